@@ -4,22 +4,46 @@
 # In[1]:
 
 
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, Response, request, jsonify, stream_with_context
+import http_client
+import metrics
 import logging
+import logging_setup
+import contextvars
+import json
 import math
-import sqlite3
+import multiprocessing
 import os
 import datetime
-import psycopg2
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from db_pool import get_pool, pool_stats
+from reference_data import ReferenceDataCache, load_reference_snapshot
+from pincode_cache import PincodeCache, PincodeInfo, normalize_pincode
+import circuit_breaker
+from pvwatts_cache import PVWattsCache, PVWattsHourlyCache, PVWATTS_PARAMS, HOURS_PER_YEAR
+from solar_grid import open_grid
+from outbound_queue import create_outbound_queue
+from session_store import create_session_store, new_session, SessionConflict
+from message_dedup import HANDLED_KEY, RecentResponses, recall_from_session, remember_in_session
+from conversation_executor import create_conversation_executor, BacklogFull
+from tariff_index import TariffIndex
+from quote_engine import evaluate_system_sizes, candidate_sizes, format_option, SQ_FT_PER_KW
+from quote_cache import QuoteCache, normalize_bill
+from hourly_simulation import SIMULATION_MODE, BANKING, evaluate_system_sizes_hourly
+import system_optimizer
+from batch_quote import quote_leads, read_leads, detect_format, stream_request_body, get_process_pool
+from warmup import Warmup, WARMUP_ON_IMPORT, warm_reference_data, load_bundled_pincodes, release_db_connections
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Queue-based, optionally JSON logging with per-conversation trace ids (see logging_setup.py)
+logging_setup.configure_logging()
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
 print("Environment:", os.getenv("FLASK_ENV"))
 
@@ -37,37 +61,61 @@ def index():
 
 @app.route('/health')
 def health_check():
+    # Not ready until the boot-time warm-up has finished (retried here if it failed in the master)
+    if not warmup.run():
+        return jsonify({"status": "warming up", "warmup": warmup.status()}), 503
     return "Healthy", 200
 
-def connect_db():
-    #return sqlite3.connect('solar.db')
-
-    database_url = os.getenv('DATABASE_URL')
-    
-    if 'sqlite' in database_url:
-        # SQLite connection
-        conn = sqlite3.connect(database_url.replace('sqlite:///', ''))
-        return conn
-    else:
-        # For production (PostgreSQL, MySQL, etc.), use SQLAlchemy or appropriate driver
-        engine = create_engine(database_url)
-        return engine.connect()
+@app.route('/stats')
+def stats():
+    # Per-worker counters for the connection pool, caches and outbound queue
+    snapshot = reference_data.get()
+    return jsonify({
+        "pid": os.getpid(),
+        "warmup": warmup.status(),
+        "db_pool": pool_stats(),
+        "reference_data_version": snapshot.version,
+        "pincode_cache": pincode_cache.stats(),
+        "pvwatts_cache": pvwatts_cache.stats(),
+        "pvwatts_hourly_cache": pvwatts_hourly_cache.stats(),
+        "solar_grid": solar_grid.stats() if solar_grid is not None else None,
+        "outbound_queue": outbound_queue.stats(),
+        "recent_responses": recent_responses.stats(),
+        "conversation_executor": conversation_executor.stats(),
+        "quote_cache": quote_cache.stats(),
+        "http": http_client.stats(),
+        "circuit_breakers": circuit_breaker.stats(),
+    }), 200
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus exposition format, aggregated across gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 def connect_db():
-    # Get database URL from environment
-    database_url = os.getenv('DATABASE_URL')
-    
-    if 'sqlite' in database_url:
-        # SQLite connection using sqlite3
-        conn = sqlite3.connect(database_url.replace('sqlite:///', ''))
-        return conn
-    elif 'postgresql' in database_url:
-        # PostgreSQL connection using psycopg2 directly (if DATABASE_URL is in psycopg2 format)
-        return psycopg2.connect(database_url)
-    else:
-        # For other databases, fallback to SQLAlchemy engine
-        engine = create_engine(database_url)
-        return engine.connect()  # SQLAlchemy connection object (no cursor)
+    # Check out a connection from the per-worker pool (sqlite or postgresql, see db_pool.py).
+    # conn.close() returns the connection to the pool rather than closing it.
+    return get_pool(app.config['DATABASE_URL']).connection()
+
+def is_admin_request(require_token=False):
+    # Admin routes require the X-Admin-Token header when ADMIN_TOKEN is set; with require_token
+    # the route is refused altogether while no ADMIN_TOKEN is configured
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token:
+        return not require_token
+    return request.headers.get('X-Admin-Token') == admin_token
+
+# Tariffs, multipliers and installation costs are loaded once and refreshed on a TTL (see reference_data.py)
+reference_data = ReferenceDataCache(lambda: load_reference_snapshot(connect_db))
+
+@app.route('/admin/reload-reference-data', methods=['POST'])
+def reload_reference_data():
+    # Only reloads the worker that serves the request; other workers pick up changes on their TTL
+    if not is_admin_request():
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    snapshot = reference_data.reload()
+    return jsonify({"status": "success", "version": snapshot.version}), 200
 
 # API Keys for OpenWeather and NREL
 # Sample OpenWeather API hit: https://api.openweathermap.org/geo/1.0/zip?zip=302018,IN&appid=b85b4f3bc72115fd17559cfd0f4a89a4
@@ -81,82 +129,270 @@ GUPSHUP_API_KEY = '2dvow1vgfzmtyyoekitrmeu0vtco0m4a'  # Replace with your actual
 # Internal Error Codes 
 # Error Code 10001: Could not fetch solar potential from NREL
 # Error Code 10002: Incorrect PINCODE entered
+# Error Code 10004: Step-1 location lookups did not finish within STEP1_DEADLINE_SECONDS
+# Failed or circuit-broken lookups fall back to the last known good data where there is some (see circuit_breaker.py)
 
-# Temporary in-memory store for user data and conversation state
-user_data = {}
+# Conversation state per phone number, shared across workers (see session_store.py)
+session_store = create_session_store(connect_db)
+SESSION_SAVE_ATTEMPTS = 3
 
-# Function to get state from pincode using PostPincode API
-def get_state_from_pincode(pincode):
-    url = f"https://api.postalpincode.in/pincode/{pincode}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
+# Responses to recently handled Gupshup message ids, replayed to redeliveries (see message_dedup.py)
+recent_responses = RecentResponses()
+
+# User messages run one at a time per phone number, in arrival order (see conversation_executor.py)
+conversation_executor = create_conversation_executor()
+BACKLOG_FULL_RESPONSE = {"status": "error", "message": "Too many messages in flight, please retry"}
+
+# The URL builders and parse_* helpers are shared with the non-blocking clients in asgi_app.py
+def state_lookup_url(pincode):
+    return f"https://api.postalpincode.in/pincode/{pincode}"
+
+def parse_state_response(status_code, data):
+    if status_code == 200:
         if data[0]['Status'] == 'Success':
             state = data[0]['PostOffice'][0]['State']
-            app.logger.debug(f"User State received : {data[0]['Status']}, {data[0]['PostOffice'][0]['State']}") 
+            app.logger.debug("User State received : %s, %s", data[0]['Status'], data[0]['PostOffice'][0]['State']) 
             return state
         else:
             return "Unknown in get_state_from_pincode"  # If pincode is not valid
     else:
         return "Error in get_state_from_pincode"  # Handle request failure
 
-# Function to get lat/lon from pincode using OpenWeather API
-def get_lat_lon_from_pincode(pincode):
-    geo_url = f"https://api.openweathermap.org/geo/1.0/zip?zip={pincode},IN&appid={OPENWEATHER_API_KEY}"
-    response = requests.get(geo_url)
-    data = response.json()
-    if response.status_code == 200 and data:
+# Function to get state from pincode using PostPincode API
+def get_state_from_pincode(pincode):
+    try:
+        return http_client.get_json(state_lookup_url(pincode), parse_state_response)
+    except http_client.DEPENDENCY_ERRORS as e:
+        app.logger.warning("State lookup failed: %s", e)
+        return "Error in get_state_from_pincode"
+
+def lat_lon_lookup_url(pincode):
+    return f"https://api.openweathermap.org/geo/1.0/zip?zip={pincode},IN&appid={OPENWEATHER_API_KEY}"
+
+def parse_lat_lon_response(status_code, data):
+    if status_code == 200 and data:
         return data['lat'], data['lon']
     else:
         return None, None
 
+# Function to get lat/lon from pincode using OpenWeather API
+def get_lat_lon_from_pincode(pincode):
+    try:
+        return http_client.get_json(lat_lon_lookup_url(pincode), parse_lat_lon_response)
+    except http_client.DEPENDENCY_ERRORS as e:
+        app.logger.warning("Geocoding failed: %s", e)
+        return None, None
+
+# Resolved pincodes are cached in memory and in the pincode_cache table (see pincode_cache.py)
+pincode_cache = PincodeCache(connect_db)
+
+# Step-1 lookups run concurrently on this pool and must all finish within the deadline
+lookup_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LOOKUP_THREADS', '8')), thread_name_prefix='lookup')
+STEP1_DEADLINE_SECONDS = float(os.getenv('STEP1_DEADLINE_SECONDS', '15'))
+
+class StepDeadlineExceeded(Exception):
+    pass
+
+class PincodeLookupUnavailable(Exception):
+    pass
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
+
+def _submit_lookup(func, *args):
+    # Run on the lookup pool in a copy of this context, so the HTTP calls see the step deadline
+    return lookup_executor.submit(contextvars.copy_context().run, func, *args)
+
+def remember_pincode(pincode, lat, lon, state):
+    """
+    Cache the result of the remote pincode lookups and return (lat, lon, state) to use.
+    
+    Returns (None, None, None) if the pincode is invalid. Raises PincodeLookupUnavailable if a
+    lookup failed and the pincode cannot be resolved until the vendor recovers.
+    """
+    if state == "Unknown in get_state_from_pincode":
+        # The postal API is the authority on whether a pincode exists, so remember the negative result
+        pincode_cache.put(PincodeInfo(pincode, None, None, None, False))
+        return None, None, None
+    if state == "Error in get_state_from_pincode":
+        # Without the postal API a mistyped pincode cannot be told from a real one, so do not guess
+        raise PincodeLookupUnavailable(f"State lookup for {pincode} failed")
+    if lat is None or lon is None:
+        # The pincode exists but geocoding failed: do not cache. Borrow the coordinates of the
+        # closest pincode we know in the same state so a vendor outage does not stop the quote.
+        nearest = pincode_cache.nearest_known(pincode, state=state)
+        if nearest is None:
+            raise PincodeLookupUnavailable(f"Geocoding {pincode} failed and no nearby pincode is known")
+        app.logger.warning("Geocoding %s failed, using coordinates of nearby pincode %s", pincode, nearest.pincode)
+        metrics.STALE_FALLBACKS.labels(kind='pincode').inc()
+        return nearest.lat, nearest.lon, state
+
+    pincode_cache.put(PincodeInfo(pincode, lat, lon, state, True))
+    return lat, lon, state
+
+def resolve_pincode(pincode):
+    """
+    Resolve a pincode to (lat, lon, state) without the NREL lookup (used by batch_quote.py).
+    
+    Returns (None, None, None) for malformed or unknown pincodes and raises
+    PincodeLookupUnavailable for ones that cannot be resolved right now.
+    """
+    pincode = normalize_pincode(pincode)
+    if pincode is None:
+        return None, None, None
+
+    info = pincode_cache.get(pincode)
+    if info is not None:
+        if not info.is_valid:
+            return None, None, None
+        return info.lat, info.lon, info.state
+
+    geo_future = lookup_executor.submit(get_lat_lon_from_pincode, pincode)
+    state = get_state_from_pincode(pincode)
+    lat, lon = geo_future.result()
+    return remember_pincode(pincode, lat, lon, state)
+
+def resolve_location(pincode, timeout=STEP1_DEADLINE_SECONDS):
+    """
+    Resolve a pincode to (lat, lon, state, ac_monthly, solrad_annual) for step 1.
+    
+    On a pincode cache miss the geocode and state lookups run concurrently, and the NREL
+    call starts as soon as coordinates arrive, so the step takes roughly as long as the
+    slowest call rather than the sum. lat/lon/state are None for an invalid pincode and
+    ac_monthly/solrad_annual are None if NREL failed. Failed geocoding falls back to a nearby
+    cached pincode in the same state and a failed NREL call to an expired PVWatts profile.
+    
+    Raises PincodeLookupUnavailable if the postal lookup failed (see remember_pincode()) and
+    StepDeadlineExceeded if the lookups do not finish within timeout seconds. The HTTP
+    calls' timeouts are capped to the same deadline, so none outlives it by more than a moment.
+    """
+    deadline = time.monotonic() + timeout
+    pincode = normalize_pincode(pincode)
+    if pincode is None:
+        return None, None, None, None, None
+
+    try:
+        with http_client.deadline(timeout):
+            info = pincode_cache.get(pincode)
+            if info is not None:
+                if not info.is_valid:
+                    return None, None, None, None, None
+                lat, lon, state = info.lat, info.lon, info.state
+                solar_future = _submit_lookup(get_solar_generation, lat, lon)
+            else:
+                geo_future = _submit_lookup(get_lat_lon_from_pincode, pincode)
+                state_future = _submit_lookup(get_state_from_pincode, pincode)
+
+                lat, lon = geo_future.result(timeout=_remaining(deadline))
+                solar_future = _submit_lookup(get_solar_generation, lat, lon) if lat is not None and lon is not None else None
+
+                lat, lon, state = remember_pincode(pincode, lat, lon, state_future.result(timeout=_remaining(deadline)))
+                if lat is None:
+                    return None, None, None, None, None
+                if solar_future is None:
+                    # Geocoding failed and the coordinates came from a nearby pincode
+                    solar_future = _submit_lookup(get_solar_generation, lat, lon)
+
+            ac_monthly, solrad_annual = solar_future.result(timeout=_remaining(deadline))
+    except FutureTimeoutError:
+        raise StepDeadlineExceeded(f"Location lookups for {pincode} did not finish within {timeout}s")
+
+    return lat, lon, state, ac_monthly, solrad_annual
+
 def get_tariff_for_state(state):
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    # Query for tariffs for the given state
-    query = "SELECT min_slab, max_slab, fixed, variable, max_bill FROM tariffs WHERE state = %s"
-    cursor.execute(query, (state,))
-    
-    tariffs = cursor.fetchall()
-    conn.close()
-
-    if not tariffs:  # If no data for the given state, use Rajasthan's tariffs
-        app.logger.debug(f"No tariffs found for {state}. Using Rajasthan's tariffs as default.")
-        state = "Rajasthan"  # Default state to Rajasthan
-        conn = connect_db()
-        cursor = conn.cursor()
-        query = "SELECT min_slab, max_slab, fixed, variable, max_bill FROM tariffs WHERE state = %s"
-        cursor.execute(query, (state,))
-        tariffs = cursor.fetchall()
-        conn.close()
-
-    # Convert the fetched data to the required format
-    result = []
-    for row in tariffs:
-        result.append({
-            'min_slab': int(row[0]),
-            'max_slab': int(row[1]),
-            'fixed': float(row[2]),
-            'variable': float(row[3]),
-            'max_bill': float(row[4]) if row[4] is not None else None
-        })
-    
-    return result
+    # Served from the in-memory reference data snapshot; falls back to Rajasthan's tariffs
+    return reference_data.tariffs_for_state(state)
+
+def get_tariff_index_for_state(state):
+    # Compiled form of get_tariff_for_state() for O(log n) bill <-> units lookups (see tariff_index.py)
+    return reference_data.tariff_index_for_state(state)
+
+
+# Per-kW PVWatts profiles are cached per 0.1° grid cell (see pvwatts_cache.py)
+pvwatts_cache = PVWattsCache(connect_db)
+# Hourly per-kW output for QUOTE_SIMULATION=hourly, on the same grid (see hourly_simulation.py)
+pvwatts_hourly_cache = PVWattsHourlyCache(connect_db)
 
+# Offline per-kW profiles built by solar_grid.py, memory-mapped and shared by all workers (None if not built)
+solar_grid = open_grid(os.getenv('SOLAR_GRID_PATH', 'solar_grid.bin'), pvwatts_cache.grid_step)
 
 # Using NREL API to get solar generation for every month
-def get_solar_generation(lat, lon, system_capacity=1):
-    nrel_url = f"https://developer.nrel.gov/api/pvwatts/v6.json?api_key={NREL_API_KEY}&lat={lat}&lon={lon}&system_capacity={system_capacity}&module_type=1&losses=10&array_type=1&tilt=20&azimuth=180"
-    response = requests.get(nrel_url)
+def nrel_pvwatts_url(lat, lon, timeframe=None):
+    params = '&'.join(f"{name}={value}" for name, value in PVWATTS_PARAMS.items())
+    if timeframe is not None:
+        params += f"&timeframe={timeframe}"
+    return f"https://developer.nrel.gov/api/pvwatts/v6.json?api_key={NREL_API_KEY}&lat={lat}&lon={lon}&{params}"
+
+def parse_nrel_response(status_code, data):
     # Example response: { 'ac_monthly': [545, 600, 700, ...]
-    data = response.json()
-    if response.status_code == 200 and 'outputs' in data:
+    if status_code == 200 and 'outputs' in data:
         return data['outputs']['ac_monthly'], data['outputs']['solrad_annual']
     else:
         return None, None
 
+def parse_nrel_hourly_response(status_code, data):
+    # outputs.ac holds the AC output in Wh for each of the 8760 hours; returned in kWh
+    if status_code == 200 and 'outputs' in data and len(data['outputs'].get('ac', ())) == HOURS_PER_YEAR:
+        return [wh / 1000 for wh in data['outputs']['ac']]
+    else:
+        return None
+
+def fetch_solar_generation_from_nrel(lat, lon):
+    try:
+        return http_client.get_json(nrel_pvwatts_url(lat, lon), parse_nrel_response)
+    except http_client.DEPENDENCY_ERRORS as e:
+        app.logger.warning("NREL lookup failed: %s", e)
+        return None, None
+
+def stale_solar_generation(lat_cell, lon_cell):
+    # NREL failed or its breaker is open: an expired profile for the cell beats no quote
+    cached = pvwatts_cache.get(lat_cell, lon_cell, allow_stale=True)
+    if cached is not None:
+        app.logger.warning("Serving an expired PVWatts profile for %s, %s", lat_cell, lon_cell)
+        metrics.STALE_FALLBACKS.labels(kind='pvwatts').inc()
+    return cached
+
+def get_solar_generation(lat, lon, system_capacity=1):
+    # ac_monthly only depends on location, so nearby coordinates share the cached profile of their grid cell.
+    # The precomputed grid is consulted first; only cells it does not cover go to the cache and NREL.
+    lat_cell, lon_cell = pvwatts_cache.cell(lat, lon)
+    cached = solar_grid.lookup(lat_cell, lon_cell) if solar_grid is not None else None
+    if cached is None:
+        cached = pvwatts_cache.get(lat_cell, lon_cell)
+    if cached is not None:
+        ac_monthly, solrad_annual = cached
+    else:
+        ac_monthly, solrad_annual = fetch_solar_generation_from_nrel(lat_cell, lon_cell)
+        if ac_monthly is None or solrad_annual is None:
+            cached = stale_solar_generation(lat_cell, lon_cell)
+            if cached is None:
+                return None, None
+            ac_monthly, solrad_annual = cached
+        else:
+            pvwatts_cache.put(lat_cell, lon_cell, ac_monthly, solrad_annual)
+
+    # Generation scales linearly with installed capacity
+    if system_capacity != 1:
+        ac_monthly = [generation * system_capacity for generation in ac_monthly]
+    return ac_monthly, solrad_annual
+
+def get_hourly_generation(lat_cell, lon_cell):
+    """Hourly AC output per kW (8760 kWh values) for a grid cell, or None if NREL has none for it."""
+    ac_hourly = pvwatts_hourly_cache.get(lat_cell, lon_cell)
+    if ac_hourly is not None:
+        return ac_hourly
+    try:
+        ac_hourly = http_client.get_json(nrel_pvwatts_url(lat_cell, lon_cell, timeframe='hourly'), parse_nrel_hourly_response)
+    except http_client.DEPENDENCY_ERRORS as e:
+        app.logger.warning("NREL hourly lookup failed: %s", e)
+    if ac_hourly is None:
+        ac_hourly = pvwatts_hourly_cache.get(lat_cell, lon_cell, allow_stale=True)
+        if ac_hourly is not None:
+            metrics.STALE_FALLBACKS.labels(kind='pvwatts_hourly').inc()
+        return ac_hourly
+    pvwatts_hourly_cache.put(lat_cell, lon_cell, ac_hourly)
+    return pvwatts_hourly_cache.get(lat_cell, lon_cell)
+
 #def estimate_energy_consumption(bill_amount):
  #   avg_rate_per_kwh = 6  # Assuming an average rate of ₹6 per kWh
   #  return bill_amount / avg_rate_per_kwh
@@ -201,37 +437,144 @@ def get_location_tier_from_pincode(pincode):
     return location_tier
 
 # Helper function to calculate cost and subsidy
-def calculate_cost_and_subsidy(system_size, location_tier):
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    # Query for tariffs for the given state
-    query = "SELECT overall_cost FROM installation_costs WHERE location_tier = %s AND system_capacity_kW = %s"
-    cursor.execute(query, (location_tier,system_size))
+def calculate_cost_and_subsidy(system_size, location_tier, interpolate=False):
+    overall_cost = reference_data.installation_cost(location_tier, system_size)
     
-    overall_cost_queried = cursor.fetchone()
-    conn.close()
-    
-    if overall_cost_queried is None:  # If no data for the given location & system size, use max cost
-        app.logger.debug(f"MISSING DATA: No cost found for {location_tier} and {system_size}kW. Using Max Cost as default.")
-        #overall_cost_queried[0] = 1000000
-        overall_cost = 1000000  # Set to default value
-    else:
-        overall_cost = overall_cost_queried[0]
-        app.logger.debug(f"Final overall cost received for {location_tier} and {system_size}kW is {overall_cost}.")
-
-    # Government subsidy logic
-    if system_size >= 3:
-        subsidy = 78000
-    elif system_size == 2:
-        subsidy = 60000
+    if overall_cost is None:
+        # With interpolate (the optimizer's half-kW sizes) sizes between or beyond table rows are
+        # priced on the tier's cost curve; classic sizing keeps the max cost for missing rows
+        cost_curve = reference_data.cost_curve_for_tier(location_tier) if interpolate else None
+        if cost_curve:
+            overall_cost = cost_curve.overall_cost(system_size)
+            app.logger.debug("Interpolated overall cost for %s and %skW is %s.", location_tier, system_size, overall_cost)
+        else:  # If no data for the given location at all, use max cost
+            app.logger.debug("MISSING DATA: No cost found for %s and %skW. Using Max Cost as default.", location_tier, system_size)
+            overall_cost = 1000000  # Set to default value
     else:
-        subsidy = 30000
+        app.logger.debug("Final overall cost received for %s and %skW is %s.", location_tier, system_size, overall_cost)
+
+    # Government subsidy: 30,000 per kW up to 2 kW plus 18,000 per kW up to 3 kW (78,000 at most)
+    subsidy = system_optimizer.subsidy_for_size(system_size)
     
     final_cost = overall_cost - subsidy
 
     return final_cost
 
+# 'classic' offers floor(size) and its neighbours; 'optimizer' searches half-kW sizes around them
+SYSTEM_SIZING = os.getenv('SYSTEM_SIZING', 'classic')
+# Smallest rooftop that holds the smallest system offered (1 kW)
+MIN_ROOFTOP_AREA = SQ_FT_PER_KW * (system_optimizer.MIN_SIZE_KW if SYSTEM_SIZING == 'optimizer' else 1)
+
+def build_quote(monthly_consumption, ac_monthly, rooftop_area, state, pincode, ac_hourly=None, num_acs=0):
+    """
+    Size the system and evaluate the options offered to the user (shared by step 3 and batch_quote.py).
+    
+    With ac_hourly (8760 per-kW values) the options are evaluated by the hourly net-metering
+    simulation in hourly_simulation.py, using num_acs to shape the load profile.
+    
+    With SYSTEM_SIZING=classic (the default) the energy-based size is floored and size-1, size and
+    size+1 are offered; with 'optimizer' sizes within OPTIMIZER_BAND_KW of that size are searched
+    in half-kW steps and priced on the interpolated cost curve (see system_optimizer.py).
+    
+    Returns:
+    (int or float, list, int): Recommended system size in kW, the options table in the
+    quote_engine.evaluate_system_sizes format and the index of the recommended option.
+    
+    Raises:
+    ValueError: If the rooftop is smaller than MIN_ROOFTOP_AREA.
+    """
+    if rooftop_area < MIN_ROOFTOP_AREA:
+        raise ValueError(f"Rooftop area must be at least {MIN_ROOFTOP_AREA:g} sq ft")
+    state_tariffs = get_tariff_index_for_state(state)
+    location_tier = get_location_tier_from_pincode(pincode)
+    app.logger.debug("Location Tier received: %s", location_tier)      
+
+    final_cost_for_size = lambda system_size: calculate_cost_and_subsidy(
+        system_size, location_tier, interpolate=SYSTEM_SIZING == 'optimizer')
+    def evaluate(system_sizes):
+        # One vectorized pass over all sizes
+        if ac_hourly is not None:
+            return evaluate_system_sizes_hourly(
+                system_sizes, monthly_consumption, ac_hourly, num_acs, state_tariffs, final_cost_for_size, rooftop_area)
+        return evaluate_system_sizes(
+            system_sizes, monthly_consumption, ac_monthly, state_tariffs, final_cost_for_size, rooftop_area)
+
+    system_size = calculate_system_size(monthly_consumption, rooftop_area, ac_monthly)
+    if SYSTEM_SIZING == 'optimizer':
+        return system_optimizer.optimize(evaluate, rooftop_area, system_size)
+
+    # Evaluate size-1, size and size+1 (or 1, 2 and 3 kW for small systems)
+    recommended_system_size = math.floor(system_size)
+    options, best_index = evaluate(candidate_sizes(recommended_system_size))
+    return recommended_system_size, options, best_index
+
+def quote_note(monthly_consumption, ac_monthly, rooftop_area):
+    """Message to send with the options when the optimizer capped the size at MAX_SYSTEM_SIZE_KW, else None."""
+    if SYSTEM_SIZING != 'optimizer':
+        return None
+    return system_optimizer.size_cap_note(calculate_system_size(monthly_consumption, rooftop_area, ac_monthly))
+
+# Step-3 quotes memoized on normalized inputs and the reference data version (see quote_cache.py)
+quote_cache = QuoteCache()
+# Budget for fetching the hourly series in step 3 when the step-1 prefetch did not cache it
+HOURLY_FETCH_DEADLINE_SECONDS = float(os.getenv('HOURLY_FETCH_DEADLINE_SECONDS', '5'))
+
+def _log_prefetch_failure(future):
+    # Nothing waits for a prefetch, so report its errors here instead of losing them
+    if not future.cancelled() and future.exception() is not None:
+        app.logger.warning("Hourly generation prefetch failed: %s", future.exception())
+
+def hourly_generation_for_quote(grid_cell):
+    """
+    The cell's hourly series for step 3, or None to quote with the monthly evaluation.
+    
+    A cache miss fetches from NREL within HOURLY_FETCH_DEADLINE_SECONDS; if that fails or runs out
+    of time the quote falls back to the monthly evaluation rather than keep the user waiting.
+    """
+    try:
+        with http_client.deadline(HOURLY_FETCH_DEADLINE_SECONDS):
+            return get_hourly_generation(*grid_cell)
+    except Exception as e:
+        app.logger.warning("Hourly generation unavailable, quoting monthly: %s", e)
+        return None
+
+def quote_for_conversation(user_state):
+    """
+    Step-3 quote for a conversation, from quote_cache when the same normalized inputs were quoted before.
+    
+    The quote is computed from the step-2 consumption, by the hourly simulation if
+    QUOTE_SIMULATION=hourly and the cell's hourly output is available. Only when QUOTE_BILL_ROUNDING
+    changes the bill is it computed from the rounded bill instead (see quote_cache.py). Sessions started
+    before the grid cell was recorded in step 1 are quoted monthly from their exact inputs without the cache.
+    
+    Returns:
+    (int, list, int): As build_quote().
+    """
+    if 'grid_cell' not in user_state:
+        return build_quote(user_state['monthly_consumption'], user_state['ac_monthly'], user_state['rooftop_area'],
+                           user_state['state'], user_state['pincode'])
+
+    state = user_state['state']
+    recent_bill = normalize_bill(user_state['recent_bill'])
+    location_tier = get_location_tier_from_pincode(user_state['pincode'])
+    ac_hourly = hourly_generation_for_quote(user_state['grid_cell']) if SIMULATION_MODE == 'hourly' else None
+    simulation = f"hourly:{BANKING}" if ac_hourly is not None else 'monthly'
+    key = (state, tuple(user_state['grid_cell']), user_state['recent_bill_month'], recent_bill,
+           user_state['num_acs'], user_state['rooftop_area'], location_tier, simulation, SYSTEM_SIZING)
+
+    def compute():
+        if recent_bill == user_state['recent_bill']:
+            monthly_consumption = user_state['monthly_consumption']
+        else:
+            monthly_bills = calculate_monthly_bills_for_year(recent_bill, user_state['num_acs'], user_state['recent_bill_month'], state)
+            monthly_consumption = calculate_monthly_consumption(monthly_bills, get_tariff_index_for_state(state))
+        return build_quote(monthly_consumption, user_state['ac_monthly'], user_state['rooftop_area'], state,
+                           user_state['pincode'], ac_hourly, user_state['num_acs'])
+
+    recommended_system_size, options, best_index = quote_cache.get_or_compute(key, reference_data.get().version, compute)
+    # The cached option dicts are shared, so hand the conversation its own copies
+    return recommended_system_size, [dict(option) for option in options], best_index
+
 # Helper function to get previous month
 def get_previous_month():
     # Get the current date
@@ -242,31 +585,12 @@ def get_previous_month():
     
     # Format the month to its first 3 letters (e.g., 'Jan', 'Feb', etc.)
     previous_month = previous_month_date.strftime("%b")  # 'Jan', 'Feb', 'Mar', etc.
-    app.logger.debug(f"Previous Month is : {previous_month}")   
+    app.logger.debug("Previous Month is : %s", previous_month)   
     return previous_month
 
 def calculate_monthly_bills_for_year(recent_bill, num_acs, current_month, state):
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    # Fetch multiplier factors for the given state
-    query = "SELECT month, multiplier FROM multipliers WHERE state = %s"
-    cursor.execute(query, (state,))
-    multipliers = cursor.fetchall()
-    conn.close()
-
-    if not multipliers:  # If no data for the given state, use Rajasthan's multipliers
-        app.logger.debug(f"No multipliers found for {state}. Using Rajasthan's multipliers as default.")
-        state = "Rajasthan"  # Default state to Rajasthan
-        conn = connect_db()
-        cursor = conn.cursor()
-        query = "SELECT month, multiplier FROM multipliers WHERE state = %s"
-        cursor.execute(query, (state,))
-        multipliers = cursor.fetchall()
-        conn.close()
-
-    # Create a dictionary for multipliers, like {'Jan': 1.1, 'Feb': 1.05, ...}
-    multipliers_dict = {month: multiplier for month, multiplier in multipliers}
+    # Multiplier factors for the given state, like {'Jan': 1.1, 'Feb': 1.05, ...} (Rajasthan's if the state has none)
+    multipliers_dict = reference_data.multipliers_for_state(state)
     
     # Find the multiplier for the current month (month of the recent bill)
     current_month_multiplier = multipliers_dict[current_month]
@@ -279,16 +603,20 @@ def calculate_monthly_bills_for_year(recent_bill, num_acs, current_month, state)
     i = 0
     for month, normalized_multiplier in normalized_multipliers.items():
         monthly_bills.append(recent_bill * float(normalized_multiplier))
-        app.logger.debug(f"Multiplication executed successfully calculate_monthly_bills_for_year")        
+        app.logger.debug("Multiplication executed successfully calculate_monthly_bills_for_year")        
         if i>1 and i<6:
             monthly_bills[i] += num_acs*3000
         i += 1
 
-    app.logger.debug(f"Monthly bills are : {monthly_bills}")   
+    app.logger.debug("Monthly bills are : %s", monthly_bills)   
     return monthly_bills
 
 # Helper function to calculate monthly consumption
 def calculate_monthly_consumption(monthly_bills, tariffs):
+    # Fast path: invert all months at once with the compiled tariff index
+    if isinstance(tariffs, TariffIndex):
+        return tariffs.units_for_bills(monthly_bills).tolist()
+
     monthly_consumption = []
     for bill in monthly_bills:
         consumption, slab_used = estimate_energy_consumption_with_max_bill(bill, tariffs)
@@ -302,7 +630,7 @@ def estimate_energy_consumption_with_max_bill(bill_amount, tariffs):
             fixed_charge = slab['fixed']
             variable_charges = bill_amount - fixed_charge
             units_consumed = variable_charges / slab['variable']
-            app.logger.debug(f"Slab used is: {slab}")    
+            app.logger.debug("Slab used is: %s", slab)    
             return int(units_consumed), slab
     return 0, None  # If no slab is found
 
@@ -312,26 +640,26 @@ def calculate_yearly_savings(monthly_savings):
 
 def calculate_monthly_savings_with_solar(monthly_consumption, monthly_generation, tariffs):
     monthly_savings = []
+    debug_enabled = app.logger.isEnabledFor(logging.DEBUG)
     i = 0
     for consumption in monthly_consumption:
         generation = int(monthly_generation[i])
         
         # Step 1: Calculate the reduced consumption (after solar generation)
         reduced_consumption = max(0, int(consumption) - generation)  # Ensure reduced consumption is not negative
-        app.logger.debug(f"Reduced consumption for Month={i} is: {reduced_consumption}") 
 
         # Step 2: Calculate the original bill based on the original consumption
         original_bill = calculate_monthly_bill(int(consumption), tariffs)
-        app.logger.debug(f"original Bill Amount for Month={i} is: {original_bill}")                   
         
         # Step 3: Calculate the reduced bill based on reduced consumption
         reduced_bill = calculate_monthly_bill(reduced_consumption, tariffs)
-        app.logger.debug(f"reduced Bill Amount for Month={i} is: {reduced_bill}")                   
        
         # Step 4: Calculate savings (original bill - reduced bill)
         savings = original_bill - reduced_bill
         monthly_savings.append(savings)
-        app.logger.debug(f"Monthly Savings for Month={i} is: {savings}")
+        if debug_enabled:
+            app.logger.debug("Month=%s reduced consumption=%s original bill=%s reduced bill=%s savings=%s",
+                             i, reduced_consumption, original_bill, reduced_bill, savings)
         i+=1              
     
     return monthly_savings
@@ -360,7 +688,8 @@ def calculate_monthly_bill(units_consumed, tariffs):
     return bill
 
 
-def send_message(message, to_number):
+def gupshup_request(message, to_number):
+    # (headers, form data) for sending a WhatsApp text through Gupshup
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
         'apikey': GUPSHUP_API_KEY
@@ -373,13 +702,165 @@ def send_message(message, to_number):
         'message': message,
         'src.name': 'QuoteGenerator'  # Replace with your app name or bot name
     }
+    return headers, payload
+
+def deliver_message(message, to_number):
+    headers, payload = gupshup_request(message, to_number)
 
     # Sending the POST request to Gupshup API
-    response = requests.post(GUPSHUP_URL, headers=headers, data=payload)
-    app.logger.debug(f"Message sent: {response.status_code}, {response.text}")    
+    response = http_client.post(GUPSHUP_URL, headers=headers, data=payload)
+    app.logger.debug("Message sent: %s, %s", response.status_code, response.text)    
     
     return response.status_code, response.text
 
+# Replies are delivered by background workers so the webhook can return to Gupshup immediately
+outbound_queue = create_outbound_queue(deliver_message)
+
+def send_message(message, to_number):
+    # Returns False if the outbound queue is full and the message was dropped
+    return outbound_queue.enqueue(message, to_number)
+
+# Result of one conversation step: the reply to send, the webhook status/HTTP code and
+# whether the conversation is over (its session then starts over from step 0)
+StepResult = namedtuple('StepResult', ['status', 'response_text', 'http_code', 'end_conversation'], defaults=[False])
+
+def handle_conversation_step(user_state, message_text, resolve=None):
+    """
+    Advance a conversation by one step.
+    
+    Parameters:
+    user_state (dict): The user's conversation state; updated in place.
+    message_text (str): The lower-cased text of the incoming message.
+    resolve (callable): Step-1 lookup of a pincode to (lat, lon, state, ac_monthly, solrad_annual),
+    resolve_location by default; the async server passes a location it resolved without blocking.
+    
+    Returns:
+    StepResult: The reply and how to answer the webhook. Sending the reply and saving
+    user_state are left to the caller, so a step can be re-run if the save conflicts.
+    """
+    user_step = user_state['step']
+
+    if user_step == 0:
+        # Send greeting and ask for pincode
+        user_state['step'] = 1
+        response_text = "Hello, I am NavyamBot. I can help you generate a cost estimate for installing rooftop solar. To begin, please enter your pincode."
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200)
+    
+    # Replace step where pincode is processed (user_step == 1)
+    elif user_step == 1:
+        # Get lat/lon and state from pincode, and the solar potential from NREL for those coordinates
+        user_state['pincode'] = message_text
+        try:
+            lat, lon, user_state['state'], ac_monthly, solrad_annual = (resolve or resolve_location)(message_text)
+        except StepDeadlineExceeded as e:
+            app.logger.error("Step 1 deadline exceeded: %s", e)
+            response_text = "[ERROR10004] We have encountered an issue. Please try again in a few minutes or contact support@navyamhomes.com and share Error Code 10004."
+            return StepResult("error", response_text, 500)
+        except PincodeLookupUnavailable as e:
+            app.logger.error("Pincode lookup unavailable: %s", e)
+            response_text = "[ERROR10005] We could not verify your pincode right now. Please try again in a few minutes or contact support@navyamhomes.com and share Error Code 10005."
+            return StepResult("error", response_text, 500)
+
+        if lat is None or lon is None or user_state['state'] is None:
+            response_text = "Invalid pincode. Please try again."
+            return StepResult("error", response_text, 400)
+
+        user_state['step'] = 1.5
+        # The PVWatts grid cell identifies the location in quote_cache keys
+        user_state['grid_cell'] = list(pvwatts_cache.cell(lat, lon))
+        if SIMULATION_MODE == 'hourly':
+            # Fetch the hourly series in the background so it is cached by step 3
+            _submit_lookup(get_hourly_generation, *user_state['grid_cell']).add_done_callback(_log_prefetch_failure)
+
+        if ac_monthly is None or solrad_annual is None:
+            response_text = "[ERROR10001] We have encountered an issue. Please contact support@navyamhomes.com and share Error Code 10001."
+            return StepResult("error", response_text, 500)
+
+        # Proceed with asking for summer bill
+        user_state['pincode'] = message_text      
+        user_state['solar_potential'] = solrad_annual
+        user_state['ac_monthly'] = ac_monthly
+        app.logger.debug("Received Monthly generation units: %s", user_state['ac_monthly'])   
+        response_text = f"Solar potential for your location is {solrad_annual:.2f} kWh/m²/day. Now, please enter your most recent electricity bill."
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200)
+
+    elif user_step == 1.5:
+        # Save the recent bill and Ask for number of ACs
+        user_state['recent_bill_month'] = get_previous_month()  # Get the previous month (based on current month)
+        user_state['recent_bill'] = float(message_text)
+
+        user_state['step'] = 2
+
+        app.logger.debug("Received Monthly Bill in step %s", user_step)   
+        response_text = f"How many ACs do you use in your house?"
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200)
+
+    elif user_step == 2:
+        # Save number of ACs and Ask for rooftop area 
+        user_state['num_acs'] = int(message_text)
+        user_state['monthly_bills'] = calculate_monthly_bills_for_year(user_state['recent_bill'], user_state['num_acs'], user_state['recent_bill_month'], user_state['state'])
+
+        # Compiled tariffs for the state, from the in-memory reference data
+        state_tariffs = get_tariff_index_for_state(user_state['state'])
+        app.logger.debug("Received Tarifs for: %s", user_state['state'])   
+
+        # Estimate energy consumption
+        user_state['monthly_consumption'] = calculate_monthly_consumption(user_state['monthly_bills'], state_tariffs)
+        app.logger.debug("calculated Monthly consumption units: %s", user_state['monthly_consumption'])   
+        user_state['step'] = 3
+        
+        response_text = f"Please enter your rooftop area (in square feet)"
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200)
+    
+    elif user_step == 3:
+        # Final step: calculate and send cost estimation
+        user_state['rooftop_area'] = int(message_text)
+        if user_state['rooftop_area'] < MIN_ROOFTOP_AREA:
+            # Too small for any system; stay on this step so the user can correct it
+            response_text = f"A rooftop solar system needs at least {MIN_ROOFTOP_AREA:g} square feet. Please enter your rooftop area (in square feet)"
+            app.logger.debug("Response: %s", response_text)
+            return StepResult("success", response_text, 200)
+        user_state['step'] = 4                
+        app.logger.debug("Received monthly consumption: %s", user_state['monthly_consumption'])                   
+        
+        # Calculate system size, cost, savings and ROI for the candidate sizes (memoized, see quote_cache.py)
+        user_state['recommended_system_size'], options, best_index = quote_for_conversation(user_state)
+        app.logger.debug("Quote options: %s", options)
+
+        user_state['quote_options'] = options
+        user_state['recommended_option'] = best_index + 1
+
+        response_text = ''.join(format_option(option_num, option) for option_num, option in enumerate(options, start=1))
+        response_text += quote_note(user_state['monthly_consumption'], user_state['ac_monthly'], user_state['rooftop_area']) or ''
+        response_text += (
+            f"Our recommendation is Option: {user_state['recommended_option']} \n"
+        )
+
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200)
+
+    else:
+        response_text = "Sorry this is all that I can do for now. For further help & support with Solar roof top installation, please contact us on support@navyamhomes.com or 8884024446"
+        app.logger.debug("Response: %s", response_text)
+        return StepResult("success", response_text, 200, True)
+
+
+@app.route('/quotes/batch', methods=['POST'])
+def batch_quotes():
+    # Body is a CSV (text/csv) or JSON lines lead list; quotes are streamed back as JSON lines (see batch_quote.py)
+    # Batches fan out NREL, DB and process-pool work, so the route stays closed without an ADMIN_TOKEN
+    if not is_admin_request(require_token=True):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    leads = read_leads(stream_request_body(request.stream), detect_format(None, request.content_type))
+    # One spawned pool per worker process, reused across requests ('spawn' avoids forking a threaded worker)
+    process_pool = get_process_pool(reference_data.get(), mp_context=multiprocessing.get_context('spawn'))
+    results = quote_leads(leads, process_pool=process_pool)
+    return Response(stream_with_context(json.dumps(result) + '\n' for result in results), mimetype='application/x-ndjson')
+
 # @app.route('/webhook', methods=['POST'])
 # def call_back_Set():
 #     #rocess the incoming data for testing purpose
@@ -388,348 +869,159 @@ def send_message(message, to_number):
 #     else:
 #         return jsonify({"status": "error"}), 400
 
-@app.route('/webhook', methods=['POST'])
-def solar_cost_estimator():
+def handle_webhook_event(incoming_data, send=None, resolve=None):
+    """
+    Handle one Gupshup webhook event.
+    
+    Parameters:
+    incoming_data (dict): The decoded webhook body.
+    send (callable): send(message, to_number) queues the reply to a user message; defaults to send_message.
+    resolve (callable): Step-1 location lookup passed to handle_conversation_step().
+    
+    Returns:
+    (dict, int): The JSON response body and HTTP status code.
+    """
+    trace_token = None
     try:
-        incoming_data = request.json
-        app.logger.debug(f"Received data: {incoming_data}")
+        # Tag this request's log records with a hash of the user's phone number
+        payload = incoming_data.get('payload', {}) if isinstance(incoming_data, dict) else {}
+        trace_token = logging_setup.set_trace(payload.get('sender', {}).get('phone') or payload.get('destination'))
+        app.logger.debug("Received data: %s", incoming_data)
         
         # Ensure incoming data is valid
         if not incoming_data:
             app.logger.error("No data received")
-            return jsonify({"status": "error", "message": "Invalid data"}), 400
+            return {"status": "error", "message": "Invalid data"}, 400
 
         #Handling different event types here
         event_type = incoming_data.get('type', None)
-        payload = incoming_data.get('payload', {})
+        metrics.WEBHOOK_EVENTS.labels(event_type=metrics.event_label(event_type)).inc()
 
         if event_type == 'message-event':
             # Handle message events like sent, delivered, read, failed, etc.
             message_type = payload.get('type', None)
             if message_type in ['sent', 'delivered', 'read', 'failed', 'enqueued']:
-                app.logger.debug(f"Message event of type {message_type}")
+                app.logger.debug("Message event of type %s", message_type)
                 # Add logic based on message status (e.g., handle failure reasons)
-                return jsonify({"status": "message-event received", "message_type": message_type}), 200
+                return {"status": "message-event received", "message_type": message_type}, 200
 
         elif event_type == 'user-event':
             # Handle user events like opted-in or opted-out
             user_event_type = payload.get('type', None)
-            app.logger.debug(f"User event of type {user_event_type}")
+            app.logger.debug("User event of type %s", user_event_type)
             if user_event_type == 'sandbox-start':
-                app.logger.debug(f"Received Gupshup Callback Set {user_event_type}")
-                return jsonify({"status": "callback set successfully", "user_event_type": user_event_type}), 200
+                app.logger.debug("Received Gupshup Callback Set %s", user_event_type)
+                return {"status": "callback set successfully", "user_event_type": user_event_type}, 200
             elif user_event_type in ['opted-in', 'opted-out']:
-                return jsonify({"status": "user-event received", "user_event_type": user_event_type}), 200
+                return {"status": "user-event received", "user_event_type": user_event_type}, 200
 
         elif event_type == 'system-event':
             # Handle system events
             app.logger.debug("System event received")
-            return jsonify({"status": "system-event received"}), 200
+            return {"status": "system-event received"}, 200
 
         elif event_type == 'billing-event':
             # Handle billing events
             app.logger.debug("Billing event received")
-            return jsonify({"status": "billing-event received"}), 200
+            return {"status": "billing-event received"}, 200
 
         elif event_type == 'message':
             # Handle incooming messages 
             app.logger.debug("Message received")
             user_phone = payload.get('sender', {}).get('phone')
-
-            if user_phone not in user_data:
-                user_data[user_phone] = {'step': 0}
-            
-            # Retrieve the current state of the user conversation
-            user_state = user_data[user_phone]
-            user_step = user_state['step']
             message_text = payload.get('payload', {}).get('text', '').lower()
-            
-            if user_step == 0:
-                # Send greeting and ask for pincode
-                user_data[user_phone]['step'] = 1
-                response_text = "Hello, I am NavyamBot. I can help you generate a cost estimate for installing rooftop solar. To begin, please enter your pincode."
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                return jsonify({"status": "success", "response": response_text}), 200
-            
-            # Replace step where pincode is processed (user_step == 1)
-            elif user_step == 1:
-                # Get lat/lon from pincode
-                user_data[user_phone]['pincode'] = message_text
-                lat, lon = get_lat_lon_from_pincode(message_text)
-                user_data[user_phone]['state'] = get_state_from_pincode(message_text)
-                if lat is None or lon is None or user_data[user_phone]['state'] is None:
-                    response_text = "Invalid pincode. Please try again."
-                    send_message(response_text, user_phone)
-                    return jsonify({"status": "error", "response": response_text}), 400
-
-                user_data[user_phone]['step'] = 1.5
-
-                # Fetch solar potential from NREL using lat/lon
-                ac_monthly, solrad_annual = get_solar_generation(lat, lon)
-                if ac_monthly is None or solrad_annual is None:
-                    response_text = "[ERROR10001] We have encountered an issue. Please contact support@navyamhomes.com and share Error Code 10001."
-                    send_message(response_text, user_phone)
-                    return jsonify({"status": "error", "response": response_text}), 500
-
-                # Proceed with asking for summer bill
-                user_data[user_phone]['pincode'] = message_text      
-                user_data[user_phone]['solar_potential'] = solrad_annual
-                user_data[user_phone]['ac_monthly'] = ac_monthly
-                app.logger.debug(f"Received Monthly generation units: {user_data[user_phone]['ac_monthly']}")   
-                response_text = f"Solar potential for your location is {solrad_annual:.2f} kWh/m²/day. Now, please enter your most recent electricity bill."
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                return jsonify({"status": "success", "response": response_text}), 200
-
-            elif user_step == 1.5:
-                # Save the recent bill and Ask for number of ACs
-                user_data[user_phone]['recent_bill_month'] = get_previous_month()  # Get the previous month (based on current month)
-                user_data[user_phone]['recent_bill'] = float(message_text)
-
-                user_data[user_phone]['step'] = 2
-
-                app.logger.debug(f"Received Monthly Bill in step {user_step}")   
-                response_text = f"How many ACs do you use in your house?"
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                return jsonify({"status": "success", "response": response_text}), 200                          
-
-            elif user_step == 2:
-                # Save number of ACs and Ask for rooftop area 
-                user_data[user_phone]['num_acs'] = int(message_text)
-                user_data[user_phone]['monthly_bills'] = calculate_monthly_bills_for_year(user_data[user_phone]['recent_bill'], user_data[user_phone]['num_acs'], user_data[user_phone]['recent_bill_month'], user_data[user_phone]['state'])
-
-                # Load tariff data from SQLite
-                state_tariffs = get_tariff_for_state(user_data[user_phone]['state'])
-                app.logger.debug(f"Received Tarifs for: {user_data[user_phone]['state']}")   
-
-                # Estimate energy consumption
-                user_data[user_phone]['monthly_consumption'] = calculate_monthly_consumption(user_data[user_phone]['monthly_bills'], state_tariffs)
-                app.logger.debug(f"calculated Monthly consumption units: {user_data[user_phone]['monthly_consumption']}")   
-                user_data[user_phone]['step'] = 3
-                
-                response_text = f"Please enter your rooftop area (in square feet)"
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                return jsonify({"status": "success", "response": response_text}), 200
-            
-            elif user_step == 3:
-                # Final step: calculate and send cost estimation
-                user_data[user_phone]['rooftop_area'] = int(message_text)
-                user_data[user_phone]['step'] = 4                
-                #bill_amount = user_data[user_phone]['recent_bill']
-                rooftop_area = user_data[user_phone]['rooftop_area']
-                monthly_ac_generation_per_kW = user_data[user_phone]['ac_monthly']
-                monthly_energy_consumption = user_data[user_phone]['monthly_consumption']
-                app.logger.debug(f"Received monthly consumption: {user_data[user_phone]['monthly_consumption'] }")                   
-                
-                # Estimate energy consumption
-                # energy_consumption = estimate_energy_consumption(bill_amount)
-                
-                # Calculate system size and cost, get state tariffs and location tier to calculate savings
-                user_data[user_phone]['recommended_system_size'] = math.floor(calculate_system_size(monthly_energy_consumption, rooftop_area, monthly_ac_generation_per_kW))
-                state_tariffs = get_tariff_for_state(user_data[user_phone]['state'])
-                app.logger.debug(f"Received Tariffs to calculate savings: {state_tariffs}")
-                location_tier = get_location_tier_from_pincode(user_data[user_phone]['pincode'])
-                app.logger.debug(f"Location Tier received: {location_tier}")      
-
-                option_num = 1      
-                sq_ft_per_kw = 120  # 1 kW requires 120 sq ft of area
-
-                # calculate generation for recommended system size - 1
-                if (user_data[user_phone]['recommended_system_size'] - 1 > 0):
-                    user_data[user_phone]['monthly_ac_generation_minus_1'] = []
-                    for generation_per_month in monthly_ac_generation_per_kW:
-                        user_data[user_phone]['monthly_ac_generation_minus_1'].append(generation_per_month*(user_data[user_phone]['recommended_system_size']-1))
-                    app.logger.debug(f"Received monthly ac generation _minus_1 : {user_data[user_phone]['monthly_ac_generation_minus_1'] }")                   
-
-                    # Calculate monthly savings
-                    user_data[user_phone]['monthly_savings_minus_1'] = calculate_monthly_savings_with_solar(monthly_energy_consumption, user_data[user_phone]['monthly_ac_generation_minus_1'], state_tariffs)
-                    app.logger.debug(f"Received Monthly savings _minus_1: {user_data[user_phone]['monthly_savings_minus_1']}")                   
-                    user_data[user_phone]['yearly_savings_minus_1'] = calculate_yearly_savings(user_data[user_phone]['monthly_savings_minus_1'])
-                    app.logger.debug(f"Received Yearly savings _minus_1: {user_data[user_phone]['yearly_savings_minus_1']}")                   
-
-                    # calculating overall cost, subsidy from location tier
-                    recommended_final_cost_minus_1 = calculate_cost_and_subsidy((user_data[user_phone]['recommended_system_size']-1), location_tier)
-                    app.logger.debug(f"Recommended final cost _minus_1 is : {recommended_final_cost_minus_1}")                   
-                    
-                    # Round estimated costs up to the nearest lakhs with two decimal places
-                    final_cost_lakhs_minus_1 = round(recommended_final_cost_minus_1 / 100000, 1)
-                    app.logger.debug(f"Step 1 completed")                   
-
-                    final_saving_thousands_minus_1 = round(user_data[user_phone]['yearly_savings_minus_1'] / 1000, 1)
-                    app.logger.debug(f"Step 2 completed")                   
-
-                    #ROI
-                    user_data[user_phone]['roi_minus_1'] = round((user_data[user_phone]['yearly_savings_minus_1'] / float(recommended_final_cost_minus_1))*100,1)
-                    app.logger.debug(f"Step 3 completed")                   
-
-                    #Terrace Coverage
-                    user_data[user_phone]['terrace_coverage_minus_1'] = round(((user_data[user_phone]['recommended_system_size']-1) * sq_ft_per_kw)/( user_data[user_phone]['rooftop_area'])*100,1)
-                    app.logger.debug(f"Step 4 completed")                   
-
-                    response_text = (
-                        f"Option : {option_num}\n"
-                        f"System size: {(user_data[user_phone]['recommended_system_size']-1)} kW\n"
-                        f"Estimated cost: Around ₹{final_cost_lakhs_minus_1} Lakhs after subsidy.\n"
-                        f"Terrace Coverage: Around {user_data[user_phone]['terrace_coverage_minus_1']}%.\n"
-                        f"Estimated yearly savings: ₹{final_saving_thousands_minus_1} Thousand.\n"
-                        f"Estimated ROI: {user_data[user_phone]['roi_minus_1']}% every year.\n\n"
-                    )
-
-                    option_num += 1
-                    app.logger.debug(f"Exited _minus_1 calcultion with option_num: {option_num}")
-
-                # calculate generation for recommended system size
-                user_data[user_phone]['monthly_ac_generation'] = []
-                for generation_per_month in monthly_ac_generation_per_kW:
-                    user_data[user_phone]['monthly_ac_generation'].append(generation_per_month*user_data[user_phone]['recommended_system_size'])
-                app.logger.debug(f"Received monthly ac generation: {user_data[user_phone]['monthly_ac_generation'] }")                   
-
-                # Calculate monthly savings                 
-                user_data[user_phone]['monthly_savings'] = calculate_monthly_savings_with_solar(monthly_energy_consumption, user_data[user_phone]['monthly_ac_generation'], state_tariffs)
-                app.logger.debug(f"Received Monthly savings: {user_data[user_phone]['monthly_savings']}")                   
-                user_data[user_phone]['yearly_savings'] = calculate_yearly_savings(user_data[user_phone]['monthly_savings'])
-                app.logger.debug(f"Received Yearly savings: {user_data[user_phone]['yearly_savings']}")                   
-
-                # calculating overall cost, subsidy from location tier             
-                recommended_final_cost = calculate_cost_and_subsidy(user_data[user_phone]['recommended_system_size'], location_tier)
-                app.logger.debug(f"Recommended final cost is : {recommended_final_cost}")                   
-                
-                # Round estimated costs up to the nearest lakhs with two decimal places
-                final_cost_lakhs = round(recommended_final_cost / 100000, 1)
-                final_saving_thousands = round(user_data[user_phone]['yearly_savings'] / 1000, 1)
-
-                #ROI
-                user_data[user_phone]['roi'] = round((user_data[user_phone]['yearly_savings'] / float(recommended_final_cost))*100,1)
-
-                user_data[user_phone]['terrace_coverage'] = round(((user_data[user_phone]['recommended_system_size']) * sq_ft_per_kw)/( user_data[user_phone]['rooftop_area'])*100,1)
-
-                response_text += (
-                    f"Option {option_num}: \n"
-                    f"System size: {user_data[user_phone]['recommended_system_size']} kW\n"
-                    f"Estimated cost: Around ₹{final_cost_lakhs} Lakhs after subsidy.\n"
-                    f"Terrace Coverage: Around {user_data[user_phone]['terrace_coverage']}%.\n"
-                    f"Estimated yearly savings: ₹{final_saving_thousands} Thousand.\n"
-                    f"Estimated ROI: {user_data[user_phone]['roi']}% every year.\n\n"
-                )
-                option_num += 1
-
-                # calculate generation for recommended system size + 1
-                user_data[user_phone]['monthly_ac_generation_plus_1'] = []
-                for generation_per_month in monthly_ac_generation_per_kW:
-                    user_data[user_phone]['monthly_ac_generation_plus_1'].append(generation_per_month*(user_data[user_phone]['recommended_system_size']+1))
-                app.logger.debug(f"Received monthly ac generation for plus 1: {user_data[user_phone]['monthly_ac_generation_plus_1'] }")                   
-
-                # Calculate monthly savings
-                user_data[user_phone]['monthly_savings_plus_1'] = calculate_monthly_savings_with_solar(monthly_energy_consumption, user_data[user_phone]['monthly_ac_generation_plus_1'], state_tariffs)
-                app.logger.debug(f"Received Monthly savings for plus 1: {user_data[user_phone]['monthly_savings_plus_1']}")                   
-                user_data[user_phone]['yearly_savings_plus_1'] = calculate_yearly_savings(user_data[user_phone]['monthly_savings_plus_1'])
-                app.logger.debug(f"Received Yearly savings for plus 1: {user_data[user_phone]['yearly_savings_plus_1']}")                   
-
-                # calculating overall cost, subsidy from location tier
-                recommended_final_cost_plus_1 = calculate_cost_and_subsidy((user_data[user_phone]['recommended_system_size']+1), location_tier)
-                app.logger.debug(f"Recommended final cost for plus 1 is : {recommended_final_cost_plus_1}")                   
-                
-                # Round estimated costs up to the nearest lakhs with two decimal places
-                final_cost_lakhs_plus_1 = round(recommended_final_cost_plus_1 / 100000, 1)
-                final_saving_thousands_plus_1 = round(user_data[user_phone]['yearly_savings_plus_1'] / 1000, 1)
-
-                #ROI
-                user_data[user_phone]['roi_plus_1'] = round((user_data[user_phone]['yearly_savings_plus_1'] / float(recommended_final_cost_plus_1))*100,1)
-
-                user_data[user_phone]['terrace_coverage_plus_1'] = round(((user_data[user_phone]['recommended_system_size']+1) * sq_ft_per_kw)/( user_data[user_phone]['rooftop_area'])*100,1)
-
-                response_text += (
-                    f"Option {option_num}: \n"
-                    f"System size: {(user_data[user_phone]['recommended_system_size']+1)} kW\n"
-                    f"Estimated cost: Around ₹{final_cost_lakhs_plus_1} Lakhs after subsidy.\n"
-                    f"Terrace Coverage: Around {user_data[user_phone]['terrace_coverage_plus_1']}%.\n"
-                    f"Estimated yearly savings: ₹{final_saving_thousands_plus_1} Thousand.\n"
-                    f"Estimated ROI: {user_data[user_phone]['roi_plus_1']}% every year.\n\n"
-                )
-
-                option_num += 1
-
-                if (user_data[user_phone]['recommended_system_size'] - 1 == 0):
-                    # calculate generation for recommended system size + 2
-                    user_data[user_phone]['monthly_ac_generation_plus_2'] = []
-                    for generation_per_month in monthly_ac_generation_per_kW:
-                        user_data[user_phone]['monthly_ac_generation_plus_2'].append(generation_per_month*(user_data[user_phone]['recommended_system_size']+2))
-                    app.logger.debug(f"Received monthly ac generation for plus 2: {user_data[user_phone]['monthly_ac_generation_plus_2'] }")                   
-
-                    # Calculate monthly savings
-                    user_data[user_phone]['monthly_savings_plus_2'] = calculate_monthly_savings_with_solar(monthly_energy_consumption, user_data[user_phone]['monthly_ac_generation_plus_2'], state_tariffs)
-                    app.logger.debug(f"Received Monthly savings for plus 2: {user_data[user_phone]['monthly_savings_plus_2']}")                   
-                    user_data[user_phone]['yearly_savings_plus_2'] = calculate_yearly_savings(user_data[user_phone]['monthly_savings_plus_2'])
-                    app.logger.debug(f"Received Yearly savings for plus 2: {user_data[user_phone]['yearly_savings_plus_2']}")                   
-
-                    # calculating overall cost, subsidy from location tier
-                    recommended_final_cost_plus_2 = calculate_cost_and_subsidy((user_data[user_phone]['recommended_system_size']+2), location_tier)
-                    app.logger.debug(f"Recommended final cost for plus 2 is : {recommended_final_cost_plus_2}")                   
-                    
-                    # Round estimated costs up to the nearest lakhs with two decimal places
-                    final_cost_lakhs_plus_2 = round(recommended_final_cost_plus_2 / 100000, 1)
-                    final_saving_thousands_plus_2 = round(user_data[user_phone]['yearly_savings_plus_2'] / 1000, 1)
-
-                    #ROI
-                    user_data[user_phone]['roi_plus_2'] = round((user_data[user_phone]['yearly_savings_plus_2'] / float(recommended_final_cost_plus_2))*100,1)
-                    
-                    user_data[user_phone]['terrace_coverage_plus_2'] = round(((user_data[user_phone]['recommended_system_size']+2) * sq_ft_per_kw)/( user_data[user_phone]['rooftop_area'])*100,1)
-
-                    response_text += (
-                        f"Option {option_num}: \n"
-                        f"System size: {(user_data[user_phone]['recommended_system_size']+2)} kW\n"
-                        f"Estimated cost: Around ₹{final_cost_lakhs_plus_2} Lakhs after subsidy.\n"
-                        f"Terrace Coverage: Around {user_data[user_phone]['terrace_coverage_plus_2']}%.\n"
-                        f"Estimated yearly savings: ₹{final_saving_thousands_plus_2} Thousand.\n"
-                        f"Estimated ROI: {user_data[user_phone]['roi_plus_2']}% every year.\n\n"
-                    )
-
-                if (user_data[user_phone]['roi_minus_1'] is not None):
-                    user_data[user_phone]['max_roi'] = max(user_data[user_phone]['roi_minus_1'], user_data[user_phone]['roi'], user_data[user_phone]['roi_plus_1'])
-                    if user_data[user_phone]['max_roi'] == user_data[user_phone]['roi_minus_1']:
-                        user_data[user_phone]['recommended_option'] = 1
-                    elif user_data[user_phone]['max_roi'] == user_data[user_phone]['roi']:
-                        user_data[user_phone]['recommended_option'] = 2
-                    else:
-                        user_data[user_phone]['recommended_option'] = 3
+            message_id = payload.get('id')
+
+            # Gupshup redelivers messages we were slow to answer: replay the recorded response
+            if message_id:
+                replay = recent_responses.get(message_id)
+                if replay is not None:
+                    metrics.DUPLICATE_MESSAGES.labels(source='memory').inc()
+                    return replay, 200
+
+            # Run the step against the stored state and save it with a compare-and-set on the session
+            # version. If another request advanced the conversation first, re-run against the new state.
+            # The message id is saved in the same state, so a racing duplicate sees it after reloading.
+            step_started = time.perf_counter()
+            step_label = None
+            for attempt in range(SESSION_SAVE_ATTEMPTS):
+                user_state, version = session_store.load(user_phone)
+                replay = recall_from_session(user_state, message_id) if message_id else None
+                if replay is not None:
+                    metrics.DUPLICATE_MESSAGES.labels(source='session').inc()
+                    recent_responses.put(message_id, replay)
+                    return replay, 200
+                if step_label is None:
+                    step_label = metrics.step_label(user_state.get('step'))
+                result = handle_conversation_step(user_state, message_text, resolve)
+                response = {"status": result.status, "response": result.response_text}
+                # A finished conversation starts over from step 0 but keeps its handled message ids
+                if result.end_conversation:
+                    next_state = new_session()
+                    next_state[HANDLED_KEY] = list(user_state.get(HANDLED_KEY, []))
                 else:
-                    user_data[user_phone]['max_roi'] = max(user_data[user_phone]['roi'], user_data[user_phone]['roi_plus_1'], user_data[user_phone]['roi_plus_2'])                    
-                    if user_data[user_phone]['max_roi'] == user_data[user_phone]['roi']:
-                        user_data[user_phone]['recommended_option'] = 1
-                    elif user_data[user_phone]['max_roi'] == user_data[user_phone]['roi_plus_1']:
-                        user_data[user_phone]['recommended_option'] = 2
-                    else:
-                        user_data[user_phone]['recommended_option'] = 3
-
-                response_text += (
-                    f"Our recommendation is Option: {user_data[user_phone]['recommended_option']} \n"
-                )
-
-
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                return jsonify({"status": "success", "response": response_text}), 200
-
+                    next_state = user_state
+                if message_id:
+                    remember_in_session(next_state, message_id, response)
+                try:
+                    session_store.save(user_phone, next_state, version)
+                    break
+                except SessionConflict:
+                    app.logger.warning("Session changed concurrently, retrying step (attempt %s)", attempt + 1)
             else:
-                response_text = "Sorry this is all that I can do for now. For further help & support with Solar roof top installation, please contact us on support@navyamhomes.com or 8884024446"
-                app.logger.debug(f"Response: {response_text}")
-                send_message(response_text, user_phone)
-                del user_data[user_phone]
-                return jsonify({"status": "success", "response": response_text}), 200
-
-            # Clean up user data
-            del user_data[user_phone]
+                return {"status": "error", "message": "Conversation is busy, please retry"}, 409
+            metrics.STEP_DURATION.labels(step=step_label).observe(time.perf_counter() - step_started)
+            if message_id:
+                recent_responses.put(message_id, response)
 
+            (send or send_message)(result.response_text, user_phone)
+            return response, result.http_code
 
+        return {"status": "ERROR CODE: 10003 Unknown event type received from Gupshup"}, 400
 
-        return jsonify({"status": "ERROR CODE: 10003 Unknown event type received from Gupshup"}), 400
+    except Exception as e:
+        app.logger.error("Error occurred: %s", e)
+        return {"status": "error", "message": str(e)}, 500
+    finally:
+        if trace_token is not None:
+            logging_setup.reset_trace(trace_token)
+
+def conversation_key(incoming_data):
+    # The sender's phone number for user messages, which are run in order per sender; None for other events
+    if isinstance(incoming_data, dict) and incoming_data.get('type') == 'message':
+        return incoming_data.get('payload', {}).get('sender', {}).get('phone')
+    return None
+
+def run_webhook_event(incoming_data):
+    """handle_webhook_event() with user messages queued behind the sender's earlier messages."""
+    user_phone = conversation_key(incoming_data)
+    if user_phone is None:
+        return handle_webhook_event(incoming_data)
+    try:
+        return conversation_executor.submit(user_phone, handle_webhook_event, incoming_data).result()
+    except BacklogFull as e:
+        # Gupshup redelivers the message later
+        app.logger.warning("Rejecting message: %s", e)
+        return BACKLOG_FULL_RESPONSE, 429
 
+@app.route('/webhook', methods=['POST'])
+def solar_cost_estimator():
+    try:
+        incoming_data = request.json
     except Exception as e:
-        app.logger.error(f"Error occurred: {e}")
-        return jsonify({"status": "error", "message": str(e)}),500
+        app.logger.error("Error occurred: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    body, http_code = run_webhook_event(incoming_data)
+    return jsonify(body), http_code
+
+# Load the read-only data once at import; under gunicorn --preload this runs in the master before forking
+warmup = Warmup([
+    ('reference_data', lambda: warm_reference_data(reference_data)),
+    ('bundled_pincodes', lambda: load_bundled_pincodes(pincode_cache)),
+    ('release_db_connections', release_db_connections),
+])
+if WARMUP_ON_IMPORT:
+    warmup.run()
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""ASGI serving mode for /webhook, /health and / with non-blocking third-party I/O.
+
+Under the sync Flask app every in-flight NREL, OpenWeather, postal-API or
+Gupshup call pins a whole gunicorn worker. Here one event loop holds many
+conversations at once while they wait on those APIs:
+
+- Third-party calls go through one httpx.AsyncClient per process, with the
+  same per-host timeouts and latency accounting as http_client.py.
+- Step 1 resolves the location before the step runs: pincode cache, geocode
+  and state lookups, then the PVWatts profile, concurrently and within
+  STEP1_DEADLINE_SECONDS.
+- The step logic, session compare-and-set and dedup are the same code as the
+  Flask webhook (app.handle_webhook_event), handed the pre-resolved location.
+  User messages run on the shared per-phone lanes of conversation_executor.py;
+  other database or session-store access runs on a bounded thread pool
+  (ASGI_BLOCKING_THREADS). The drivers have no async API, so they are kept
+  off the event loop instead.
+- Replies are sent to Gupshup from the event loop, in order per phone number,
+  with the retry policy of outbound_queue.py.
+
+Run it with
+
+    gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:${GUNICORN_PORT} asgi_app:application
+
+so that gunicorn.conf.py (preload, warm-up, metrics) still applies, or with
+`uvicorn asgi_app:application` in development. /stats, /metrics and the admin
+and batch routes stay on the Flask app.
+
+Only the third-party calls are non-blocking. Every session load, dedup check
+and database read or write still holds a thread: the step-1 ones one of the
+ASGI_BLOCKING_THREADS threads, the step itself a CONVERSATION_WORKERS lane.
+Under load these pools, and the DB_POOL_MAX_SIZE connections behind them, are
+the limit on throughput per worker. Calls beyond them queue, and the event
+loop keeps accepting requests. Size ASGI_BLOCKING_THREADS to what the
+database and session store can serve concurrently rather than to the number
+of open conversations.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+
+import app as navyam
+import http_client
+import logging_setup
+from circuit_breaker import CircuitOpenError
+from conversation_executor import BacklogFull
+from message_dedup import recall_from_session
+from outbound_queue import DEFAULT_BASE_BACKOFF_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_BACKOFF_SECONDS
+from pincode_cache import normalize_pincode
+
+logger = logging.getLogger(__name__)
+
+# Threads for session, cache and database calls made off the event loop (see the module docstring)
+BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', '32'))
+HTTP_MAX_CONNECTIONS = int(os.getenv('ASGI_HTTP_MAX_CONNECTIONS', '100'))
+
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+_client = None
+_deliveries = set()   # in-flight delivery tasks (kept referenced until done)
+_send_locks = {}      # to_number -> [asyncio.Lock, number of queued deliveries]
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the thread pool, keeping the caller's context (trace id)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(context.run, func, *args))
+
+
+def get_client():
+    """This event loop's shared AsyncClient (created on first use)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                                        max_keepalive_connections=HTTP_MAX_CONNECTIONS))
+    return _client
+
+
+# What a non-blocking call to a dependency may raise besides returning an error response
+DEPENDENCY_ERRORS = (httpx.HTTPError, CircuitOpenError, http_client.DeadlineExceeded, http_client.InvalidResponse)
+
+
+async def request(method, url, **kwargs):
+    """Non-blocking counterpart of http_client.request(), with the same breakers and deadline."""
+    return await _send(method, url, None, kwargs)
+
+
+async def get_json(url, parse):
+    """Non-blocking counterpart of http_client.get_json(): unexpected bodies raise InvalidResponse."""
+    return await _send('GET', url, parse, {})
+
+
+async def _send(method, url, parse, kwargs):
+    host = urlsplit(url).hostname
+    connect_timeout, read_timeout = http_client.timeouts_for(host)
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    http_client.breaker_for(host).before_call()
+    started = time.monotonic()
+    error = True
+    try:
+        response = await get_client().request(method, url, timeout=timeout, **kwargs)
+        if parse is None:
+            error = response.status_code >= 500
+            return response
+        try:
+            result = parse(response.status_code, response.json() if response.status_code == 200 else None)
+        except http_client.MALFORMED_RESPONSE_ERRORS as e:
+            raise http_client.InvalidResponse(f"Unexpected response from {host}: {e!r}") from e
+        error = response.status_code >= 500
+        return result
+    finally:
+        http_client.record(host, time.monotonic() - started, error)
+
+
+async def get_state_from_pincode(pincode):
+    try:
+        return await get_json(navyam.state_lookup_url(pincode), navyam.parse_state_response)
+    except DEPENDENCY_ERRORS as e:
+        logger.warning("State lookup failed: %s", e)
+        return "Error in get_state_from_pincode"
+
+
+async def get_lat_lon_from_pincode(pincode):
+    try:
+        return await get_json(navyam.lat_lon_lookup_url(pincode), navyam.parse_lat_lon_response)
+    except DEPENDENCY_ERRORS as e:
+        logger.warning("Geocoding failed: %s", e)
+        return None, None
+
+
+async def get_solar_generation(lat, lon):
+    """Per-kW (ac_monthly, solrad_annual) for the grid cell: solar grid, pvwatts_cache, NREL, expired profile."""
+    lat_cell, lon_cell = navyam.pvwatts_cache.cell(lat, lon)
+    cached = navyam.solar_grid.lookup(lat_cell, lon_cell) if navyam.solar_grid is not None else None
+    if cached is None:
+        cached = await run_blocking(navyam.pvwatts_cache.get, lat_cell, lon_cell)
+    if cached is not None:
+        return cached
+
+    try:
+        ac_monthly, solrad_annual = await get_json(navyam.nrel_pvwatts_url(lat_cell, lon_cell), navyam.parse_nrel_response)
+    except DEPENDENCY_ERRORS as e:
+        logger.warning("NREL lookup failed: %s", e)
+        ac_monthly, solrad_annual = None, None
+    if ac_monthly is None or solrad_annual is None:
+        cached = await run_blocking(navyam.stale_solar_generation, lat_cell, lon_cell)
+        return cached if cached is not None else (None, None)
+    await run_blocking(navyam.pvwatts_cache.put, lat_cell, lon_cell, ac_monthly, solrad_annual)
+    return ac_monthly, solrad_annual
+
+
+async def _lookup_location(pincode):
+    info = await run_blocking(navyam.pincode_cache.get, pincode)
+    if info is not None:
+        if not info.is_valid:
+            return None, None, None, None, None
+        ac_monthly, solrad_annual = await get_solar_generation(info.lat, info.lon)
+        return info.lat, info.lon, info.state, ac_monthly, solrad_annual
+
+    geo_task = asyncio.ensure_future(get_lat_lon_from_pincode(pincode))
+    state_task = asyncio.ensure_future(get_state_from_pincode(pincode))
+    lat, lon = await geo_task
+    # Start NREL as soon as the coordinates are known
+    solar_task = asyncio.ensure_future(get_solar_generation(lat, lon)) if lat is not None and lon is not None else None
+
+    lat, lon, state = await run_blocking(navyam.remember_pincode, pincode, lat, lon, await state_task)
+    if lat is None:
+        return None, None, None, None, None
+    if solar_task is None:
+        # Geocoding failed and the coordinates came from a nearby pincode
+        solar_task = asyncio.ensure_future(get_solar_generation(lat, lon))
+    ac_monthly, solrad_annual = await solar_task
+    return lat, lon, state, ac_monthly, solrad_annual
+
+
+def _consume_result(task):
+    # Lookups that outlive the step deadline still fill the caches; just swallow their errors
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background location lookup failed: %s", task.exception())
+
+
+async def resolve_location(pincode, timeout=navyam.STEP1_DEADLINE_SECONDS):
+    """
+    Async counterpart of app.resolve_location(): (lat, lon, state, ac_monthly, solrad_annual).
+
+    Raises app.StepDeadlineExceeded after timeout seconds; the lookups keep running in the background.
+    """
+    pincode = normalize_pincode(pincode)
+    if pincode is None:
+        return None, None, None, None, None
+    # The lookups' tasks copy this context, so their HTTP timeouts are capped to the deadline too
+    with http_client.deadline(timeout):
+        task = asyncio.ensure_future(_lookup_location(pincode))
+    task.add_done_callback(_consume_result)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        raise navyam.StepDeadlineExceeded(f"Location lookups for {pincode} did not finish within {timeout}s")
+
+
+async def prefetch_location(message_text):
+    """Resolve a step-1 pincode now and return a resolver for handle_conversation_step() that replays it."""
+    try:
+        location, error = await resolve_location(message_text), None
+    except Exception as e:
+        location, error = None, e
+
+    def resolve(pincode):
+        if pincode != message_text:
+            # The conversation moved on concurrently; fall back to the blocking lookup on this thread
+            return navyam.resolve_location(pincode)
+        if error is not None:
+            raise error
+        return location
+
+    return resolve
+
+
+async def deliver_message(message, to_number):
+    """Send a reply through Gupshup with retries; replies to one number go out in order."""
+    entry = _send_locks.setdefault(to_number, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            headers, data = navyam.gupshup_request(message, to_number)
+            for attempt in range(1, DEFAULT_MAX_ATTEMPTS + 1):
+                try:
+                    response = await request('POST', navyam.GUPSHUP_URL, headers=headers, data=data)
+                    if 200 <= response.status_code < 300:
+                        return True
+                    # Client errors other than rate limiting will not succeed on retry
+                    if 400 <= response.status_code < 500 and response.status_code != 429:
+                        logger.error("Outbound message rejected: %s %s", response.status_code, response.text)
+                        return False
+                    logger.warning("Outbound message failed with %s (attempt %d)", response.status_code, attempt)
+                except DEPENDENCY_ERRORS as e:
+                    logger.warning("Outbound message raised %s (attempt %d)", e, attempt)
+                if attempt < DEFAULT_MAX_ATTEMPTS:
+                    delay = min(DEFAULT_MAX_BACKOFF_SECONDS, DEFAULT_BASE_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            return False
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _send_locks.pop(to_number, None)
+
+
+def _schedule_delivery(message, to_number):
+    task = asyncio.ensure_future(deliver_message(message, to_number))
+    _deliveries.add(task)
+    task.add_done_callback(_deliveries.discard)
+
+
+async def handle_webhook(incoming_data):
+    """Pre-resolve step-1 lookups without blocking, then run the shared webhook handler off the event loop."""
+    loop = asyncio.get_running_loop()
+    resolve = None
+    if isinstance(incoming_data, dict) and incoming_data.get('type') == 'message':
+        payload = incoming_data.get('payload', {})
+        user_phone = payload.get('sender', {}).get('phone')
+        message_text = payload.get('payload', {}).get('text', '').lower()
+        message_id = payload.get('id')
+        with logging_setup.trace(user_phone):
+            # Only a peek: the step itself reloads the session and re-checks for duplicates
+            user_state, _ = await run_blocking(navyam.session_store.load, user_phone)
+            is_duplicate = message_id and recall_from_session(user_state, message_id) is not None
+            if user_state.get('step') == 1 and not is_duplicate:
+                resolve = await prefetch_location(message_text)
+
+    def send(message, to_number):
+        # Called from the worker thread; the delivery itself runs on the event loop
+        loop.call_soon_threadsafe(_schedule_delivery, message, to_number)
+
+    user_phone = navyam.conversation_key(incoming_data)
+    if user_phone is None:
+        return await run_blocking(navyam.handle_webhook_event, incoming_data, send, resolve)
+    # Same per-phone ordering as the Flask route; the event loop awaits the lane instead of a pool thread
+    try:
+        future = navyam.conversation_executor.submit(user_phone, navyam.handle_webhook_event, incoming_data, send, resolve)
+    except BacklogFull as e:
+        logger.warning("Rejecting message: %s", e)
+        return navyam.BACKLOG_FULL_RESPONSE, 429
+    return await asyncio.wrap_future(future)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _respond(send, status, body, content_type=b'application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Already done in the gunicorn master when preloaded; otherwise warm up off the event loop
+            await run_blocking(navyam.warmup.run)
+            logger.info("ASGI worker %s: %d blocking threads, %d conversation lanes", os.getpid(),
+                        BLOCKING_THREADS, navyam.conversation_executor.workers)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _deliveries:
+                await asyncio.wait(list(_deliveries), timeout=5)
+            if _client is not None:
+                await _client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """The ASGI callable."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if path == '/' and method == 'GET':
+        response_text = (f"Async server running in {navyam.app.config['ENV']} mode "
+                         f"with database at {navyam.app.config['DATABASE_URL']}")
+        await _respond(send, 200, {"status": "success", "response": response_text})
+    elif path == '/health' and method == 'GET':
+        if not await run_blocking(navyam.warmup.run):
+            await _respond(send, 503, {"status": "warming up", "warmup": navyam.warmup.status()})
+        else:
+            await _respond(send, 200, b'Healthy', b'text/html; charset=utf-8')
+    elif path == '/webhook' and method == 'POST':
+        try:
+            incoming_data = json.loads(await _read_body(receive) or b'null')
+        except ValueError as e:
+            logger.error("Error occurred: %s", e)
+            await _respond(send, 500, {"status": "error", "message": str(e)})
+            return
+        body, http_code = await handle_webhook(incoming_data)
+        await _respond(send, http_code, body)
+    elif path in ('/', '/health', '/webhook'):
+        await _respond(send, 405, {"status": "error", "message": "Method not allowed"})
+    else:
+        await _respond(send, 404, {"status": "error", "message": "Not found"})
@@ -5,7 +5,7 @@
 
 
 from flask import Flask, request, jsonify
-import requests
+import http_client
 import logging
 
 app = Flask(__name__)
@@ -123,7 +123,7 @@ def send_message(message, to_number):
     }
 
     # Sending the POST request to Gupshup API
-    response = requests.post(GUPSHUP_URL, headers=headers, data=payload)
+    response = http_client.post(GUPSHUP_URL, headers=headers, data=payload)
     
     # Debugging information to check the response
     print(f"Message sent: {response.status_code}, {response.text}")
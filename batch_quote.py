@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Bulk quoting of lead lists through the same pipeline as the WhatsApp conversation.
+
+Each lead needs pincode, recent_bill, num_acs and rooftop_area; lead_id and
+bill_month (e.g. 'Jun', defaults to last month) are optional. Input can be CSV
+with a header row or JSON lines. Leads are processed in chunks: the chunk's
+distinct pincodes are resolved once, then one NREL lookup is made per distinct
+PVWatts grid cell, and finally the quotes are computed in a process pool.
+Results come back as JSON lines in input order.
+
+Pool workers import app with the import-time warm-up disabled and are handed
+the parent's reference data snapshot, so they never query the database
+themselves (see _init_quote_worker()).
+
+    python batch_quote.py leads.csv -o quotes.jsonl --workers 4
+
+The same pipeline is served over HTTP by POST /quotes/batch in app.py.
+"""
+
+import argparse
+import atexit
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.getenv('BATCH_WORKERS', str(os.cpu_count() or 2)))
+DEFAULT_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '500'))
+LOOKUP_THREADS = int(os.getenv('BATCH_LOOKUP_THREADS', '8'))
+
+REQUIRED_FIELDS = ['pincode', 'recent_bill', 'num_acs', 'rooftop_area']
+
+# Set by read_leads() on an input line it could not turn into a lead
+PARSE_ERROR_KEY = '_parse_error'
+
+_process_pool = None
+_process_pool_pid = None
+_process_pool_version = None
+_process_pool_lock = threading.Lock()
+
+
+def read_leads(lines, fmt):
+    """
+    Yield lead dicts from an iterable of text lines.
+
+    A JSONL line that is not a JSON object is yielded as {'line': n, PARSE_ERROR_KEY: message},
+    which quote_lead() turns into an error result, so one bad line does not end the batch.
+
+    Parameters:
+    lines (iterable): Lines of the input file or request body.
+    fmt (str): 'csv' or 'jsonl'.
+    """
+    if fmt == 'csv':
+        for row in csv.DictReader(lines):
+            yield {key.strip(): (value or '').strip() for key, value in row.items() if key}
+    else:
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                lead = json.loads(line)
+            except ValueError as e:
+                yield {'line': line_number, PARSE_ERROR_KEY: f"Invalid JSON: {e}"}
+                continue
+            if not isinstance(lead, dict):
+                yield {'line': line_number, PARSE_ERROR_KEY: f"Expected a JSON object, got {type(lead).__name__}"}
+                continue
+            yield lead
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_quote_worker(reference_rows):
+    """Pool initializer: import app without its warm-up and serve the parent's reference data."""
+    os.environ['WARMUP_ON_IMPORT'] = '0'
+    import app
+    from reference_data import ReferenceDataCache, build_snapshot
+
+    snapshot = build_snapshot(*reference_rows)
+    app.reference_data = ReferenceDataCache(lambda: snapshot)
+
+
+def _new_process_pool(snapshot, workers, mp_context):
+    from reference_data import snapshot_rows
+
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_quote_worker,
+                               initargs=(snapshot_rows(snapshot),))
+
+
+def quote_lead(task):
+    """
+    Compute the quote for one lead (runs in a pool process).
+
+    task is (lead, state, ac_monthly, location_error) with the location already resolved by the
+    parent; location_error is set when the pincode could not be resolved for now.
+    """
+    import app
+
+    lead, state, ac_monthly, location_error = task
+    if PARSE_ERROR_KEY in lead:
+        return {'line': lead['line'], 'status': 'error', 'message': lead[PARSE_ERROR_KEY]}
+    result = {'lead_id': lead.get('lead_id'), 'pincode': lead.get('pincode')}
+    try:
+        missing = [field for field in REQUIRED_FIELDS if lead.get(field) in (None, '')]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+        if location_error:
+            raise ValueError(location_error)
+        if state is None:
+            raise ValueError("Invalid pincode")
+        if ac_monthly is None:
+            raise ValueError("Could not fetch solar potential from NREL")
+
+        recent_bill = float(lead['recent_bill'])
+        num_acs = int(lead['num_acs'])
+        rooftop_area = float(lead['rooftop_area'])
+        bill_month = lead.get('bill_month') or app.get_previous_month()
+
+        monthly_bills = app.calculate_monthly_bills_for_year(recent_bill, num_acs, bill_month, state)
+        monthly_consumption = app.calculate_monthly_consumption(monthly_bills, app.get_tariff_index_for_state(state))
+        recommended_system_size, options, best_index = app.build_quote(
+            monthly_consumption, ac_monthly, rooftop_area, state, lead['pincode'])
+
+        result.update({
+            'status': 'success',
+            'state': state,
+            'recommended_system_size': recommended_system_size,
+            'recommended_option': best_index + 1,
+            'options': options,
+        })
+        note = app.quote_note(monthly_consumption, ac_monthly, rooftop_area)
+        if note:
+            result['note'] = note.strip()
+    except Exception as e:
+        result.update({'status': 'error', 'message': str(e)})
+    return result
+
+
+def _resolve_locations(chunk, lookup_pool, pincodes, cells):
+    """Resolve the chunk's distinct pincodes and PVWatts grid cells not seen earlier in the batch."""
+    import app
+
+    def resolve(pincode):
+        try:
+            return app.resolve_pincode(pincode)
+        except app.PincodeLookupUnavailable as e:
+            logger.warning("%s", e)
+            return None
+
+    new_pincodes = sorted({str(lead.get('pincode', '')).strip() for lead in chunk
+                           if PARSE_ERROR_KEY not in lead} - set(pincodes))
+    for pincode, location in zip(new_pincodes, lookup_pool.map(resolve, new_pincodes)):
+        pincodes[pincode] = location
+
+    new_cells = set()
+    for pincode in new_pincodes:
+        if pincodes[pincode] is None:
+            continue
+        lat, lon, state = pincodes[pincode]
+        if lat is not None:
+            cell = app.pvwatts_cache.cell(lat, lon)
+            if cell not in cells:
+                new_cells.add(cell)
+    new_cells = sorted(new_cells)
+    # Querying at the grid point returns the profile shared by every pincode snapped to it
+    for cell, (ac_monthly, _) in zip(new_cells, lookup_pool.map(lambda c: app.get_solar_generation(*c), new_cells)):
+        cells[cell] = ac_monthly
+
+
+def get_process_pool(snapshot, workers=DEFAULT_WORKERS, mp_context=None):
+    """
+    This process's shared quote pool for a reference data snapshot (used by POST /quotes/batch).
+
+    Pool processes are started once and reused by every request, instead of each request
+    spawning workers that re-import app. Requests share the pool's workers. When the reference
+    data version changes the pool is replaced by one started with the new snapshot.
+    """
+    global _process_pool, _process_pool_pid, _process_pool_version
+    pid = os.getpid()
+    pool = _process_pool
+    if pool is not None and _process_pool_pid == pid and _process_pool_version == snapshot.version:
+        return pool
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_pid != pid or _process_pool_version != snapshot.version:
+            if _process_pool is not None and _process_pool_pid == pid:
+                # Batches still running on the old pool finish their queued work first
+                _process_pool.shutdown(wait=False)
+            _process_pool = _new_process_pool(snapshot, workers, mp_context)
+            _process_pool_pid = pid
+            _process_pool_version = snapshot.version
+    return _process_pool
+
+
+def _discard_process_pool(pool):
+    # A pool whose worker died cannot be used again; the next get_process_pool() starts a new one
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+
+
+@atexit.register
+def _shutdown_process_pool():
+    if _process_pool is not None and _process_pool_pid == os.getpid():
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def quote_leads(leads, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, mp_context=None, process_pool=None):
+    """
+    Quote an iterable of leads, yielding one result dict per lead in input order.
+
+    Pincode and NREL lookups are deduplicated across the whole batch. Without process_pool a
+    pool of worker processes is created for this call with the current reference data;
+    mp_context is passed to it.
+    """
+    if process_pool is not None:
+        try:
+            yield from _quote_leads(leads, process_pool, workers, chunk_size)
+        except BrokenProcessPool:
+            _discard_process_pool(process_pool)
+            raise
+        return
+    import app
+
+    with _new_process_pool(app.reference_data.get(), workers, mp_context) as own_pool:
+        yield from _quote_leads(leads, own_pool, workers, chunk_size)
+
+
+def _quote_leads(leads, process_pool, workers, chunk_size):
+    import app
+
+    pincodes = {}  # pincode -> (lat, lon, state), or None while it cannot be resolved
+    cells = {}     # (lat_cell, lon_cell) -> ac_monthly
+    with ThreadPoolExecutor(max_workers=LOOKUP_THREADS) as lookup_pool:
+        for chunk in _chunks(leads, chunk_size):
+            _resolve_locations(chunk, lookup_pool, pincodes, cells)
+
+            tasks = []
+            for lead in chunk:
+                location = pincodes.get(str(lead.get('pincode', '')).strip(), (None, None, None))
+                if location is None:
+                    tasks.append((lead, None, None, "Could not verify pincode right now, please retry"))
+                    continue
+                lat, lon, state = location
+                ac_monthly = cells.get(app.pvwatts_cache.cell(lat, lon)) if lat is not None else None
+                tasks.append((lead, state, ac_monthly, None))
+
+            for result in process_pool.map(quote_lead, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+                yield result
+
+
+def detect_format(name, content_type=None):
+    """'csv' or 'jsonl' from a file name or Content-Type header."""
+    if content_type and ('json' in content_type):
+        return 'jsonl'
+    if content_type and 'csv' in content_type:
+        return 'csv'
+    return 'jsonl' if name and name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate solar quotes for a CSV or JSONL lead list.")
+    parser.add_argument('input', help="Lead file (.csv or .jsonl), or - for stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output JSONL file (default: stdout)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (default: from file extension)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Quote worker processes")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Leads resolved and quoted per chunk")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.input)
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    counts = {'success': 0, 'error': 0}
+    try:
+        for result in quote_leads(read_leads(source, fmt), workers=args.workers, chunk_size=args.chunk_size):
+            counts[result['status']] += 1
+            sink.write(json.dumps(result) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(f"Quoted {counts['success']} leads, {counts['error']} errors", file=sys.stderr)
+
+
+def stream_request_body(stream):
+    """Text lines from a WSGI input stream, decoded as UTF-8."""
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Micro-benchmarks for the quote calculation core.
+
+Runs against a throwaway SQLite database loaded from the db-init CSVs, with
+the OpenWeather, postal, NREL and Gupshup calls replaced by fixed fixtures, so
+only our own code is measured. For each benchmark it records ops/sec (best of
+several rounds) and the peak memory allocated by a single call.
+
+    python benchmark.py                                  # print results
+    python benchmark.py --save bench_baseline.json       # record a baseline
+    python benchmark.py --compare bench_baseline.json    # fail on regressions
+
+--compare exits with status 1 if any benchmark's ops/sec drops by more than
+--threshold (default 20%) against the baseline. Baselines are machine
+specific, so record and compare them on the same host.
+"""
+
+import argparse
+import copy
+import csv
+import json
+import logging
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DB_INIT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db-init')
+
+# Fixture responses for the external APIs (Jaipur, 302018)
+FIXTURE_LAT_LON = (26.8468, 75.7924)
+FIXTURE_STATE = 'Rajasthan'
+FIXTURE_AC_MONTHLY = [110.2, 120.5, 150.1, 160.3, 165.0, 150.2, 120.4, 115.8, 130.2, 135.6, 120.1, 105.9]
+FIXTURE_SOLRAD_ANNUAL = 5.3
+
+# (recent_bill, num_acs, bill_month, rooftop_area) for a typical conversation
+SCENARIO = (3000.0, 1, 'Jun', 600)
+
+
+def build_fixture_database():
+    """Create a SQLite database from the pipe-delimited db-init CSVs and return its URL."""
+    path = os.path.join(tempfile.mkdtemp(prefix='navyam-bench-'), 'bench.db')
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE tariffs (id INTEGER PRIMARY KEY, state TEXT, min_slab INTEGER, max_slab INTEGER, fixed REAL, variable REAL, max_bill REAL);
+        CREATE TABLE multipliers (id INTEGER PRIMARY KEY, state TEXT, month TEXT, multiplier REAL);
+        CREATE TABLE installation_costs (id INTEGER PRIMARY KEY, location_tier TEXT, system_capacity_kW INTEGER, overall_cost REAL);
+    """)
+    for table, columns in [('tariffs', 7), ('multipliers', 4), ('installation_costs', 4)]:
+        with open(os.path.join(DB_INIT_DIR, f'{table}.csv'), newline='') as f:
+            rows = [[value if value != '' else None for value in row] for row in csv.reader(f, delimiter='|') if row]
+        conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * columns)})", rows)
+    conn.commit()
+    conn.close()
+    return 'sqlite:///' + path
+
+
+def load_app():
+    """Import app.py against the fixture database with the external calls stubbed out."""
+    os.environ['DATABASE_URL'] = build_fixture_database()
+    os.environ['SESSION_STORE_URL'] = 'memory'
+    import app
+
+    app.get_lat_lon_from_pincode = lambda pincode: FIXTURE_LAT_LON
+    app.get_state_from_pincode = lambda pincode: FIXTURE_STATE
+    app.fetch_solar_generation_from_nrel = lambda lat, lon: (list(FIXTURE_AC_MONTHLY), FIXTURE_SOLRAD_ANNUAL)
+    app.outbound_queue._deliver = lambda message, destination: (200, 'ok')
+    return app
+
+
+def define_benchmarks(app):
+    recent_bill, num_acs, bill_month, rooftop_area = SCENARIO
+    monthly_bills = app.calculate_monthly_bills_for_year(recent_bill, num_acs, bill_month, FIXTURE_STATE)
+    tariffs = app.get_tariff_for_state(FIXTURE_STATE)
+    tariff_index = app.get_tariff_index_for_state(FIXTURE_STATE)
+    monthly_consumption = app.calculate_monthly_consumption(monthly_bills, tariffs)
+    system_size = int(app.calculate_system_size(monthly_consumption, rooftop_area, FIXTURE_AC_MONTHLY))
+    monthly_generation = [generation * system_size for generation in FIXTURE_AC_MONTHLY]
+
+    step3_state = {
+        'step': 3, 'pincode': '302018', 'state': FIXTURE_STATE, 'ac_monthly': list(FIXTURE_AC_MONTHLY),
+        'solar_potential': FIXTURE_SOLRAD_ANNUAL, 'recent_bill': recent_bill, 'recent_bill_month': bill_month,
+        'num_acs': num_acs, 'monthly_bills': monthly_bills, 'monthly_consumption': monthly_consumption,
+    }
+
+    def full_step3_quote():
+        app.handle_conversation_step(copy.deepcopy(step3_state), str(rooftop_area))
+
+    return {
+        'calculate_monthly_bills_for_year': lambda: app.calculate_monthly_bills_for_year(recent_bill, num_acs, bill_month, FIXTURE_STATE),
+        'calculate_monthly_consumption': lambda: app.calculate_monthly_consumption(monthly_bills, tariffs),
+        'calculate_monthly_consumption_indexed': lambda: app.calculate_monthly_consumption(monthly_bills, tariff_index),
+        'calculate_system_size': lambda: app.calculate_system_size(monthly_consumption, rooftop_area, FIXTURE_AC_MONTHLY),
+        'calculate_monthly_savings_with_solar': lambda: app.calculate_monthly_savings_with_solar(monthly_consumption, monthly_generation, tariffs),
+        'full_step3_quote': full_step3_quote,
+    }
+
+
+def measure(func, rounds=5, min_round_seconds=0.2):
+    """Best-of-rounds ops/sec plus the peak bytes allocated by one call."""
+    # Calibrate the number of calls per round
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_seconds:
+            break
+        calls *= 2
+
+    best = elapsed
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline_bytes, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': calls / best,
+        'mean_us': best / calls * 1e6,
+        'peak_alloc_bytes': peak_bytes - baseline_bytes,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the names of benchmarks whose throughput regressed past the threshold."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        change = result['ops_per_sec'] / previous['ops_per_sec'] - 1
+        status = 'REGRESSION' if change < -threshold else 'ok'
+        print(f"{name:45s} {change:+7.1%} vs baseline  {status}")
+        if status == 'REGRESSION':
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the quote calculation core.")
+    parser.add_argument('--save', metavar='FILE', help="Write results to a JSON baseline file")
+    parser.add_argument('--compare', metavar='FILE', help="Compare against a JSON baseline and fail on regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed ops/sec drop before failing (default 0.2)")
+    parser.add_argument('--rounds', type=int, default=5, help="Timing rounds per benchmark")
+    parser.add_argument('--only', action='append', help="Run only the named benchmark (repeatable)")
+    args = parser.parse_args(argv)
+
+    app = load_app()
+    # Measure the code, not stderr: keep the app's debug logging off as in production
+    logging.getLogger().setLevel(logging.WARNING)
+    app.app.logger.setLevel(logging.WARNING)
+
+    results = {}
+    for name, func in define_benchmarks(app).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(func, rounds=args.rounds)
+        print(f"{name:45s} {results[name]['ops_per_sec']:12,.0f} ops/s  {results[name]['mean_us']:10.1f} us/op  "
+              f"{results[name]['peak_alloc_bytes']:8,d} B peak")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'benchmarks': results}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Throughput regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Per-dependency circuit breakers for the third-party APIs.
+
+http_client.py (and the async client in asgi_app.py) ask the dependency's
+breaker before every call. After FAILURE_THRESHOLD consecutive failures
+(network errors, timeouts or 5xx responses) the breaker opens, and calls fail
+at once with CircuitOpenError instead of tying up a thread for the full
+timeout. After RESET_TIMEOUT_SECONDS it lets HALF_OPEN_MAX_CALLS probe calls
+through: a successful probe closes it again and a failed one reopens it.
+
+Callers treat CircuitOpenError like any other failed lookup, so an open
+breaker falls back to the last known good data where there is some (expired
+PVWatts profiles, nearby cached pincodes; see app.py).
+
+Breakers are per process; every gunicorn worker trips its own.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+RESET_TIMEOUT_SECONDS = float(os.getenv('CIRCUIT_RESET_TIMEOUT_SECONDS', '30'))
+HALF_OPEN_MAX_CALLS = int(os.getenv('CIRCUIT_HALF_OPEN_MAX_CALLS', '1'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with half-open probing.
+
+    Parameters:
+    name (str): Dependency name, used in errors, logs and metrics.
+    failure_threshold (int): Consecutive failures that open the breaker.
+    reset_timeout (float): Seconds the breaker stays open before probing.
+    half_open_max_calls (int): Probe calls allowed at once while half-open.
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT_SECONDS,
+                 half_open_max_calls=HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError; every admitted call must be followed by record_*()."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._reject()
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self._reject()
+                self._probes += 1
+
+    def _reject(self):
+        self.rejected += 1
+        metrics.CIRCUIT_BREAKER_REJECTED.labels(dependency=self.name).inc()
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                logger.warning("Circuit for %s opened after %d consecutive failures", self.name, self._failures)
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                metrics.CIRCUIT_BREAKER_OPENED.labels(dependency=self.name).inc()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self._failures, 'opened': self.opened,
+                    'rejected': self.rejected}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """The process-wide breaker for a dependency, created on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def stats():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.stats() for name, breaker in breakers.items()}
@@ -0,0 +1,7 @@
+# Tests import app.py, so keep its import-time setup away from the .env database and other services
+import os
+import tempfile
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='navyam-test-'), 'test.db')
+os.environ['SESSION_STORE_URL'] = 'memory'
+os.environ['WARMUP_ON_IMPORT'] = '0'
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Ordered, per-phone execution of conversation steps.
+
+Users often send two messages in quick succession (a bill, then the number of
+ACs). Handled on two request threads at once, both steps read the same
+session; the compare-and-set in session_store.py makes one of them re-run,
+but the pair can still be applied out of order. Instead, every user message is
+run on a lane chosen by hashing the phone number. Each lane has a single
+consumer thread, so one user's messages are processed strictly in arrival
+order while different users proceed in parallel on other lanes, with no
+global lock. The request thread waits for its step's result.
+
+A user may only have max_backlog messages waiting or running. Beyond that
+submit() raises BacklogFull and the webhook answers 429, so Gupshup redelivers
+the message later. One slow step (e.g. step-1 lookups) holds up the other users
+hashed to its lane, so CONVERSATION_WORKERS should comfortably exceed the
+number of concurrent requests per worker.
+"""
+
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.getenv('CONVERSATION_WORKERS', '16'))
+DEFAULT_MAX_BACKLOG = int(os.getenv('CONVERSATION_MAX_BACKLOG', '5'))
+
+_STOP = object()
+
+
+class BacklogFull(Exception):
+    pass
+
+
+class ConversationExecutor:
+    """
+    Runs callables in submission order per key, on one single-consumer lane per hash bucket.
+
+    Parameters:
+    workers (int): Number of lanes (one thread each).
+    max_backlog (int): Calls one key may have queued or running at a time.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_backlog=DEFAULT_MAX_BACKLOG):
+        self.workers = max(1, workers)
+        self.max_backlog = max(1, max_backlog)
+        self._lanes = [queue.Queue() for _ in range(self.workers)]
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._backlog = {}  # key -> calls queued or running
+        self._backlog_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected_backlog_full': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for lane_index, lane in enumerate(self._lanes):
+                thread = threading.Thread(target=self._run, args=(lane,), name=f"conversation-{lane_index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _lane_for(self, key):
+        return self._lanes[zlib.crc32(str(key).encode('utf-8')) % self.workers]
+
+    def submit(self, key, func, *args):
+        """
+        Queue func(*args) behind the key's earlier calls.
+
+        The call runs in a copy of the caller's context (e.g. its log trace id).
+
+        Returns:
+        concurrent.futures.Future: Resolves to func's return value or exception.
+
+        Raises:
+        BacklogFull: If the key already has max_backlog calls queued or running.
+        """
+        self._ensure_started()
+        with self._backlog_lock:
+            pending = self._backlog.get(key, 0)
+            if pending >= self.max_backlog:
+                self._stats['rejected_backlog_full'] += 1
+                metrics.CONVERSATION_REJECTED.inc()
+                raise BacklogFull(f"{pending} messages already in flight for this conversation")
+            self._backlog[key] = pending + 1
+            self._stats['submitted'] += 1
+        future = Future()
+        self._lane_for(key).put((key, future, contextvars.copy_context(), func, args, time.monotonic()))
+        metrics.CONVERSATION_QUEUE_DEPTH.inc()
+        return future
+
+    def _run(self, lane):
+        while True:
+            item = lane.get()
+            if item is _STOP:
+                return
+            key, future, context, func, args, submitted_at = item
+            metrics.CONVERSATION_QUEUE_DEPTH.dec()
+            wait = time.monotonic() - submitted_at
+            metrics.CONVERSATION_QUEUE_WAIT.observe(wait)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(context.run(func, *args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._backlog_lock:
+                    if self._backlog[key] <= 1:
+                        del self._backlog[key]
+                    else:
+                        self._backlog[key] -= 1
+                    self._stats['completed'] += 1
+                    self._stats['wait_seconds_total'] += wait
+                    self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], wait)
+
+    def depth(self):
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def stats(self):
+        with self._backlog_lock:
+            snapshot = dict(self._stats)
+            snapshot['conversations_in_flight'] = len(self._backlog)
+            snapshot['max_conversation_backlog'] = max(self._backlog.values(), default=0)
+        snapshot['depth'] = self.depth()
+        completed = snapshot['completed']
+        snapshot['wait_seconds_avg'] = snapshot['wait_seconds_total'] / completed if completed else 0.0
+        return snapshot
+
+    def shutdown(self, timeout=5.0):
+        """Stop the lanes after they finish what is already queued, waiting at most timeout seconds."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        for lane in self._lanes:
+            lane.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._pid = None
+
+
+def create_conversation_executor(**kwargs):
+    """Create an executor that drains on interpreter exit."""
+    executor = ConversationExecutor(**kwargs)
+    atexit.register(executor.shutdown)
+    return executor
@@ -38,6 +38,60 @@ CREATE TABLE IF NOT EXISTS installation_costs (
     overall_cost REAL
 );
 
+-- Lookup keys of the reference tables (see migrations/001_reference_indexes.sql)
+CREATE UNIQUE INDEX IF NOT EXISTS tariffs_state_min_slab_key ON tariffs (state, min_slab);
+CREATE UNIQUE INDEX IF NOT EXISTS multipliers_state_month_key ON multipliers (state, month);
+CREATE UNIQUE INDEX IF NOT EXISTS installation_costs_tier_capacity_key ON installation_costs (location_tier, system_capacity_kW);
+
+-- Create the `pincode_cache` table (filled at runtime and by `python pincode_cache.py warm`)
+CREATE TABLE IF NOT EXISTS pincode_cache (
+    pincode TEXT PRIMARY KEY,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    state TEXT,
+    is_valid INTEGER NOT NULL,
+    updated_at DOUBLE PRECISION
+);
+
+-- Create the `pvwatts_cache` table (per-kW PVWatts profiles keyed on a lat/lon grid cell)
+CREATE TABLE IF NOT EXISTS pvwatts_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,
+    ac_monthly TEXT NOT NULL,
+    solrad_annual DOUBLE PRECISION NOT NULL,
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+);
+
+-- Create the `pvwatts_hourly_cache` table (hourly per-kW PVWatts output for the hourly simulation mode)
+CREATE TABLE IF NOT EXISTS pvwatts_hourly_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,
+    ac_hourly TEXT NOT NULL,
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+);
+
+-- Create the `sessions` table (conversation state shared by all workers)
+CREATE TABLE IF NOT EXISTS sessions (
+    phone TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+
+-- Create the `reference_data_versions` table (one row per dataset loaded by `python reference_loader.py load`)
+CREATE TABLE IF NOT EXISTS reference_data_versions (
+    version TEXT NOT NULL,
+    loaded_at DOUBLE PRECISION NOT NULL,
+    source TEXT,
+    tariff_rows INTEGER NOT NULL,
+    multiplier_rows INTEGER NOT NULL,
+    cost_rows INTEGER NOT NULL
+);
+
 -- Load data into the tariffs table
 COPY tariffs (id, state, min_slab, max_slab, fixed, variable, max_bill)
 FROM '/docker-entrypoint-initdb.d/tariffs.csv' DELIMITER '|' CSV;
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Process-wide, bounded connection pool used by connect_db() in app.py.
+
+One pool is created lazily per worker process (it is rebuilt automatically
+after a fork) and hands out connections for both sqlite:/// and postgresql://
+URLs. Callers keep the existing pattern of
+
+    conn = connect_db()
+    cursor = conn.cursor()
+    ...
+    conn.close()
+
+where close() returns the connection to the pool instead of tearing it down.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '5'))
+DEFAULT_MAX_IDLE_SECONDS = float(os.getenv('DB_POOL_MAX_IDLE_SECONDS', '300'))
+DEFAULT_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '10'))
+# Connections idle for longer than this are pinged before being handed out
+DEFAULT_HEALTH_CHECK_AFTER = float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', '30'))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class PooledCursor:
+    """
+    Thin cursor wrapper so the same '%s' style queries work on every backend.
+
+    sqlite3 uses the qmark paramstyle, so '%s' placeholders are rewritten to '?'
+    before execution. Everything else is delegated to the real cursor.
+    """
+
+    def __init__(self, cursor, paramstyle):
+        self._cursor = cursor
+        self._paramstyle = paramstyle
+
+    def _adapt(self, query):
+        if self._paramstyle == 'qmark':
+            return query.replace('%s', '?')
+        return query
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(self._adapt(query), params)
+        finally:
+            metrics.observe_db_query(query, time.perf_counter() - started)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(self._adapt(query), seq_of_params)
+        finally:
+            metrics.observe_db_query(query, time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Connection proxy whose close() hands the connection back to its pool."""
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+        self._closed = False
+
+    def cursor(self):
+        return PooledCursor(self._conn.cursor(), self._pool.paramstyle)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._conn)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it (e.g. after a fatal error)."""
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._conn, broken=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._conn.rollback()
+            except Exception:
+                self.discard()
+                return False
+        self.close()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DB-API connections for a single database URL.
+
+    Parameters:
+    database_url (str): sqlite:///path or postgresql://... URL.
+    max_size (int): Maximum number of open connections (idle + in use).
+    max_idle_seconds (float): Idle connections older than this are closed.
+    checkout_timeout (float): Seconds to wait for a free connection before failing.
+    health_check_after (float): Idle time after which a connection is pinged on checkout.
+    """
+
+    def __init__(self, database_url, max_size=DEFAULT_MAX_SIZE, max_idle_seconds=DEFAULT_MAX_IDLE_SECONDS,
+                 checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT, health_check_after=DEFAULT_HEALTH_CHECK_AFTER):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.database_url = database_url
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.paramstyle = 'qmark' if database_url.startswith('sqlite') else 'format'
+
+        self._lock = threading.Condition()
+        self._idle = []  # LIFO stack of (raw_conn, last_used_monotonic)
+        self._open = 0
+        self._in_use = 0
+        self._engine = None
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'closed': 0,
+            'evicted_idle': 0,
+            'failed_health_checks': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    # Connection factory for the supported URL schemes
+    def _create_connection(self):
+        if self.database_url.startswith('sqlite'):
+            # check_same_thread=False is safe because a connection is only ever used by one checkout at a time
+            return sqlite3.connect(self.database_url.replace('sqlite:///', ''), check_same_thread=False)
+        elif self.database_url.startswith('postgres'):
+            import psycopg2
+            return psycopg2.connect(self.database_url)
+        else:
+            # For other databases, fall back to a raw DB-API connection from SQLAlchemy.
+            # NullPool keeps SQLAlchemy from pooling underneath us.
+            if self._engine is None:
+                from sqlalchemy import create_engine
+                from sqlalchemy.pool import NullPool
+                self._engine = create_engine(self.database_url, poolclass=NullPool)
+            return self._engine.raw_connection()
+
+    def _close_quietly(self, raw_conn):
+        try:
+            raw_conn.close()
+        except Exception as e:
+            logger.debug("Error closing pooled connection: %s", e)
+
+    def _is_healthy(self, raw_conn):
+        try:
+            cursor = raw_conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            # Do not leave an open transaction behind on postgres
+            raw_conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Pooled connection failed health check: %s", e)
+            return False
+
+    def _evict_idle_locked(self, now):
+        """Close idle connections that have not been used within max_idle_seconds."""
+        keep = []
+        for raw_conn, last_used in self._idle:
+            if now - last_used > self.max_idle_seconds:
+                self._close_quietly(raw_conn)
+                self._open -= 1
+                self._stats['evicted_idle'] += 1
+                self._stats['closed'] += 1
+            else:
+                keep.append((raw_conn, last_used))
+        self._idle = keep
+
+    def connection(self):
+        """Check out a connection, creating one if the pool is not yet full."""
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._evict_idle_locked(now)
+
+                if self._idle:
+                    raw_conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    self._stats['checkouts'] += 1
+                    needs_check = now - last_used > self.health_check_after
+                elif self._open < self.max_size:
+                    # Reserve the slot now and connect outside the lock
+                    self._open += 1
+                    self._in_use += 1
+                    self._stats['checkouts'] += 1
+                    raw_conn, needs_check = None, False
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(f"No database connection available after {self.checkout_timeout}s")
+                    self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+                    continue
+
+            if raw_conn is None:
+                try:
+                    raw_conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                        self._in_use -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._stats['created'] += 1
+                metrics.DB_CHECKOUT_DURATION.observe(time.monotonic() - started)
+                return PooledConnection(self, raw_conn)
+
+            if needs_check and not self._is_healthy(raw_conn):
+                self._close_quietly(raw_conn)
+                with self._lock:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._stats['failed_health_checks'] += 1
+                    self._stats['closed'] += 1
+                    self._lock.notify()
+                continue
+
+            metrics.DB_CHECKOUT_DURATION.observe(time.monotonic() - started)
+            return PooledConnection(self, raw_conn)
+
+    def _release(self, raw_conn, broken=False):
+        if not broken:
+            try:
+                # End any implicit transaction so the next user starts clean
+                raw_conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._lock:
+            self._in_use -= 1
+            if broken:
+                self._open -= 1
+                self._stats['closed'] += 1
+            else:
+                self._idle.append((raw_conn, time.monotonic()))
+            self._lock.notify()
+
+        if broken:
+            self._close_quietly(raw_conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'max_size': self.max_size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+            })
+        return snapshot
+
+    def close_all(self):
+        """Close every idle connection; in-use connections are closed when released."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._stats['closed'] += len(idle)
+        for raw_conn, _ in idle:
+            self._close_quietly(raw_conn)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(database_url=None):
+    """
+    Return the pool for this worker process, creating it on first use.
+
+    A pool inherited across fork() is never reused: its sockets belong to the
+    parent, so a fresh pool is built the first time a new pid asks for one.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            database_url = database_url or os.getenv('DATABASE_URL')
+            if not database_url:
+                raise RuntimeError("DATABASE_URL is not set")
+            # Drop the inherited pool without closing the parent's connections
+            _pool = ConnectionPool(database_url)
+            _pool_pid = pid
+            logger.info("Created database connection pool (max_size=%s) for pid %s", _pool.max_size, pid)
+    return _pool
+
+
+def pool_stats():
+    """Usage stats for this process's pool, or None if no pool has been created yet."""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Gunicorn settings (loaded automatically from the working directory).
+
+The app is preloaded in the master, which runs the warm-up in warmup.py; the
+loaded data is then frozen out of the garbage collector's reach so forked
+workers keep sharing its pages copy-on-write.
+
+Workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR so that
+/metrics can aggregate them (see metrics.py). The directory is emptied when
+the master starts, and a dead worker's live gauges are dropped on exit.
+"""
+
+import gc
+import os
+import shutil
+
+preload_app = True
+
+# The preloaded app records metrics while it is imported, before on_starting runs
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.getenv('PROMETHEUS_MULTIPROC_DIR'), exist_ok=True)
+
+
+def on_starting(server):
+    # Drop samples left over from a previous run (and from the preload import)
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Runs after the app is preloaded and before any worker is forked
+    gc.collect()
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
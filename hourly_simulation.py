@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Hourly (8760-point) net-metering simulation of candidate system sizes.
+
+calculate_monthly_savings_with_solar() in app.py (and quote_engine.py) nets a
+month's generation against the month's consumption. That is what annual or
+monthly banking pays out, but without banking the midday surplus is exported
+at the feed-in rate at best and the evening load is still bought from the
+grid. In hourly mode (QUOTE_SIMULATION=hourly) the quote instead:
+
+1. takes the hourly AC output per kW for the location from PVWatts
+   (timeframe=hourly, cached in pvwatts_hourly_cache),
+2. spreads each month's consumption over its hours with a residential daily
+   load shape, plus an afternoon/night AC shape for the share of the months'
+   consumption the ACs account for,
+3. computes hourly import and export for every candidate size at once
+   (a sizes x 8760 array) and sums them per month,
+4. bills the imports under the NET_METERING_BANKING rule:
+   - 'annual': surplus units are banked and offset later months of the year,
+   - 'monthly': surplus offsets the same month's imports only,
+   - 'none': every imported unit is billed (gross metering);
+   surplus not used up is paid at EXPORT_RATE_PER_KWH.
+
+Bills use the same TariffIndex and int() truncation of units as the monthly
+evaluation, and the options have the same shape, so format_option() and the
+quote cache work unchanged. Three sizes take well under a millisecond.
+"""
+
+import os
+
+import numpy as np
+
+from pvwatts_cache import HOURS_PER_YEAR
+from quote_engine import SQ_FT_PER_KW
+from tariff_index import TariffIndex
+
+SIMULATION_MODE = os.getenv('QUOTE_SIMULATION', 'monthly')
+BANKING = os.getenv('NET_METERING_BANKING', 'annual')
+EXPORT_RATE = float(os.getenv('EXPORT_RATE_PER_KWH', '0'))
+BANKING_RULES = ('annual', 'monthly', 'none')
+
+# PVWatts hourly output is for a typical (non-leap) year starting on 1 January at 00:00
+DAYS_PER_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+HOURS_PER_MONTH = np.array(DAYS_PER_MONTH) * 24
+MONTH_STARTS = np.concatenate(([0], np.cumsum(HOURS_PER_MONTH)[:-1]))
+MONTH_OF_HOUR = np.repeat(np.arange(12), HOURS_PER_MONTH)
+HOUR_OF_DAY = np.tile(np.arange(24), HOURS_PER_YEAR // 24)
+
+# Relative household load by hour of day: low overnight, morning and evening peaks
+BASE_LOAD_SHAPE = np.array([0.55, 0.5, 0.5, 0.5, 0.55, 0.7, 1.0, 1.25, 1.2, 1.0, 0.9, 0.85,
+                            0.85, 0.85, 0.85, 0.9, 1.0, 1.2, 1.55, 1.75, 1.7, 1.45, 1.05, 0.75])
+# Relative AC load by hour of day: afternoon heat and the evening/night
+AC_LOAD_SHAPE = np.array([1.3, 1.3, 1.2, 1.0, 0.8, 0.5, 0.2, 0.1, 0.1, 0.2, 0.4, 0.7,
+                          1.0, 1.3, 1.5, 1.5, 1.4, 1.3, 1.3, 1.4, 1.5, 1.6, 1.6, 1.5])
+
+# Same months calculate_monthly_bills_for_year() adds the AC bill to (Mar-Jun)
+AC_MONTHS = (2, 3, 4, 5)
+# Units one AC adds to a month (about 1.5 kW for 7 hours a day), capped at a share of the month
+AC_UNITS_PER_MONTH = 300
+MAX_AC_SHARE = 0.6
+
+
+def _normalized(shape):
+    return shape / shape.mean()
+
+
+def build_load_profile(monthly_consumption, num_acs=0):
+    """
+    Spread monthly consumption over the hours of a year.
+
+    Parameters:
+    monthly_consumption (list): 12 monthly consumption values (kWh).
+    num_acs (int): Number of ACs; in AC_MONTHS their share follows AC_LOAD_SHAPE.
+
+    Returns:
+    numpy.ndarray: 8760 hourly loads (kWh) whose monthly sums equal monthly_consumption.
+    """
+    consumption = np.asarray(monthly_consumption, dtype=float)
+    ac_share = np.zeros(12)
+    if num_acs:
+        months = list(AC_MONTHS)
+        ac_share[months] = np.minimum(MAX_AC_SHARE, num_acs * AC_UNITS_PER_MONTH / np.maximum(consumption[months], 1.0))
+
+    base, ac = _normalized(BASE_LOAD_SHAPE)[HOUR_OF_DAY], _normalized(AC_LOAD_SHAPE)[HOUR_OF_DAY]
+    share = ac_share[MONTH_OF_HOUR]
+    average_load = (consumption / HOURS_PER_MONTH)[MONTH_OF_HOUR]
+    return average_load * ((1 - share) * base + share * ac)
+
+
+def simulate(system_sizes, ac_hourly, load, banking=BANKING):
+    """
+    Monthly grid imports, exports and billed units for each system size.
+
+    Parameters:
+    system_sizes (list): Candidate sizes in kW.
+    ac_hourly (array): 8760 hourly AC outputs per kW (kWh).
+    load (array): 8760 hourly loads (kWh), e.g. from build_load_profile().
+    banking (str): 'annual', 'monthly' or 'none'.
+
+    Returns:
+    dict: 'imported', 'exported' and 'billed' (sizes x 12 arrays of kWh) and 'unused_export'
+    (per size, the surplus kWh left over for the export rate).
+    """
+    if banking not in BANKING_RULES:
+        raise ValueError(f"Unknown banking rule {banking!r}; expected one of {BANKING_RULES}")
+    sizes = np.asarray(system_sizes, dtype=float)
+    generation = sizes[:, None] * np.asarray(ac_hourly, dtype=float)[None, :]
+    net = np.asarray(load, dtype=float)[None, :] - generation
+    imported = np.add.reduceat(np.maximum(net, 0.0), MONTH_STARTS, axis=1)
+    exported = np.add.reduceat(np.maximum(-net, 0.0), MONTH_STARTS, axis=1)
+
+    if banking == 'none':
+        billed, unused_export = imported, exported.sum(axis=1)
+    elif banking == 'monthly':
+        monthly_net = imported - exported
+        billed, unused_export = np.maximum(monthly_net, 0.0), np.maximum(-monthly_net, 0.0).sum(axis=1)
+    else:
+        # Carry each month's surplus forward through the year
+        billed = np.empty_like(imported)
+        bank = np.zeros(len(sizes))
+        for month in range(12):
+            month_net = imported[:, month] - exported[:, month] - bank
+            billed[:, month] = np.maximum(month_net, 0.0)
+            bank = np.maximum(-month_net, 0.0)
+        unused_export = bank
+    return {'imported': imported, 'exported': exported, 'billed': billed, 'unused_export': unused_export}
+
+
+def evaluate_system_sizes_hourly(system_sizes, monthly_consumption, ac_hourly, num_acs, tariffs, final_cost_for_size,
+                                 rooftop_area, banking=BANKING, export_rate=EXPORT_RATE):
+    """
+    Hourly-simulation counterpart of quote_engine.evaluate_system_sizes().
+
+    Parameters:
+    system_sizes (list): Candidate system sizes in kW.
+    monthly_consumption (list): 12 monthly consumption values (kWh).
+    ac_hourly (array): 8760 hourly AC outputs per kW (kWh) from PVWatts.
+    num_acs (int): Number of ACs, used to shape the load profile.
+    tariffs (TariffIndex or list): The state's compiled tariffs (or the raw slab list).
+    final_cost_for_size (callable): Size in kW -> cost after subsidy (calculate_cost_and_subsidy).
+    rooftop_area (float): Rooftop area in square feet.
+    banking (str): Net-metering banking rule, see simulate().
+    export_rate (float): Rupees paid per surplus kWh not offset against imports.
+
+    Returns:
+    (list, int): Options in the evaluate_system_sizes() format and the index of the highest ROI.
+    """
+    tariff_index = tariffs if isinstance(tariffs, TariffIndex) else TariffIndex(tariffs)
+    sizes = np.asarray(system_sizes, dtype=float)
+    consumption = np.asarray(monthly_consumption, dtype=float).astype(np.int64)
+    result = simulate(system_sizes, ac_hourly, build_load_profile(consumption, num_acs), banking)
+
+    original_bills = tariff_index.bills_for_units(consumption)
+    # Truncate billed units like int() in the monthly evaluation
+    reduced_bills = tariff_index.bills_for_units(np.trunc(result['billed']))
+    yearly_savings = (original_bills[None, :] - reduced_bills).sum(axis=1) + result['unused_export'] * export_rate
+
+    final_costs = np.array([float(final_cost_for_size(size)) for size in system_sizes])
+    roi = np.round(yearly_savings / final_costs * 100, 1)
+    terrace_coverage = np.round(sizes * SQ_FT_PER_KW / rooftop_area * 100, 1)
+
+    options = []
+    for i, size in enumerate(system_sizes):
+        options.append({
+            'system_size': size,
+            'yearly_savings': float(yearly_savings[i]),
+            'final_cost': float(final_costs[i]),
+            'roi': float(roi[i]),
+            'terrace_coverage': float(terrace_coverage[i]),
+        })
+    return options, int(np.argmax(roi))
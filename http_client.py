@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Shared HTTP client for the third-party APIs (postalpincode.in, OpenWeather, NREL, Gupshup).
+
+All calls go through one requests.Session per process, which keeps a
+keep-alive connection pool per host, so repeat calls skip DNS and the TLS
+handshake. Every request gets explicit connect and read timeouts, and
+per-host latency is recorded for /stats and the /metrics histograms.
+
+Each dependency has a circuit breaker (see circuit_breaker.py) that fails
+calls fast while the vendor is down. JSON APIs are called with get_json(), which
+counts a body it cannot parse (e.g. an HTML error page) as a failed call. A caller working to a deadline (step 1)
+sets it with deadline(); the timeouts of every request made in that context,
+including on threads started with a copy of it, are capped to the time left.
+"""
+
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from circuit_breaker import CircuitOpenError, get_breaker
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+
+# PVWatts responses can take a while to compute
+READ_TIMEOUT_OVERRIDES = {
+    'developer.nrel.gov': float(os.getenv('NREL_READ_TIMEOUT', '20')),
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+# Absolute time.monotonic() deadline of the current operation, or None
+_deadline = contextvars.ContextVar('http_deadline', default=None)
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+class InvalidResponse(requests.RequestException):
+    """A dependency answered with a body that is not JSON or not in the expected shape."""
+
+
+# What parsing an unexpected body (an HTML error page, truncated JSON, another shape) raises
+MALFORMED_RESPONSE_ERRORS = (ValueError, KeyError, IndexError, TypeError)
+
+
+# What a call to a dependency may raise besides returning an error response
+DEPENDENCY_ERRORS = (requests.RequestException, CircuitOpenError)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Cap the timeouts of requests made inside the block (and in copies of its context) to seconds from now."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, or None if there is none."""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def timeouts_for(host):
+    """(connect, read) timeouts for a request to host, capped to the current deadline."""
+    connect_timeout, read_timeout = CONNECT_TIMEOUT, READ_TIMEOUT_OVERRIDES.get(host, READ_TIMEOUT)
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded(f"Deadline passed before calling {host}")
+        connect_timeout, read_timeout = min(connect_timeout, left), min(read_timeout, left)
+    return connect_timeout, read_timeout
+
+
+def get_session():
+    """Return this process's shared session, creating it after fork as needed."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            # pool_connections = number of hosts kept, pool_maxsize = keep-alive connections per host
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def breaker_for(host):
+    return get_breaker(metrics.dependency_label(host))
+
+
+def record(host, elapsed, error):
+    """Record one request's outcome and latency for the breaker, /stats and /metrics (also used by asgi_app.py)."""
+    breaker = breaker_for(host)
+    if error:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    metrics.DEPENDENCY_DURATION.labels(dependency=metrics.dependency_label(host),
+                                       outcome='error' if error else 'ok').observe(elapsed)
+    with _stats_lock:
+        host_stats = _stats.setdefault(host, {'requests': 0, 'errors': 0, 'latency_seconds_total': 0.0,
+                                              'latency_seconds_max': 0.0})
+        host_stats['requests'] += 1
+        host_stats['latency_seconds_total'] += elapsed
+        host_stats['latency_seconds_max'] = max(host_stats['latency_seconds_max'], elapsed)
+        if error:
+            host_stats['errors'] += 1
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the shared session.
+
+    Parameters:
+    method (str): HTTP method, e.g. 'GET'.
+    url (str): Full URL.
+    timeout (tuple): Optional (connect, read) timeout; defaults per host and is capped to the current deadline.
+
+    Returns:
+    requests.Response: The response. Network errors and timeouts are raised as requests exceptions,
+    and CircuitOpenError is raised without a request while the host's breaker is open.
+    """
+    return _send(method, url, timeout, None, kwargs)
+
+
+def get_json(url, parse, timeout=None, **kwargs):
+    """
+    GET a JSON API and parse the response.
+
+    Parameters:
+    url (str): Full URL.
+    parse (callable): parse(status_code, data) -> result, where data is the decoded body of a
+    200 response and None otherwise (e.g. app.parse_state_response).
+    timeout (tuple): As for request().
+
+    Returns:
+    The result of parse. A 200 body that is not JSON, or that parse cannot handle, raises
+    InvalidResponse and counts as a failed call for the breaker, like a 5xx response.
+    """
+    return _send('GET', url, timeout, parse, kwargs)
+
+
+def _send(method, url, timeout, parse, kwargs):
+    host = urlsplit(url).hostname
+    if timeout is None:
+        timeout = timeouts_for(host)
+
+    breaker_for(host).before_call()
+    started = time.monotonic()
+    error = True
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        if parse is None:
+            error = response.status_code >= 500
+            return response
+        try:
+            result = parse(response.status_code, response.json() if response.status_code == 200 else None)
+        except MALFORMED_RESPONSE_ERRORS as e:
+            raise InvalidResponse(f"Unexpected response from {host}: {e!r}") from e
+        error = response.status_code >= 500
+        return result
+    finally:
+        record(host, time.monotonic() - started, error)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def stats():
+    """Per-host request counts and latency for this process."""
+    with _stats_lock:
+        snapshot = {host: dict(host_stats) for host, host_stats in _stats.items()}
+    for host_stats in snapshot.values():
+        host_stats['latency_seconds_avg'] = host_stats['latency_seconds_total'] / host_stats['requests']
+    return snapshot
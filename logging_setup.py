@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Logging configuration for the web app and the CLI tools.
+
+configure_logging() replaces the old logging.basicConfig(level=logging.DEBUG):
+
+- Records are put on an in-memory queue by a QueueHandler and written to
+  stderr by a QueueListener thread, so request threads never block on I/O.
+  The listener is restarted per process, so forked gunicorn workers log too.
+- Every record carries a trace_id: a short hash of the user's phone number,
+  set for the duration of a webhook request by set_trace() or trace(). Raw
+  phone numbers never need to appear in log lines to correlate a conversation.
+- LOG_FORMAT=json writes one JSON object per line (python-json-logger);
+  the default is plain text.
+- LOG_DEBUG_SAMPLE_RATE keeps only a fraction of DEBUG records. Sampling is
+  decided per trace_id, so a sampled conversation keeps all its debug lines.
+
+Log calls should use lazy %-style arguments, e.g.
+logger.debug("Monthly bills are: %s", monthly_bills), so nothing is formatted
+for records that are filtered out.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s trace=%(trace_id)s: %(message)s'
+JSON_FIELDS = '%(asctime)s %(levelname)s %(process)d %(name)s %(trace_id)s %(message)s'
+
+NO_TRACE = '-'
+_trace_id = contextvars.ContextVar('trace_id', default=NO_TRACE)
+
+
+def trace_id_for(phone):
+    """Stable, non-reversible trace id for a phone number."""
+    return hashlib.sha256(str(phone).encode('utf-8')).hexdigest()[:16]
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def set_trace(phone):
+    """Set the trace id for the current context; returns a token for reset_trace()."""
+    return _trace_id.set(trace_id_for(phone) if phone else NO_TRACE)
+
+
+def reset_trace(token):
+    _trace_id.reset(token)
+
+
+@contextlib.contextmanager
+def trace(phone):
+    """Tag every record logged inside the block with the phone number's trace id."""
+    token = set_trace(phone)
+    try:
+        yield
+    finally:
+        reset_trace(token)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current trace_id to each record (runs in the calling thread, where the context is set)."""
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class DebugSampleFilter(logging.Filter):
+    """
+    Keeps a fraction of DEBUG records; other levels always pass.
+
+    Parameters:
+    rate (float): Fraction of traces (or of untraced records) whose debug records are kept.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        if self.rate <= 0.0:
+            return False
+        trace_id = getattr(record, 'trace_id', NO_TRACE)
+        if trace_id == NO_TRACE:
+            return random.random() < self.rate
+        return int(trace_id[:8], 16) < self.rate * 0x100000000
+
+
+class ProcessLocalQueueHandler(QueueHandler):
+    """QueueHandler that (re)starts its listener in whichever process it first emits from."""
+
+    def __init__(self, target):
+        super().__init__(queue.SimpleQueue())
+        self._target = target
+        self._listener = None
+        self._pid = None
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self.acquire()
+        try:
+            if self._pid != pid:
+                # A listener inherited across fork has no thread behind it: start over with a fresh queue
+                self.queue = queue.SimpleQueue()
+                self._listener = QueueListener(self.queue, self._target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = pid
+        finally:
+            self.release()
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Flush queued records and stop the listener (registered with atexit)."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+def build_formatter(fmt=None):
+    """Text or JSON formatter for the given LOG_FORMAT value."""
+    fmt = fmt or LOG_FORMAT
+    if fmt == 'json':
+        from pythonjsonlogger import jsonlogger
+        return jsonlogger.JsonFormatter(JSON_FIELDS, rename_fields={'levelname': 'level', 'process': 'pid'})
+    return logging.Formatter(TEXT_FORMAT)
+
+
+_handler = None
+
+
+def configure_logging(level=None, fmt=None, debug_sample_rate=None, stream=None):
+    """
+    Install the queue-based handler on the root logger (idempotent).
+
+    Parameters:
+    level (str): Root log level; defaults to LOG_LEVEL.
+    fmt (str): 'text' or 'json'; defaults to LOG_FORMAT.
+    debug_sample_rate (float): Defaults to LOG_DEBUG_SAMPLE_RATE.
+    stream: Output stream; defaults to stderr.
+
+    Returns:
+    logging.Handler: The installed queue handler.
+    """
+    global _handler
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if _handler is not None:
+        return _handler
+
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(build_formatter(fmt))
+
+    handler = ProcessLocalQueueHandler(target)
+    handler.addFilter(TraceIdFilter())
+    handler.addFilter(DebugSampleFilter(LOG_DEBUG_SAMPLE_RATE if debug_sample_rate is None else debug_sample_rate))
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    atexit.register(handler.stop)
+    _handler = handler
+    return handler
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Deduplication of redelivered Gupshup message events.
+
+Gupshup retries an inbound message when the webhook is slow to answer. Each
+message carries an id (payload.id), and the response to it is remembered in
+two places:
+
+- RecentResponses, a bounded in-process LRU with a TTL, answers repeats that
+  reach the same worker without touching the session store.
+- The last few handled ids are kept in the conversation state itself (see
+  remember_in_session()). The state is saved with the session's
+  compare-and-set, so recording the id is atomic with advancing the step. A
+  duplicate handled by another worker, or racing the original request, finds
+  the id after reloading the session and gets the recorded response instead
+  of running the step a second time.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', '10000'))
+DEFAULT_TTL_SECONDS = float(os.getenv('DEDUP_TTL_SECONDS', '3600'))
+SESSION_ENTRIES = int(os.getenv('DEDUP_SESSION_ENTRIES', '5'))
+
+# Conversation state key holding [[message_id, response], ...], oldest first
+HANDLED_KEY = 'handled_messages'
+
+
+class RecentResponses:
+    """
+    Bounded, TTL-limited map of message id -> response body.
+
+    Parameters:
+    max_size (int): Maximum number of message ids kept.
+    ttl_seconds (float): How long a response is replayed for.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # message_id -> (response, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message_id):
+        """The response recorded for the message id, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is not None and entry[1] < now:
+                del self._entries[message_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, message_id, response):
+        with self._lock:
+            self._entries[message_id] = (response, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(message_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+
+def recall_from_session(state, message_id):
+    """The response recorded in the conversation state for the message id, or None."""
+    for handled_id, response in state.get(HANDLED_KEY, ()):
+        if handled_id == message_id:
+            return response
+    return None
+
+
+def remember_in_session(state, message_id, response, keep=SESSION_ENTRIES):
+    """Record a handled message id and its response in the conversation state (last `keep` only)."""
+    handled = [entry for entry in state.get(HANDLED_KEY, ()) if entry[0] != message_id]
+    handled.append([message_id, response])
+    state[HANDLED_KEY] = handled[-keep:]
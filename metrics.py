@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Prometheus metrics for the webhook, its external dependencies and the database.
+
+Under gunicorn every worker is a separate process, so the metrics use
+prometheus_client's multiprocess mode whenever PROMETHEUS_MULTIPROC_DIR is
+set (the dockerfile sets it and gunicorn.conf.py cleans it up). /metrics then
+aggregates the samples written by all workers, whichever worker serves it.
+"""
+
+import os
+import re
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Conversation steps and event types used as label values (anything else is folded into 'other')
+STEPS = {0: '0', 1: '1', 1.5: '1.5', 2: '2', 3: '3'}
+EVENT_TYPES = {'message', 'message-event', 'user-event', 'system-event', 'billing-event'}
+
+# Hosts of the third-party APIs, reported by short dependency name
+DEPENDENCIES = {
+    'api.postalpincode.in': 'postal',
+    'api.openweathermap.org': 'openweather',
+    'developer.nrel.gov': 'nrel',
+    'api.gupshup.io': 'gupshup',
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+STEP_DURATION = Histogram(
+    'navyam_step_duration_seconds', 'Time to handle one conversation step, including session load/save',
+    ['step'], buckets=LATENCY_BUCKETS)
+WEBHOOK_EVENTS = Counter(
+    'navyam_webhook_events_total', 'Webhook events received from Gupshup', ['event_type'])
+DUPLICATE_MESSAGES = Counter(
+    'navyam_webhook_duplicate_messages_total', 'Redelivered messages answered from a recorded response', ['source'])
+QUOTE_CACHE_LOOKUPS = Counter(
+    'navyam_quote_cache_lookups_total', 'Step-3 quotes served from (hit) or added to (miss) the quote cache', ['result'])
+CONVERSATION_QUEUE_WAIT = Histogram(
+    'navyam_conversation_queue_wait_seconds', "Time a user message waits behind the sender's earlier messages",
+    buckets=LATENCY_BUCKETS)
+CONVERSATION_QUEUE_DEPTH = Gauge(
+    'navyam_conversation_queue_depth', 'User messages waiting for their conversation lane', multiprocess_mode='livesum')
+CONVERSATION_REJECTED = Counter(
+    'navyam_conversation_backlog_rejected_total', 'User messages rejected because the sender had too many in flight')
+CIRCUIT_BREAKER_OPENED = Counter(
+    'navyam_circuit_breaker_opened_total', 'Times a dependency circuit breaker opened', ['dependency'])
+CIRCUIT_BREAKER_REJECTED = Counter(
+    'navyam_circuit_breaker_rejected_total', 'Calls failed fast by an open circuit breaker', ['dependency'])
+STALE_FALLBACKS = Counter(
+    'navyam_stale_fallbacks_total', 'Lookups answered from last known good data after a dependency failed', ['kind'])
+DEPENDENCY_DURATION = Histogram(
+    'navyam_dependency_duration_seconds', 'Latency of calls to third-party APIs',
+    ['dependency', 'outcome'], buckets=LATENCY_BUCKETS)
+DB_QUERY_DURATION = Histogram(
+    'navyam_db_query_duration_seconds', 'Latency of database queries made through connect_db()',
+    ['operation', 'table'], buckets=DB_BUCKETS)
+DB_CHECKOUT_DURATION = Histogram(
+    'navyam_db_pool_checkout_seconds', 'Time spent waiting for a pooled database connection', buckets=DB_BUCKETS)
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    'navyam_outbound_queue_depth', 'Outbound WhatsApp messages waiting for delivery', multiprocess_mode='livesum')
+OUTBOUND_DELIVERY_DURATION = Histogram(
+    'navyam_outbound_delivery_seconds', 'Time from queueing an outbound message to its delivery',
+    ['outcome'], buckets=LATENCY_BUCKETS)
+
+_QUERY_PATTERN = re.compile(r'^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+))?', re.IGNORECASE | re.DOTALL)
+
+
+def step_label(step):
+    return STEPS.get(step, 'other')
+
+
+def event_label(event_type):
+    return event_type if event_type in EVENT_TYPES else 'other'
+
+
+def dependency_label(host):
+    return DEPENDENCIES.get(host, 'other')
+
+
+def observe_db_query(query, seconds):
+    """Record a query's latency labelled by its SQL verb and (first) table name."""
+    match = _QUERY_PATTERN.match(query)
+    operation = match.group(1).upper() if match else 'OTHER'
+    table = (match.group(2) or '').lower() if match else ''
+    DB_QUERY_DURATION.labels(operation=operation, table=table or 'none').observe(seconds)
+
+
+def render():
+    """Return (body, content_type) for the /metrics endpoint."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
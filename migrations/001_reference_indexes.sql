@@ -0,0 +1,19 @@
+-- Composite, unique lookup keys for the reference tables.
+--
+-- The app filters tariffs by state (ordered by min_slab), multipliers by state and month,
+-- and installation_costs by (location_tier, system_capacity_kW). Uniqueness also stops a
+-- reload from introducing duplicate slabs, months or cost rows; reference_loader.py creates
+-- the same indexes inside its load transaction.
+--
+-- Works on PostgreSQL and SQLite, and is safe to re-run:
+--   psql "$DATABASE_URL" -f migrations/001_reference_indexes.sql
+--   sqlite3 solar.db < migrations/001_reference_indexes.sql
+--
+-- Creating a unique index fails if duplicates already exist; list them first with e.g.
+--   SELECT state, min_slab, COUNT(*) FROM tariffs GROUP BY state, min_slab HAVING COUNT(*) > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tariffs_state_min_slab_key ON tariffs (state, min_slab);
+
+CREATE UNIQUE INDEX IF NOT EXISTS multipliers_state_month_key ON multipliers (state, month);
+
+CREATE UNIQUE INDEX IF NOT EXISTS installation_costs_tier_capacity_key ON installation_costs (location_tier, system_capacity_kW);
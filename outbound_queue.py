@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Background delivery queue for outbound WhatsApp messages.
+
+The webhook hands replies to OutboundQueue.enqueue() and returns to Gupshup
+straight away. Worker threads deliver the messages with retry and exponential
+backoff. Every destination is hashed to one worker lane, so messages to the
+same phone number are always delivered in the order they were queued.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))
+DEFAULT_MAX_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '1000'))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', '5'))
+DEFAULT_BASE_BACKOFF_SECONDS = float(os.getenv('OUTBOUND_BASE_BACKOFF_SECONDS', '0.5'))
+DEFAULT_MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOUND_MAX_BACKOFF_SECONDS', '30'))
+
+_STOP = object()
+
+
+class OutboundQueue:
+    """
+    Bounded, ordered-per-destination delivery queue.
+
+    Parameters:
+    deliver (callable): deliver(message, destination) -> (status_code, response_text).
+    workers (int): Number of delivery threads (lanes).
+    max_queue_size (int): Total number of messages that may wait across all lanes.
+    max_attempts (int): Delivery attempts per message before it is dropped.
+    """
+
+    def __init__(self, deliver, workers=DEFAULT_WORKERS, max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, base_backoff=DEFAULT_BASE_BACKOFF_SECONDS,
+                 max_backoff=DEFAULT_MAX_BACKOFF_SECONDS):
+        self._deliver = deliver
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        lane_size = max(1, max_queue_size // self.workers)
+        self._lanes = [queue.Queue(maxsize=lane_size) for _ in range(self.workers)]
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'failed': 0,
+            'dropped_queue_full': 0,
+            'retries': 0,
+            'latency_seconds_total': 0.0,
+            'latency_seconds_max': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for lane_index, lane in enumerate(self._lanes):
+                thread = threading.Thread(target=self._run, args=(lane,), name=f"outbound-{lane_index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _lane_for(self, destination):
+        return self._lanes[zlib.crc32(str(destination).encode('utf-8')) % self.workers]
+
+    def enqueue(self, message, destination):
+        """Queue a message for delivery. Returns False if the destination's lane is full."""
+        self._ensure_started()
+        try:
+            self._lane_for(destination).put_nowait((message, destination, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped_queue_full'] += 1
+            logger.error("Outbound queue full, dropping message to %s", destination)
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+        metrics.OUTBOUND_QUEUE_DEPTH.inc()
+        return True
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _send_with_retry(self, message, destination):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                status_code, response_text = self._deliver(message, destination)
+                if 200 <= status_code < 300:
+                    return True
+                # Client errors other than rate limiting will not succeed on retry
+                if 400 <= status_code < 500 and status_code != 429:
+                    logger.error("Outbound message to %s rejected: %s %s", destination, status_code, response_text)
+                    return False
+                logger.warning("Outbound message to %s failed with %s (attempt %d)", destination, status_code, attempt)
+            except Exception as e:
+                logger.warning("Outbound message to %s raised %s (attempt %d)", destination, e, attempt)
+
+            if attempt < self.max_attempts:
+                with self._stats_lock:
+                    self._stats['retries'] += 1
+                time.sleep(self._backoff(attempt))
+        return False
+
+    def _run(self, lane):
+        while True:
+            item = lane.get()
+            try:
+                if item is _STOP:
+                    return
+                message, destination, enqueued_at = item
+                metrics.OUTBOUND_QUEUE_DEPTH.dec()
+                delivered = self._send_with_retry(message, destination)
+                latency = time.monotonic() - enqueued_at
+                metrics.OUTBOUND_DELIVERY_DURATION.labels(outcome='delivered' if delivered else 'failed').observe(latency)
+                with self._stats_lock:
+                    if delivered:
+                        self._stats['delivered'] += 1
+                        self._stats['latency_seconds_total'] += latency
+                        self._stats['latency_seconds_max'] = max(self._stats['latency_seconds_max'], latency)
+                    else:
+                        self._stats['failed'] += 1
+            finally:
+                lane.task_done()
+
+    def depth(self):
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['depth'] = self.depth()
+        delivered = snapshot['delivered']
+        snapshot['latency_seconds_avg'] = snapshot['latency_seconds_total'] / delivered if delivered else 0.0
+        return snapshot
+
+    def shutdown(self, timeout=5.0):
+        """Stop the workers after they drain what is already queued, waiting at most timeout seconds."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        for lane in self._lanes:
+            try:
+                lane.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._pid = None
+
+
+def create_outbound_queue(deliver, **kwargs):
+    """Create a queue that drains on interpreter exit."""
+    outbound = OutboundQueue(deliver, **kwargs)
+    atexit.register(outbound.shutdown)
+    return outbound
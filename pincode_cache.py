@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Persistent cache of pincode -> (lat, lon, state) lookups.
+
+Pincode answers from OpenWeather and postalpincode.in never change, so each
+resolved pincode is stored in the pincode_cache table (with a flag for pincodes
+the postal API reports as invalid) and kept in an in-memory LRU in front of it.
+A pincode file bundled with the image can also be loaded into a read-only
+in-memory layer at boot (see warmup.py), which is shared by forked workers.
+
+The table can be pre-warmed from a CSV file with the columns
+pincode,lat,lon,state:
+
+    python pincode_cache.py warm pincodes.csv
+"""
+
+import csv
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LRU_SIZE = int(os.getenv('PINCODE_CACHE_LRU_SIZE', '20000'))
+
+PINCODE_PATTERN = re.compile(r'^[1-9][0-9]{5}$')
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS pincode_cache (
+    pincode TEXT PRIMARY KEY,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    state TEXT,
+    is_valid INTEGER NOT NULL,
+    updated_at DOUBLE PRECISION
+)
+"""
+
+UPSERT_QUERY = """
+INSERT INTO pincode_cache (pincode, lat, lon, state, is_valid, updated_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON CONFLICT (pincode) DO UPDATE SET
+    lat = excluded.lat, lon = excluded.lon, state = excluded.state,
+    is_valid = excluded.is_valid, updated_at = excluded.updated_at
+"""
+
+# is_valid is False for pincodes the postal API says do not exist (a cached negative result)
+PincodeInfo = namedtuple('PincodeInfo', ['pincode', 'lat', 'lon', 'state', 'is_valid'])
+
+
+def normalize_pincode(text):
+    """Strip whitespace from user input and return the pincode, or None if it is not a 6-digit Indian pincode."""
+    pincode = (text or '').strip().replace(' ', '')
+    return pincode if PINCODE_PATTERN.match(pincode) else None
+
+
+class PincodeCache:
+    """
+    Two-level pincode cache: an in-memory LRU backed by the pincode_cache table.
+
+    Parameters:
+    connect_db (callable): Returns a pooled DB-API connection (app.connect_db).
+    lru_size (int): Maximum number of pincodes kept in memory.
+    """
+
+    def __init__(self, connect_db, lru_size=DEFAULT_LRU_SIZE):
+        self._connect_db = connect_db
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._bundled = MappingProxyType({})
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.bundled_hits = 0
+        self.hits = 0
+        self.table_hits = 0
+        self.misses = 0
+
+    def _ensure_table(self, cursor):
+        if not self._table_ready:
+            cursor.execute(CREATE_TABLE_QUERY)
+            self._table_ready = True
+
+    def _remember(self, info):
+        with self._lock:
+            self._lru[info.pincode] = info
+            self._lru.move_to_end(info.pincode)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, pincode):
+        """Return the cached PincodeInfo for the pincode, or None if it has never been resolved."""
+        info = self._bundled.get(pincode)
+        if info is not None:
+            self.bundled_hits += 1
+            return info
+
+        with self._lock:
+            info = self._lru.get(pincode)
+            if info is not None:
+                self._lru.move_to_end(pincode)
+                self.hits += 1
+                return info
+
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute("SELECT pincode, lat, lon, state, is_valid FROM pincode_cache WHERE pincode = %s", (pincode,))
+            row = cursor.fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.table_hits += 1
+        info = PincodeInfo(row[0], row[1], row[2], row[3], bool(row[4]))
+        self._remember(info)
+        return info
+
+    def nearest_known(self, pincode, min_prefix=3, state=None):
+        """
+        The valid cached pincode closest to an unresolved one, for use while the geocoding API is down.
+
+        Candidates share at least the first min_prefix digits (the sorting district) and, if state is
+        given, are in that state; the one with the longest common prefix, then the numerically
+        closest, wins. Returns a PincodeInfo or None.
+        """
+        prefix = pincode[:min_prefix]
+        candidates = [info for code, info in self._bundled.items() if code.startswith(prefix) and info.is_valid]
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute("SELECT pincode, lat, lon, state, is_valid FROM pincode_cache "
+                           "WHERE pincode LIKE %s AND is_valid = 1", (prefix + '%',))
+            candidates.extend(PincodeInfo(row[0], row[1], row[2], row[3], True) for row in cursor.fetchall())
+            conn.commit()
+        finally:
+            conn.close()
+        if state is not None:
+            candidates = [info for info in candidates if info.state == state]
+        if not candidates:
+            return None
+
+        def common_prefix(code):
+            n = 0
+            while n < len(code) and n < len(pincode) and code[n] == pincode[n]:
+                n += 1
+            return n
+
+        return min(candidates, key=lambda info: (-common_prefix(info.pincode), abs(int(info.pincode) - int(pincode))))
+
+    def load_bundled(self, infos):
+        """Replace the read-only layer with the given PincodeInfo rows. Returns the number loaded."""
+        self._bundled = MappingProxyType({info.pincode: info for info in infos})
+        return len(self._bundled)
+
+    def put(self, info):
+        """Store a resolved pincode in both the LRU and the table."""
+        self.put_many([info])
+
+    def put_many(self, infos):
+        """Store many resolved pincodes in one transaction (used for pre-warming)."""
+        infos = list(infos)
+        if not infos:
+            return 0
+        now = time.time()
+        rows = [(i.pincode, i.lat, i.lon, i.state, 1 if i.is_valid else 0, now) for i in infos]
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.executemany(UPSERT_QUERY, rows)
+            conn.commit()
+        finally:
+            conn.close()
+        for info in infos[-self.lru_size:]:
+            self._remember(info)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._lru)
+        return {'bundled_size': len(self._bundled), 'bundled_hits': self.bundled_hits, 'lru_size': size,
+                'lru_hits': self.hits, 'table_hits': self.table_hits, 'misses': self.misses}
+
+
+def read_pincode_file(path):
+    """
+    Yield PincodeInfo rows from a CSV file with a pincode,lat,lon,state header.
+
+    Rows without lat, lon or state are skipped rather than stored as invalid: only the
+    postal API's answer marks a pincode as nonexistent.
+    """
+    skipped = 0
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            pincode = normalize_pincode(row.get('pincode'))
+            if pincode is None:
+                continue
+            lat, lon, state = (row.get('lat') or '').strip(), (row.get('lon') or '').strip(), (row.get('state') or '').strip()
+            if not (lat and lon and state):
+                skipped += 1
+                continue
+            yield PincodeInfo(pincode, float(lat), float(lon), state, True)
+    if skipped:
+        logger.warning("Skipped %d incomplete rows in %s", skipped, path)
+
+
+def warm_from_file(cache, path, batch_size=1000):
+    """Bulk load a pincode file into the cache. Returns the number of pincodes stored."""
+    total = 0
+    batch = []
+    for info in read_pincode_file(path):
+        batch.append(info)
+        if len(batch) >= batch_size:
+            total += cache.put_many(batch)
+            batch = []
+    total += cache.put_many(batch)
+    return total
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'warm':
+        print("Usage: python pincode_cache.py warm <pincodes.csv>")
+        sys.exit(1)
+
+    from dotenv import load_dotenv
+    from db_pool import get_pool
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    cache = PincodeCache(get_pool().connection)
+    count = warm_from_file(cache, sys.argv[2])
+    print(f"Pre-warmed {count} pincodes")
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Location-keyed cache for NREL PVWatts per-kW generation profiles.
+
+PVWatts is always queried for a 1 kW system with a fixed module/loss/tilt/
+azimuth parameter set, so the answer only depends on location. Coordinates are
+snapped to a grid (PVWATTS_GRID_STEP degrees, 0.1 by default, roughly 11 km)
+and the grid cell plus the parameter set is used as the cache key. Results are
+kept in the pvwatts_cache table for PVWATTS_CACHE_TTL_DAYS with a small
+in-memory layer in front of it, so nearby pincodes share a single NREL call.
+
+The 8760-value hourly AC series used by the hourly simulation mode (see
+hourly_simulation.py) is cached the same way in pvwatts_hourly_cache.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRID_STEP = float(os.getenv('PVWATTS_GRID_STEP', '0.1'))
+DEFAULT_TTL_SECONDS = float(os.getenv('PVWATTS_CACHE_TTL_DAYS', '180')) * 24 * 3600
+DEFAULT_MEMORY_SIZE = int(os.getenv('PVWATTS_CACHE_MEMORY_SIZE', '5000'))
+# Hourly series are ~35 KB each in memory
+DEFAULT_HOURLY_MEMORY_SIZE = int(os.getenv('PVWATTS_HOURLY_CACHE_MEMORY_SIZE', '200'))
+HOURS_PER_YEAR = 8760
+
+# Parameter set sent to PVWatts for every request (per kW of installed capacity)
+PVWATTS_PARAMS = {
+    'system_capacity': 1,
+    'module_type': 1,
+    'losses': 10,
+    'array_type': 1,
+    'tilt': 20,
+    'azimuth': 180,
+}
+
+CREATE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS pvwatts_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,
+    ac_monthly TEXT NOT NULL,
+    solrad_annual DOUBLE PRECISION NOT NULL,
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+)
+"""
+
+UPSERT_QUERY = """
+INSERT INTO pvwatts_cache (lat_cell, lon_cell, params_key, ac_monthly, solrad_annual, fetched_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON CONFLICT (lat_cell, lon_cell, params_key) DO UPDATE SET
+    ac_monthly = excluded.ac_monthly, solrad_annual = excluded.solrad_annual, fetched_at = excluded.fetched_at
+"""
+
+CREATE_HOURLY_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS pvwatts_hourly_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,
+    ac_hourly TEXT NOT NULL,
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+)
+"""
+
+UPSERT_HOURLY_QUERY = """
+INSERT INTO pvwatts_hourly_cache (lat_cell, lon_cell, params_key, ac_hourly, fetched_at)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (lat_cell, lon_cell, params_key) DO UPDATE SET
+    ac_hourly = excluded.ac_hourly, fetched_at = excluded.fetched_at
+"""
+
+
+def params_key(params=None):
+    """Stable string for a PVWatts parameter set, e.g. 'array_type=1&azimuth=180&...'."""
+    params = PVWATTS_PARAMS if params is None else params
+    return '&'.join(f"{name}={params[name]}" for name in sorted(params))
+
+
+def grid_cell(lat, lon, step=DEFAULT_GRID_STEP):
+    """Snap coordinates to the nearest grid point, e.g. (26.8468, 75.7924) -> (26.8, 75.8)."""
+    return round(round(float(lat) / step) * step, 4), round(round(float(lon) / step) * step, 4)
+
+
+class PVWattsCache:
+    """
+    Durable cache of (ac_monthly, solrad_annual) per grid cell and parameter set.
+
+    Parameters:
+    connect_db (callable): Returns a pooled DB-API connection (app.connect_db).
+    ttl_seconds (float): Age after which a cached profile is fetched again.
+    grid_step (float): Grid size in degrees used to quantize coordinates.
+    """
+
+    def __init__(self, connect_db, ttl_seconds=DEFAULT_TTL_SECONDS, grid_step=DEFAULT_GRID_STEP,
+                 memory_size=DEFAULT_MEMORY_SIZE):
+        self._connect_db = connect_db
+        self.ttl_seconds = ttl_seconds
+        self.grid_step = grid_step
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # (lat_cell, lon_cell, params_key) -> (ac_monthly, solrad_annual, fetched_at)
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def cell(self, lat, lon):
+        return grid_cell(lat, lon, self.grid_step)
+
+    def _ensure_table(self, cursor):
+        if not self._table_ready:
+            cursor.execute(CREATE_TABLE_QUERY)
+            self._table_ready = True
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, lat_cell, lon_cell, key=None, allow_stale=False):
+        """
+        Return (ac_monthly, solrad_annual) for the cell if cached and fresh, else None.
+
+        With allow_stale an expired profile is returned too (the last known good value while NREL is down).
+        """
+        cache_key = (lat_cell, lon_cell, key or params_key())
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(cache_key)
+        if entry is None:
+            conn = self._connect_db()
+            try:
+                cursor = conn.cursor()
+                self._ensure_table(cursor)
+                cursor.execute(
+                    "SELECT ac_monthly, solrad_annual, fetched_at FROM pvwatts_cache "
+                    "WHERE lat_cell = %s AND lon_cell = %s AND params_key = %s", cache_key)
+                row = cursor.fetchone()
+                conn.commit()
+            finally:
+                conn.close()
+            if row is not None:
+                entry = (json.loads(row[0]), float(row[1]), float(row[2]))
+                self._remember(cache_key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        if now - entry[2] > self.ttl_seconds:
+            if not allow_stale:
+                self.misses += 1
+                return None
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, lat_cell, lon_cell, ac_monthly, solrad_annual, key=None):
+        """Store a freshly fetched profile for the cell."""
+        cache_key = (lat_cell, lon_cell, key or params_key())
+        fetched_at = time.time()
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute(UPSERT_QUERY, cache_key + (json.dumps(list(ac_monthly)), float(solrad_annual), fetched_at))
+            conn.commit()
+        finally:
+            conn.close()
+        self._remember(cache_key, (list(ac_monthly), float(solrad_annual), fetched_at))
+
+    def stats(self):
+        with self._lock:
+            size = len(self._memory)
+        return {'memory_size': size, 'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
+
+
+def encode_hourly(ac_hourly):
+    """Base64 of the little-endian float32 series (a text column works on every backend)."""
+    return base64.b64encode(np.asarray(ac_hourly, dtype='<f4').tobytes()).decode('ascii')
+
+
+def decode_hourly(text):
+    return np.frombuffer(base64.b64decode(text), dtype='<f4').astype(float)
+
+
+class PVWattsHourlyCache:
+    """
+    Durable cache of the hourly AC output (kWh per kW for each of the 8760 hours) per grid cell.
+
+    Parameters:
+    connect_db (callable): Returns a pooled DB-API connection (app.connect_db).
+    ttl_seconds (float): Age after which a cached series is fetched again.
+    grid_step (float): Grid size in degrees used to quantize coordinates.
+    """
+
+    def __init__(self, connect_db, ttl_seconds=DEFAULT_TTL_SECONDS, grid_step=DEFAULT_GRID_STEP,
+                 memory_size=DEFAULT_HOURLY_MEMORY_SIZE):
+        self._connect_db = connect_db
+        self.ttl_seconds = ttl_seconds
+        self.grid_step = grid_step
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # (lat_cell, lon_cell, params_key) -> (read-only ndarray, fetched_at)
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _ensure_table(self, cursor):
+        if not self._table_ready:
+            cursor.execute(CREATE_HOURLY_TABLE_QUERY)
+            self._table_ready = True
+
+    def _remember(self, key, ac_hourly, fetched_at):
+        ac_hourly.setflags(write=False)
+        with self._lock:
+            self._memory[key] = (ac_hourly, fetched_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, lat_cell, lon_cell, key=None, allow_stale=False):
+        """Return the cell's read-only hourly series if cached and fresh (or expired, with allow_stale), else None."""
+        cache_key = (lat_cell, lon_cell, key or params_key())
+        with self._lock:
+            entry = self._memory.get(cache_key)
+        if entry is None:
+            conn = self._connect_db()
+            try:
+                cursor = conn.cursor()
+                self._ensure_table(cursor)
+                cursor.execute(
+                    "SELECT ac_hourly, fetched_at FROM pvwatts_hourly_cache "
+                    "WHERE lat_cell = %s AND lon_cell = %s AND params_key = %s", cache_key)
+                row = cursor.fetchone()
+                conn.commit()
+            finally:
+                conn.close()
+            if row is not None:
+                entry = (decode_hourly(row[0]), float(row[1]))
+                self._remember(cache_key, *entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.time() - entry[1] > self.ttl_seconds:
+            if not allow_stale:
+                self.misses += 1
+                return None
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry[0]
+
+    def put(self, lat_cell, lon_cell, ac_hourly, key=None):
+        """Store a freshly fetched hourly series for the cell."""
+        ac_hourly = np.asarray(ac_hourly, dtype=float)
+        if ac_hourly.shape != (HOURS_PER_YEAR,):
+            raise ValueError(f"Expected {HOURS_PER_YEAR} hourly values, got {ac_hourly.shape}")
+        cache_key = (lat_cell, lon_cell, key or params_key())
+        fetched_at = time.time()
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute(UPSERT_HOURLY_QUERY, cache_key + (encode_hourly(ac_hourly), fetched_at))
+            conn.commit()
+        finally:
+            conn.close()
+        # Keep exactly what a later read from the table would return
+        self._remember(cache_key, decode_hourly(encode_hourly(ac_hourly)), fetched_at)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._memory)
+        return {'memory_size': size, 'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Memoization of computed quotes keyed on normalized conversation inputs.
+
+Users in the same area tend to enter similar numbers, so the step-3 quote is
+cached on (state, PVWatts grid cell, bill month, bill, num_acs, rooftop area,
+location tier, simulation mode, reference data version). By default the bill
+in the key is the one the user entered and the quote is computed from the
+exact step-2 consumption, so a cached quote is exactly the one the user would
+get without the cache.
+
+QUOTE_BILL_ROUNDING (rupees, 0 by default) trades that for a higher hit rate,
+and the change is visible to users. Bills are rounded to the nearest multiple
+before keying, and the quote is computed from the rounded bill so that it
+depends only on its key. A user who enters 12,040 is then quoted, and shown
+savings, as if the bill were 12,000.
+
+The reference data version covers tariffs, multipliers and installation
+costs. When a new version is seen every entry of the older one is dropped at
+once (reported as an invalidation), so reloaded data never serves a stale
+quote and old entries do not linger until they are evicted.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_MAX_SIZE = int(os.getenv('QUOTE_CACHE_SIZE', '5000'))
+BILL_ROUNDING = float(os.getenv('QUOTE_BILL_ROUNDING', '0'))
+
+
+def normalize_bill(bill, rounding=BILL_ROUNDING):
+    """Round a bill amount to the nearest `rounding` rupees (unchanged if rounding is 0)."""
+    if not rounding:
+        return float(bill)
+    return float(round(float(bill) / rounding) * rounding)
+
+
+class QuoteCache:
+    """
+    Size-bounded LRU of quote results for one reference data version.
+
+    Parameters:
+    max_size (int): Maximum number of quotes kept; 0 disables the cache.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key, version, compute):
+        """
+        Return the cached result for key under the data version, computing and storing it on a miss.
+
+        Parameters:
+        key (tuple): Normalized quote inputs (without the version).
+        version (str): Reference data version the result is computed with.
+        compute (callable): No-argument function returning the result; called outside the lock.
+
+        Returns:
+        The result of compute() for this key, possibly from an earlier call.
+        """
+        with self._lock:
+            self._check_version(version)
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.QUOTE_CACHE_LOOKUPS.labels(result='hit').inc()
+                return result
+            self.misses += 1
+        metrics.QUOTE_CACHE_LOOKUPS.labels(result='miss').inc()
+
+        # Concurrent misses on one key may both compute; the results are identical
+        result = compute()
+        if self.max_size > 0:
+            with self._lock:
+                if self._version == version:
+                    self._entries[key] = result
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return result
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {'size': size, 'max_size': self.max_size, 'version': self._version, 'hits': self.hits,
+                'misses': self.misses, 'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations}
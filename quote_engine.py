@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Vectorized evaluation of candidate solar system sizes for a quote.
+
+Instead of recomputing generation, savings, cost, ROI and terrace coverage in
+one scalar block per option, a whole grid of system sizes is evaluated against
+the 12-month consumption vector in one NumPy pass. The arithmetic mirrors
+calculate_monthly_savings_with_solar() in app.py, including the int()
+truncation of consumption and generation; bills come from a TariffIndex.
+"""
+
+import numpy as np
+
+from tariff_index import TariffIndex
+
+SQ_FT_PER_KW = 120  # 1 kW requires 120 sq ft of area
+MAX_SYSTEM_SIZE_KW = 15
+
+
+def evaluate_system_sizes(system_sizes, monthly_consumption, ac_monthly, tariffs, final_cost_for_size, rooftop_area):
+    """
+    Evaluate a grid of system sizes in one pass.
+
+    Parameters:
+    system_sizes (list): Candidate system sizes in kW.
+    monthly_consumption (list): 12 monthly consumption values (kWh).
+    ac_monthly (list): 12 monthly AC outputs per kW of capacity (kWh) from NREL.
+    tariffs (TariffIndex or list): The state's compiled tariffs (or the raw slab list).
+    final_cost_for_size (callable): Size in kW -> cost after subsidy (calculate_cost_and_subsidy).
+    rooftop_area (float): Rooftop area in square feet.
+
+    Returns:
+    (list, int): One dict per size with system_size, yearly_savings, final_cost, roi and
+    terrace_coverage, and the index of the option with the highest ROI (first one on ties).
+    """
+    tariff_index = tariffs if isinstance(tariffs, TariffIndex) else TariffIndex(tariffs)
+    sizes = np.asarray(system_sizes, dtype=float)
+    consumption = np.asarray(monthly_consumption, dtype=float).astype(np.int64)
+    generation_per_kw = np.asarray(ac_monthly, dtype=float)
+
+    # (sizes x months) generation, truncated like int(generation) in the scalar code
+    generation = (sizes[:, None] * generation_per_kw[None, :]).astype(np.int64)
+    reduced_consumption = np.maximum(0, consumption[None, :] - generation)
+
+    original_bills = tariff_index.bills_for_units(consumption)
+    reduced_bills = tariff_index.bills_for_units(reduced_consumption)
+    yearly_savings = (original_bills[None, :] - reduced_bills).sum(axis=1)
+
+    final_costs = np.array([float(final_cost_for_size(size)) for size in system_sizes])
+    roi = np.round(yearly_savings / final_costs * 100, 1)
+    terrace_coverage = np.round(sizes * SQ_FT_PER_KW / rooftop_area * 100, 1)
+
+    options = []
+    for i, size in enumerate(system_sizes):
+        options.append({
+            'system_size': size,
+            'yearly_savings': float(yearly_savings[i]),
+            'final_cost': float(final_costs[i]),
+            'roi': float(roi[i]),
+            'terrace_coverage': float(terrace_coverage[i]),
+        })
+    return options, int(np.argmax(roi))
+
+
+def candidate_sizes(recommended_system_size):
+    """The three sizes offered to the user: size-1, size, size+1, or 1, 2, 3 for systems of 1 kW or less."""
+    if recommended_system_size > 1:
+        return [recommended_system_size - 1, recommended_system_size, recommended_system_size + 1]
+    return [1, 2, 3]
+
+
+def format_option(option_num, option):
+    """WhatsApp text for one quote option."""
+    return (
+        f"Option {option_num}: \n"
+        f"System size: {option['system_size']} kW\n"
+        f"Estimated cost: Around ₹{round(option['final_cost'] / 100000, 1)} Lakhs after subsidy.\n"
+        f"Terrace Coverage: Around {option['terrace_coverage']}%.\n"
+        f"Estimated yearly savings: ₹{round(option['yearly_savings'] / 1000, 1)} Thousand.\n"
+        f"Estimated ROI: {option['roi']}% every year.\n\n"
+    )
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""In-process cache for the tariffs, multipliers and installation_costs tables.
+
+The three tables hold a few dozen rows and change a handful of times a year,
+so they are loaded together into an immutable snapshot and served from memory.
+Snapshots are built from read-only mappings and tuples, so one loaded in the
+gunicorn master before forking (see warmup.py) is safely shared by all workers.
+The snapshot is refreshed once it is older than REFERENCE_DATA_TTL_SECONDS or
+when reload() is called (see the /admin/reload-reference-data route in app.py).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from system_optimizer import CostCurve
+from tariff_index import TariffIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = float(os.getenv('REFERENCE_DATA_TTL_SECONDS', '3600'))
+DEFAULT_STATE = "Rajasthan"
+
+# All three tables in one round trip: (table, key, month, n1, n2, n3, n4, n5) rows where
+# tariffs:            state, NULL, min_slab, max_slab, fixed, variable, max_bill
+# multipliers:        state, month, id, NULL, multiplier, NULL, NULL
+# installation_costs: location_tier, NULL, system_capacity_kW, NULL, overall_cost, NULL, NULL
+REFERENCE_QUERY = """
+SELECT 'tariffs' AS source, state AS key, NULL AS month, min_slab AS n1, max_slab AS n2,
+       CAST(fixed AS DOUBLE PRECISION) AS n3, CAST(variable AS DOUBLE PRECISION) AS n4,
+       CAST(max_bill AS DOUBLE PRECISION) AS n5
+FROM tariffs
+UNION ALL
+SELECT 'multipliers', state, month, id, NULL, CAST(multiplier AS DOUBLE PRECISION), NULL, NULL
+FROM multipliers
+UNION ALL
+SELECT 'installation_costs', location_tier, NULL, system_capacity_kW, NULL, CAST(overall_cost AS DOUBLE PRECISION), NULL, NULL
+FROM installation_costs
+ORDER BY source, key, n1
+"""
+
+# Lookup keys of the reference tables (migrations/001_reference_indexes.sql); unique so a
+# reload cannot introduce duplicate slabs, months or cost rows
+REFERENCE_INDEX_QUERIES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS tariffs_state_min_slab_key ON tariffs (state, min_slab)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS multipliers_state_month_key ON multipliers (state, month)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS installation_costs_tier_capacity_key "
+    "ON installation_costs (location_tier, system_capacity_kW)",
+]
+
+# Read-only mappings and tuples of:
+# tariffs:            {state: ({'min_slab', 'max_slab', 'fixed', 'variable', 'max_bill'}, ...)}
+# multipliers:        {state: {'Jan': 0.8, 'Feb': 1.0, ...}} in calendar order
+# installation_costs: {(location_tier, system_capacity_kW): overall_cost}
+ReferenceSnapshot = namedtuple('ReferenceSnapshot', ['version', 'loaded_at', 'tariffs', 'multipliers', 'installation_costs'])
+
+
+def load_reference_snapshot(connect_db):
+    """
+    Read all three reference tables with one query over a single pooled connection.
+
+    Parameters:
+    connect_db (callable): Returns a DB-API connection (app.connect_db).
+
+    Returns:
+    ReferenceSnapshot: Freshly loaded data with a content-derived version.
+    """
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(REFERENCE_QUERY)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    tariff_rows, multiplier_rows, cost_rows = [], [], []
+    for source, key, month, n1, n2, n3, n4, n5 in rows:
+        if source == 'tariffs':
+            tariff_rows.append((key, n1, n2, n3, n4, n5))
+        elif source == 'multipliers':
+            multiplier_rows.append((key, month, n3))
+        else:
+            cost_rows.append((key, n1, n3))
+    return build_snapshot(tariff_rows, multiplier_rows, cost_rows)
+
+
+def build_snapshot(tariff_rows, multiplier_rows, cost_rows):
+    """Convert raw table rows into a ReferenceSnapshot."""
+    tariffs = {}
+    for state, min_slab, max_slab, fixed, variable, max_bill in tariff_rows:
+        tariffs.setdefault(state, []).append({
+            'min_slab': int(min_slab),
+            'max_slab': int(max_slab),
+            'fixed': float(fixed),
+            'variable': float(variable),
+            'max_bill': float(max_bill) if max_bill is not None else None
+        })
+
+    multipliers = {}
+    for state, month, multiplier in multiplier_rows:
+        multipliers.setdefault(state, {})[month] = float(multiplier)
+
+    installation_costs = {}
+    for location_tier, system_capacity, overall_cost in cost_rows:
+        installation_costs[(location_tier, int(system_capacity))] = float(overall_cost)
+
+    # Same data gives the same version in every worker, so it can be used in cache keys
+    digest = hashlib.sha1(repr((
+        sorted((state, [sorted(slab.items()) for slab in slabs]) for state, slabs in tariffs.items()),
+        sorted((state, list(months.items())) for state, months in multipliers.items()),
+        sorted(installation_costs.items()),
+    )).encode('utf-8')).hexdigest()[:12]
+
+    return ReferenceSnapshot(
+        digest, time.time(),
+        MappingProxyType({state: tuple(MappingProxyType(slab) for slab in slabs) for state, slabs in tariffs.items()}),
+        MappingProxyType({state: MappingProxyType(months) for state, months in multipliers.items()}),
+        MappingProxyType(installation_costs))
+
+
+def snapshot_rows(snapshot):
+    """
+    The (tariff_rows, multiplier_rows, cost_rows) that build_snapshot() turns back into snapshot.
+
+    Unlike the snapshot's read-only mappings the rows can be pickled, e.g. to hand the snapshot
+    to batch_quote.py's worker processes.
+    """
+    tariff_rows = [(state, slab['min_slab'], slab['max_slab'], slab['fixed'], slab['variable'], slab['max_bill'])
+                   for state, slabs in snapshot.tariffs.items() for slab in slabs]
+    multiplier_rows = [(state, month, multiplier)
+                       for state, months in snapshot.multipliers.items() for month, multiplier in months.items()]
+    cost_rows = [(location_tier, system_capacity, overall_cost)
+                 for (location_tier, system_capacity), overall_cost in snapshot.installation_costs.items()]
+    return tariff_rows, multiplier_rows, cost_rows
+
+
+class ReferenceDataCache:
+    """
+    Thread-safe holder of the current ReferenceSnapshot.
+
+    Readers never block on the database once a snapshot is loaded: when the TTL
+    expires one thread reloads while the others keep using the previous snapshot.
+    If a reload fails the old snapshot is kept and retried after the next TTL.
+    """
+
+    def __init__(self, loader, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._snapshot = None
+        self._expires_at = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload_count = 0
+        self._tariff_indexes = {}  # (version, state) -> TariffIndex
+        self._cost_curves = {}  # (version, location_tier) -> CostCurve
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires_at:
+            return snapshot
+        if snapshot is None:
+            # Nothing to serve yet, so every caller waits for the first load
+            with self._reload_lock:
+                if self._snapshot is None:
+                    self._load_locked()
+            return self._snapshot
+        # Stale: refresh in this thread only if nobody else is already doing it
+        if self._reload_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() >= self._expires_at:
+                    try:
+                        self._load_locked()
+                    except Exception as e:
+                        logger.error("Reference data reload failed, serving version %s: %s", snapshot.version, e)
+                        self._expires_at = time.monotonic() + self.ttl_seconds
+            finally:
+                self._reload_lock.release()
+        return self._snapshot
+
+    def reload(self):
+        """Force a reload now and return the new snapshot."""
+        with self._reload_lock:
+            self._load_locked()
+            return self._snapshot
+
+    def _load_locked(self):
+        snapshot = self._loader()
+        previous = self._snapshot
+        self._snapshot = snapshot
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        self.reload_count += 1
+        self._tariff_indexes = {}
+        self._cost_curves = {}
+        if previous is None or previous.version != snapshot.version:
+            logger.info("Loaded reference data version %s (%d tariff states, %d multiplier states, %d cost rows)",
+                        snapshot.version, len(snapshot.tariffs), len(snapshot.multipliers), len(snapshot.installation_costs))
+
+    def tariffs_for_state(self, state):
+        """Slab list for the state, falling back to the default state's tariffs."""
+        snapshot = self.get()
+        tariffs = snapshot.tariffs.get(state)
+        if not tariffs:
+            logger.debug("No tariffs found for %s. Using %s's tariffs as default.", state, DEFAULT_STATE)
+            tariffs = snapshot.tariffs.get(DEFAULT_STATE, ())
+        return tariffs
+
+    def tariff_index_for_state(self, state):
+        """Compiled TariffIndex for the state's tariffs, built once per snapshot version."""
+        snapshot = self.get()
+        key = (snapshot.version, state)
+        index = self._tariff_indexes.get(key)
+        if index is None:
+            index = TariffIndex(self.tariffs_for_state(state))
+            self._tariff_indexes[key] = index
+        return index
+
+    def multipliers_for_state(self, state):
+        """Month -> multiplier mapping for the state, falling back to the default state."""
+        snapshot = self.get()
+        multipliers = snapshot.multipliers.get(state)
+        if not multipliers:
+            logger.debug("No multipliers found for %s. Using %s's multipliers as default.", state, DEFAULT_STATE)
+            multipliers = snapshot.multipliers.get(DEFAULT_STATE, MappingProxyType({}))
+        return multipliers
+
+    def installation_cost(self, location_tier, system_capacity):
+        """Overall installation cost for the tier and size, or None if not in the table."""
+        return self.get().installation_costs.get((location_tier, system_capacity))
+
+    def cost_curve_for_tier(self, location_tier):
+        """Interpolating CostCurve over the tier's installation costs, built once per snapshot version."""
+        snapshot = self.get()
+        key = (snapshot.version, location_tier)
+        curve = self._cost_curves.get(key)
+        if curve is None:
+            curve = CostCurve.from_installation_costs(snapshot.installation_costs, location_tier)
+            self._cost_curves[key] = curve
+        return curve
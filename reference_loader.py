@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Bulk loader for the tariffs, multipliers and installation_costs reference tables.
+
+Replaces the row-by-row update scripts (update_queries.py, max_bill_calc).
+It reads the pipe-delimited, header-less CSVs in the db-init format:
+
+    tariffs.csv             id|state|min_slab|max_slab|fixed|variable|max_bill
+    multipliers.csv         id|state|month|multiplier
+    installation_costs.csv  id|location_tier|system_capacity_kW|overall_cost
+
+max_bill is always derived as fixed + max_slab * variable (NULL for the open-
+ended slab) in one NumPy pass, so the column in the file may be left empty.
+The three tables are validated first and then replaced in a single transaction:
+the rows are bulk-inserted with COPY on Postgres and executemany on SQLite, and
+a row is added to reference_data_versions. Readers see either the old dataset
+or the new one, never a mix.
+
+    python reference_loader.py load --dir db-init
+    python reference_loader.py load --dir new-tariffs --notify http://localhost:8000/admin/reload-reference-data
+    python reference_loader.py versions
+
+The version is the same content hash that /stats reports as
+reference_data_version (see reference_data.build_snapshot).
+"""
+
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from reference_data import REFERENCE_INDEX_QUERIES, build_snapshot
+
+logger = logging.getLogger(__name__)
+
+OPEN_ENDED_SLAB = 999999
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+TABLE_COLUMNS = {
+    'tariffs': ['id', 'state', 'min_slab', 'max_slab', 'fixed', 'variable', 'max_bill'],
+    'multipliers': ['id', 'state', 'month', 'multiplier'],
+    'installation_costs': ['id', 'location_tier', 'system_capacity_kW', 'overall_cost'],
+}
+# Columns that may be left empty; every other cell is required
+OPTIONAL_COLUMNS = {'tariffs': {'max_bill'}}
+
+CREATE_VERSIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS reference_data_versions (
+    version TEXT NOT NULL,
+    loaded_at DOUBLE PRECISION NOT NULL,
+    source TEXT,
+    tariff_rows INTEGER NOT NULL,
+    multiplier_rows INTEGER NOT NULL,
+    cost_rows INTEGER NOT NULL
+)
+"""
+
+
+class ReferenceDataError(ValueError):
+    """Raised when the input files fail validation; nothing is written."""
+
+
+def read_table(path, table):
+    """Rows of a pipe-delimited CSV as lists of strings (None for empty optional values)."""
+    columns = TABLE_COLUMNS[table]
+    optional = OPTIONAL_COLUMNS.get(table, set())
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f, delimiter='|'), 1):
+            if not row:
+                continue
+            if len(row) != len(columns):
+                raise ReferenceDataError(f"{path}:{line_number}: expected {len(columns)} columns, got {len(row)}")
+            values = [value.strip() or None for value in row]
+            empty = [column for column, value in zip(columns, values) if value is None and column not in optional]
+            if empty:
+                raise ReferenceDataError(f"{path}:{line_number}: empty {', '.join(empty)}")
+            rows.append(values)
+    return rows
+
+
+def derive_max_bill(max_slab, fixed, variable):
+    """Vectorized max_bill = fixed + max_slab * variable, NaN for the open-ended slab."""
+    max_slab = np.asarray(max_slab, dtype=float)
+    return np.where(max_slab >= OPEN_ENDED_SLAB, np.nan,
+                    np.asarray(fixed, dtype=float) + max_slab * np.asarray(variable, dtype=float))
+
+
+def add_fixed_installation_costs(system_capacity, variable_cost):
+    """Overall cost for variable-only cost rows: + 50k below 4 kW, 100k below 7 kW, 150k above."""
+    system_capacity = np.asarray(system_capacity, dtype=float)
+    fixed_cost = np.select([system_capacity < 4, system_capacity < 7], [50000.0, 100000.0], 150000.0)
+    return fixed_cost + np.asarray(variable_cost, dtype=float)
+
+
+def prepare_tariffs(rows):
+    """Typed tariff rows with max_bill recomputed; validates that each state's slabs are contiguous."""
+    if not rows:
+        raise ReferenceDataError("tariffs: no rows")
+    ids = [int(row[0]) for row in rows]
+    states = [row[1] for row in rows]
+    min_slab = np.array([int(row[2]) for row in rows])
+    max_slab = np.array([int(row[3]) for row in rows])
+    fixed = np.array([float(row[4]) for row in rows])
+    variable = np.array([float(row[5]) for row in rows])
+
+    if (variable <= 0).any():
+        raise ReferenceDataError("tariffs: variable rate must be positive")
+    if (max_slab < min_slab).any():
+        raise ReferenceDataError("tariffs: max_slab below min_slab")
+    max_bill = derive_max_bill(max_slab, fixed, variable)
+
+    by_state = {}
+    for i, state in enumerate(states):
+        by_state.setdefault(state, []).append(i)
+    for state, indexes in by_state.items():
+        indexes.sort(key=lambda i: min_slab[i])
+        for previous, current in zip(indexes, indexes[1:]):
+            if min_slab[current] != max_slab[previous] + 1:
+                raise ReferenceDataError(f"tariffs: {state} slabs are not contiguous at {min_slab[current]}")
+        if max_slab[indexes[-1]] < OPEN_ENDED_SLAB:
+            raise ReferenceDataError(f"tariffs: {state} has no open-ended top slab")
+
+    return [(ids[i], states[i], int(min_slab[i]), int(max_slab[i]), float(fixed[i]), float(variable[i]),
+             None if np.isnan(max_bill[i]) else float(max_bill[i])) for i in range(len(rows))]
+
+
+def prepare_multipliers(rows):
+    """Typed multiplier rows; validates that every state has all 12 months."""
+    if not rows:
+        raise ReferenceDataError("multipliers: no rows")
+    prepared = [(int(row[0]), row[1], row[2], float(row[3])) for row in rows]
+    months_by_state = {}
+    for _, state, month, multiplier in prepared:
+        if month not in MONTHS:
+            raise ReferenceDataError(f"multipliers: unknown month {month!r} for {state}")
+        if multiplier <= 0:
+            raise ReferenceDataError(f"multipliers: {state} {month} must be positive")
+        months_by_state.setdefault(state, set()).add(month)
+    for state, months in months_by_state.items():
+        if len(months) != 12:
+            raise ReferenceDataError(f"multipliers: {state} is missing {sorted(set(MONTHS) - months)}")
+    return prepared
+
+
+def prepare_installation_costs(rows, add_fixed_costs=False):
+    """Typed installation cost rows, optionally adding the tiered fixed cost to variable-only rows."""
+    if not rows:
+        raise ReferenceDataError("installation_costs: no rows")
+    capacity = np.array([int(row[2]) for row in rows])
+    cost = np.array([float(row[3]) for row in rows])
+    if add_fixed_costs:
+        cost = add_fixed_installation_costs(capacity, cost)
+    return [(int(row[0]), row[1], int(capacity[i]), float(cost[i])) for i, row in enumerate(rows)]
+
+
+def dataset_version(datasets):
+    """Content version of prepared datasets, computed exactly as for a snapshot loaded from the tables."""
+    # Same row order as the reference_data queries (tariffs by state, min_slab; multipliers by state, id)
+    tariffs = sorted(datasets['tariffs'], key=lambda row: (row[1], row[2]))
+    multipliers = sorted(datasets['multipliers'], key=lambda row: (row[1], row[0]))
+    return build_snapshot([row[1:] for row in tariffs], [row[1:] for row in multipliers],
+                          [row[1:] for row in datasets['installation_costs']]).version
+
+
+def _copy_rows(cursor, table, rows):
+    """COPY rows into a Postgres table from an in-memory buffer."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='|', lineterminator='\n')
+    writer.writerows(['' if value is None else value for value in row] for row in rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(TABLE_COLUMNS[table])}) FROM STDIN WITH (FORMAT csv, DELIMITER '|')",
+                       buffer)
+
+
+def replace_reference_data(conn, datasets, source, postgres=False):
+    """
+    Replace the three tables and record the version, all in one transaction.
+
+    Parameters:
+    conn: DB-API connection (a pooled connection from db_pool).
+    datasets (dict): table name -> prepared rows.
+    source (str): Where the data came from, stored with the version.
+    postgres (bool): Use COPY instead of executemany.
+
+    Returns:
+    str: The new version.
+    """
+    version = dataset_version(datasets)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_VERSIONS_TABLE_QUERY)
+        # Unique lookup keys: duplicate rows in the new data fail the load and roll it back
+        for query in REFERENCE_INDEX_QUERIES:
+            cursor.execute(query)
+        for table, rows in datasets.items():
+            cursor.execute(f"DELETE FROM {table}")
+            if postgres:
+                _copy_rows(cursor, table, rows)
+            else:
+                columns = TABLE_COLUMNS[table]
+                cursor.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows)
+        cursor.execute(
+            "INSERT INTO reference_data_versions (version, loaded_at, source, tariff_rows, multiplier_rows, cost_rows) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (version, time.time(), source, len(datasets['tariffs']), len(datasets['multipliers']),
+             len(datasets['installation_costs'])))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+
+def list_versions(conn, limit=20):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_VERSIONS_TABLE_QUERY)
+    cursor.execute("SELECT version, loaded_at, source, tariff_rows, multiplier_rows, cost_rows "
+                   "FROM reference_data_versions ORDER BY loaded_at DESC LIMIT %s", (limit,))
+    rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the reference data tables from pipe-delimited CSVs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load = subparsers.add_parser('load', help="Validate and atomically replace the reference tables")
+    load.add_argument('--dir', default='db-init', help="Directory with tariffs.csv, multipliers.csv, installation_costs.csv")
+    load.add_argument('--add-fixed-install-costs', action='store_true',
+                      help="installation_costs.csv holds variable costs only; add the tiered fixed cost")
+    load.add_argument('--dry-run', action='store_true', help="Validate and print the version without writing")
+    load.add_argument('--notify', metavar='URL', help="POST here afterwards, e.g. the app's /admin/reload-reference-data")
+    versions = subparsers.add_parser('versions', help="List recently loaded versions")
+    versions.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--database-url', default=None, help="Defaults to DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from db_pool import get_pool
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    database_url = args.database_url or os.getenv('DATABASE_URL')
+
+    if args.command == 'versions':
+        conn = get_pool(database_url).connection()
+        try:
+            for version, loaded_at, source, tariff_rows, multiplier_rows, cost_rows in list_versions(conn, args.limit):
+                print(f"{version}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(loaded_at))}  "
+                      f"{tariff_rows} tariffs, {multiplier_rows} multipliers, {cost_rows} costs  {source}")
+        finally:
+            conn.close()
+        return 0
+
+    started = time.monotonic()
+    try:
+        datasets = {
+            'tariffs': prepare_tariffs(read_table(os.path.join(args.dir, 'tariffs.csv'), 'tariffs')),
+            'multipliers': prepare_multipliers(read_table(os.path.join(args.dir, 'multipliers.csv'), 'multipliers')),
+            'installation_costs': prepare_installation_costs(
+                read_table(os.path.join(args.dir, 'installation_costs.csv'), 'installation_costs'),
+                args.add_fixed_install_costs),
+        }
+    except (OSError, ValueError) as e:
+        print(f"Not loading: {e}", file=sys.stderr)
+        return 1
+
+    if args.dry_run:
+        version = dataset_version(datasets)
+        print(f"Valid: version {version} ({', '.join(f'{len(rows)} {table}' for table, rows in datasets.items())})")
+        return 0
+
+    pool = get_pool(database_url)
+    conn = pool.connection()
+    try:
+        version = replace_reference_data(conn, datasets, os.path.abspath(args.dir), postgres=pool.paramstyle != 'qmark')
+    finally:
+        conn.close()
+    print(f"Loaded reference data version {version} in {time.monotonic() - started:.2f}s")
+
+    if args.notify:
+        import http_client
+
+        response = http_client.post(args.notify, headers={'X-Admin-Token': os.getenv('ADMIN_TOKEN', '')})
+        print(f"Notified {args.notify}: {response.status_code}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
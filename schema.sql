@@ -21,3 +21,52 @@ CREATE TABLE installation_costs (
     system_capacity_kW INTEGER,
     overall_cost NUMERIC
 );
+
+-- Lookup keys of the reference tables (migrations/001_reference_indexes.sql for existing databases)
+CREATE UNIQUE INDEX tariffs_state_min_slab_key ON tariffs (state, min_slab);
+CREATE UNIQUE INDEX multipliers_state_month_key ON multipliers (state, month);
+CREATE UNIQUE INDEX installation_costs_tier_capacity_key ON installation_costs (location_tier, system_capacity_kW);
+
+CREATE TABLE pincode_cache (
+    pincode TEXT PRIMARY KEY,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    state TEXT,
+    is_valid INTEGER NOT NULL,  -- 0 = pincode does not exist (cached negative result)
+    updated_at DOUBLE PRECISION
+);
+
+CREATE TABLE pvwatts_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,   -- latitude snapped to the PVWatts cache grid
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,             -- PVWatts parameter set, e.g. 'array_type=1&azimuth=180&...'
+    ac_monthly TEXT NOT NULL,             -- JSON list of 12 monthly kWh values per kW
+    solrad_annual DOUBLE PRECISION NOT NULL,
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+);
+
+CREATE TABLE pvwatts_hourly_cache (
+    lat_cell DOUBLE PRECISION NOT NULL,   -- same grid and parameter set as pvwatts_cache
+    lon_cell DOUBLE PRECISION NOT NULL,
+    params_key TEXT NOT NULL,
+    ac_hourly TEXT NOT NULL,              -- base64 of 8760 little-endian float32 kWh values per kW
+    fetched_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell, params_key)
+);
+
+CREATE TABLE sessions (
+    phone TEXT PRIMARY KEY,
+    data TEXT NOT NULL,                   -- compact JSON conversation state
+    version INTEGER NOT NULL,             -- bumped on every save (compare-and-set)
+    expires_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE TABLE reference_data_versions (
+    version TEXT NOT NULL,                -- content hash of tariffs, multipliers and installation_costs
+    loaded_at DOUBLE PRECISION NOT NULL,
+    source TEXT,                          -- directory the CSVs were loaded from (reference_loader.py)
+    tariff_rows INTEGER NOT NULL,
+    multiplier_rows INTEGER NOT NULL,
+    cost_rows INTEGER NOT NULL
+);
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Conversation state storage shared by all gunicorn workers.
+
+Each phone number has one session: the JSON-serialized conversation state plus
+a version number. save() is a compare-and-set on that version, so two workers
+handling messages from the same phone cannot both advance the same step; the
+loser gets SessionConflict and re-runs the step against the new state.
+
+The backend is picked by SESSION_STORE_URL:
+- unset or 'database': the sessions table in DATABASE_URL (SQLite or Postgres)
+- 'redis://host:port/db': a Redis-protocol server (needs the redis package)
+- 'memory': a per-process dict, only suitable for a single worker
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', '86400'))
+
+
+class SessionConflict(Exception):
+    """Raised when a session was changed by another request since it was loaded."""
+
+
+def new_session():
+    return {'step': 0}
+
+
+def dumps(state):
+    # Compact separators keep the stored payload small
+    return json.dumps(state, separators=(',', ':'))
+
+
+def loads(data):
+    return json.loads(data)
+
+
+class MemorySessionStore:
+    """Process-local store; conversations do not survive restarts or span workers."""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {}  # phone -> (data, version, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, phone):
+        with self._lock:
+            entry = self._sessions.get(phone)
+        if entry is None or entry[2] < time.time():
+            return new_session(), 0
+        return loads(entry[0]), entry[1]
+
+    def save(self, phone, state, version):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(phone)
+            current = entry[1] if entry is not None and entry[2] >= now else 0
+            if current != version:
+                raise SessionConflict(phone)
+            self._sessions[phone] = (dumps(state), version + 1, now + self.ttl_seconds)
+        return version + 1
+
+    def delete(self, phone):
+        with self._lock:
+            self._sessions.pop(phone, None)
+
+
+class SQLSessionStore:
+    """
+    Sessions in the `sessions` table of the application database.
+
+    Parameters:
+    connect_db (callable): Returns a pooled DB-API connection (app.connect_db).
+    ttl_seconds (float): Idle time after which a conversation starts over.
+    """
+
+    CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        phone TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL
+    )
+    """
+
+    # Only an expired row may be replaced when starting a conversation from version 0
+    INSERT_QUERY = """
+    INSERT INTO sessions (phone, data, version, expires_at) VALUES (%s, %s, 1, %s)
+    ON CONFLICT (phone) DO UPDATE SET data = excluded.data, version = 1, expires_at = excluded.expires_at
+    WHERE sessions.expires_at < %s
+    """
+
+    UPDATE_QUERY = """
+    UPDATE sessions SET data = %s, version = version + 1, expires_at = %s
+    WHERE phone = %s AND version = %s AND expires_at >= %s
+    """
+
+    def __init__(self, connect_db, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self._connect_db = connect_db
+        self.ttl_seconds = ttl_seconds
+        self._table_ready = False
+
+    def _ensure_table(self, cursor):
+        if not self._table_ready:
+            cursor.execute(self.CREATE_TABLE_QUERY)
+            self._table_ready = True
+
+    def load(self, phone):
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute("SELECT data, version FROM sessions WHERE phone = %s AND expires_at >= %s", (phone, time.time()))
+            row = cursor.fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+        if row is None:
+            return new_session(), 0
+        return loads(row[0]), int(row[1])
+
+    def save(self, phone, state, version):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            if version == 0:
+                cursor.execute(self.INSERT_QUERY, (phone, dumps(state), expires_at, now))
+            else:
+                cursor.execute(self.UPDATE_QUERY, (dumps(state), expires_at, phone, version, now))
+            updated = cursor.rowcount
+            # Occasionally clear out abandoned conversations
+            if random.random() < 0.01:
+                cursor.execute("DELETE FROM sessions WHERE expires_at < %s", (now,))
+            conn.commit()
+        finally:
+            conn.close()
+        if updated != 1:
+            raise SessionConflict(phone)
+        return version + 1
+
+    def delete(self, phone):
+        conn = self._connect_db()
+        try:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute("DELETE FROM sessions WHERE phone = %s", (phone,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class RedisSessionStore:
+    """
+    Sessions in a Redis-protocol server (Redis, Valkey, KeyDB, ...).
+
+    Each session is one key holding {"v": version, "s": state}; save() uses
+    WATCH/MULTI so the version check and the write are atomic.
+    """
+
+    KEY_PREFIX = 'navyam:session:'
+
+    def __init__(self, url, ttl_seconds=DEFAULT_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_STORE_URL points at Redis but the 'redis' package is not installed")
+        self._redis = redis
+        self._client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, phone):
+        return f"{self.KEY_PREFIX}{phone}"
+
+    def load(self, phone):
+        data = self._client.get(self._key(phone))
+        if data is None:
+            return new_session(), 0
+        entry = loads(data)
+        return entry['s'], entry['v']
+
+    def save(self, phone, state, version):
+        key = self._key(phone)
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                data = pipe.get(key)
+                current = loads(data)['v'] if data is not None else 0
+                if current != version:
+                    raise SessionConflict(phone)
+                pipe.multi()
+                pipe.set(key, dumps({'v': version + 1, 's': state}), ex=int(self.ttl_seconds))
+                pipe.execute()
+            except self._redis.WatchError:
+                raise SessionConflict(phone)
+        return version + 1
+
+    def delete(self, phone):
+        self._client.delete(self._key(phone))
+
+
+def create_session_store(connect_db, url=None):
+    """Build the session store selected by SESSION_STORE_URL."""
+    url = url if url is not None else os.getenv('SESSION_STORE_URL', 'database')
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        logger.info("Using Redis session store")
+        return RedisSessionStore(url)
+    if url == 'memory':
+        logger.warning("Using in-memory session store; conversations will not be shared between workers")
+        return MemorySessionStore()
+    return SQLSessionStore(connect_db)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Precomputed per-kW PVWatts profiles for a lat/lon grid, served from a memory-mapped file.
+
+The build tool writes one compact binary file covering a bounding box on the
+same grid as pvwatts_cache.py. After a 64-byte header the file holds a
+little-endian float32 array of shape (nlat, nlon, 13): the 12 ac_monthly
+values per kW followed by solrad_annual. Cells without data are NaN.
+
+At request time get_solar_generation() in app.py reads the grid through
+numpy.memmap: lookups are a page-cache read with no parsing, and the pages
+are shared by every gunicorn worker on the host. Cells outside the grid (or
+NaN) fall back to the pvwatts_cache table and the live NREL API.
+
+    python solar_grid.py build -o solar_grid.bin --from-cache          # every cell already in pvwatts_cache
+    python solar_grid.py build -o solar_grid.bin --cells pincodes.csv  # lat,lon columns; fetches missing cells
+    python solar_grid.py info solar_grid.bin
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from pvwatts_cache import DEFAULT_GRID_STEP, grid_cell, params_key
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'NVSG'
+FORMAT_VERSION = 1
+VALUES_PER_CELL = 13  # 12 x ac_monthly + solrad_annual
+# magic, format version, lat_min, lon_min, step, nlat, nlon, params digest, built_at
+HEADER = struct.Struct('<4sIdddII16sd')
+HEADER_SIZE = 64
+
+# Bounding box used when building from a list of cells (mainland India plus islands)
+INDIA_BOUNDS = (6.0, 68.0, 37.5, 97.5)
+
+
+def params_digest(key=None):
+    """16-byte digest of the PVWatts parameter set the grid was built with."""
+    return hashlib.sha1((key or params_key()).encode('utf-8')).digest()[:16]
+
+
+class SolarGrid:
+    """
+    Read-only view of a grid file.
+
+    Parameters:
+    path (str): Path of a file written by write_grid().
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"{path} is not a solar grid file")
+        magic, version, self.lat_min, self.lon_min, self.step, self.nlat, self.nlon, self.digest, self.built_at = \
+            HEADER.unpack_from(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} solar grid file")
+        self.path = path
+        self.values = np.memmap(path, dtype='<f4', mode='r', offset=HEADER_SIZE,
+                                shape=(self.nlat, self.nlon, VALUES_PER_CELL))
+        self.hits = 0
+        self.misses = 0
+
+    def matches_params(self, key=None):
+        return self.digest == params_digest(key)
+
+    def lookup(self, lat, lon):
+        """Return (ac_monthly, solrad_annual) per kW for the cell containing lat/lon, or None."""
+        i = int(round((float(lat) - self.lat_min) / self.step))
+        j = int(round((float(lon) - self.lon_min) / self.step))
+        if 0 <= i < self.nlat and 0 <= j < self.nlon:
+            cell = self.values[i, j]
+            if not np.isnan(cell[VALUES_PER_CELL - 1]):
+                self.hits += 1
+                # Round away float32 noise (PVWatts reports far fewer significant digits)
+                return [round(value, 4) for value in cell[:12].tolist()], round(float(cell[12]), 4)
+        self.misses += 1
+        return None
+
+    def stats(self):
+        covered = int(np.count_nonzero(~np.isnan(self.values[:, :, VALUES_PER_CELL - 1])))
+        return {'path': self.path, 'cells': self.nlat * self.nlon, 'covered_cells': covered,
+                'hits': self.hits, 'misses': self.misses}
+
+
+def open_grid(path, step=DEFAULT_GRID_STEP):
+    """
+    Open the grid at path, or return None if it is missing or built with other PVWatts parameters.
+
+    A grid built at another step than the cache's (PVWATTS_GRID_STEP) is rejected too: its cells
+    would not line up with grid_cell(), so lookups would return another location's profile.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    grid = SolarGrid(path)
+    if not grid.matches_params():
+        logger.warning("Ignoring solar grid %s: built with different PVWatts parameters", path)
+        return None
+    if abs(grid.step - step) > 1e-9:
+        logger.error("Rejecting solar grid %s: built with a %s degree step but PVWATTS_GRID_STEP is %s; "
+                     "rebuild it with python solar_grid.py build", path, grid.step, step)
+        return None
+    logger.info("Serving solar profiles from %s (%d x %d cells)", path, grid.nlat, grid.nlon)
+    return grid
+
+
+def write_grid(path, profiles, step=DEFAULT_GRID_STEP, bounds=None):
+    """
+    Write a grid file from {(lat_cell, lon_cell): (ac_monthly, solrad_annual)}.
+
+    Parameters:
+    path (str): Output file; written to a temporary name and renamed into place.
+    profiles (dict): Per-kW profiles keyed by nearest grid point (grid_cell()).
+    step (float): Grid step in degrees (must match the cells' step).
+    bounds (tuple): (lat_min, lon_min, lat_max, lon_max); defaults to the extent of the profiles.
+
+    Returns:
+    int: Number of cells written.
+    """
+    if bounds is None:
+        if not profiles:
+            raise ValueError("No profiles to write")
+        lats = [lat for lat, _ in profiles]
+        lons = [lon for _, lon in profiles]
+        bounds = (min(lats), min(lons), max(lats), max(lons))
+    lat_min, lon_min = grid_cell(bounds[0], bounds[1], step)
+    lat_max, lon_max = grid_cell(bounds[2], bounds[3], step)
+    nlat = int(round((lat_max - lat_min) / step)) + 1
+    nlon = int(round((lon_max - lon_min) / step)) + 1
+
+    values = np.full((nlat, nlon, VALUES_PER_CELL), np.nan, dtype='<f4')
+    written = 0
+    for (lat, lon), (ac_monthly, solrad_annual) in profiles.items():
+        i = int(round((lat - lat_min) / step))
+        j = int(round((lon - lon_min) / step))
+        if 0 <= i < nlat and 0 <= j < nlon and len(ac_monthly) == 12:
+            values[i, j, :12] = ac_monthly
+            values[i, j, 12] = solrad_annual
+            written += 1
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, lat_min, lon_min, step, nlat, nlon, params_digest(), time.time())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(values.tobytes())
+    # Workers that already mapped the old file keep reading it until they reopen
+    os.replace(tmp_path, path)
+    return written
+
+
+def profiles_from_cache(connect_db, step=DEFAULT_GRID_STEP):
+    """All profiles in the pvwatts_cache table for the current parameter set, regardless of age."""
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT lat_cell, lon_cell, ac_monthly, solrad_annual FROM pvwatts_cache WHERE params_key = %s",
+                       (params_key(),))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return {grid_cell(lat, lon, step): (json.loads(ac_monthly), float(solrad_annual))
+            for lat, lon, ac_monthly, solrad_annual in rows}
+
+
+def read_cells(path, step=DEFAULT_GRID_STEP):
+    """Distinct grid cells for the lat,lon columns of a CSV file (e.g. the pincode warm file)."""
+    cells = set()
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                cells.add(grid_cell(float(row['lat']), float(row['lon']), step))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return sorted(cells)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed solar-resource grid.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Build a grid file")
+    build.add_argument('-o', '--output', default=os.getenv('SOLAR_GRID_PATH', 'solar_grid.bin'))
+    build.add_argument('--from-cache', action='store_true', help="Include every profile in the pvwatts_cache table")
+    build.add_argument('--cells', help="CSV with lat,lon columns; cells not yet cached are fetched from NREL")
+    build.add_argument('--fetch-delay', type=float, default=1.0, help="Seconds between NREL calls (rate limit)")
+    build.add_argument('--india-bounds', action='store_true', help="Size the grid to all of India, not just the data")
+    info = subparsers.add_parser('info', help="Describe a grid file")
+    info.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        grid = SolarGrid(args.path)
+        print(json.dumps(dict(grid.stats(), lat_min=grid.lat_min, lon_min=grid.lon_min, step=grid.step,
+                              nlat=grid.nlat, nlon=grid.nlon, matches_params=grid.matches_params(),
+                              built_at=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(grid.built_at))), indent=2))
+        return 0
+
+    if not args.from_cache and not args.cells:
+        parser.error("build needs --from-cache and/or --cells")
+
+    import app
+
+    step = app.pvwatts_cache.grid_step
+    profiles = profiles_from_cache(app.connect_db, step) if args.from_cache else {}
+    if args.cells:
+        missing = [cell for cell in read_cells(args.cells, step) if cell not in profiles]
+        logger.info("Fetching %d cells", len(missing))
+        for n, (lat_cell, lon_cell) in enumerate(missing, 1):
+            cached = app.pvwatts_cache.get(lat_cell, lon_cell)
+            if cached is None:
+                # get_solar_generation() stores the fetched profile in pvwatts_cache as well
+                cached = app.get_solar_generation(lat_cell, lon_cell)
+                time.sleep(args.fetch_delay)
+            if cached[0] is not None:
+                profiles[(lat_cell, lon_cell)] = cached
+            if n % 100 == 0:
+                logger.info("Fetched %d/%d cells", n, len(missing))
+
+    written = write_grid(args.output, profiles, step, INDIA_BOUNDS if args.india_bounds else None)
+    print(f"Wrote {written} cells to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Search over system sizes in half-kW steps for the best quote.
+
+The classic sizing in app.py floors the energy-based size and offers
+size-1, size and size+1 (1, 2 and 3 kW for small systems), all whole kW and
+priced only from exact installation_costs rows. The optimizer instead:
+
+- searches the sizes within OPTIMIZER_BAND_KW of the classic recommendation
+  (the floored energy-based size from calculate_system_size() in app.py, or
+  2 kW for systems of 1 kW or less) in OPTIMIZER_STEP_KW steps, so with the
+  default 1 kW band every classic option is a candidate and the optimizer
+  can only match or improve the classic ROI,
+- keeps to the grid from MIN_SIZE_KW up to the rooftop-area limit
+  (rooftop_area / SQ_FT_PER_KW, at most MAX_SYSTEM_SIZE_KW), evaluated with
+  one call to the vectorized evaluators in quote_engine.py or
+  hourly_simulation.py,
+- prices each size from a CostCurve: installation cost interpolated between
+  table rows, extended past the largest row at its last per-kW slope, minus
+  the subsidy (₹30,000 per kW up to 2 kW plus ₹18,000 per kW up to 3 kW, which
+  is the existing 30,000 / 60,000 / 78,000 at whole sizes),
+- picks the size by OPTIMIZER_OBJECTIVE: 'roi' maximizes the yearly ROI;
+  'payback' takes the largest size that pays back within
+  OPTIMIZER_MAX_PAYBACK_YEARS (the best ROI if none does),
+- offers three distinct sizes: the chosen one with its neighbours one kW
+  either side, shifted inwards at the ends of the grid (the choice and the
+  two sizes above it at the small end, the two below it at the large end).
+
+Rooftops that cannot hold MIN_SIZE_KW are rejected with a ValueError, and
+rooftops with room for fewer than three grid sizes are offered the three
+smallest, past the rooftop limit as the classic 1, 2 and 3 kW are. Energy-
+based sizes above MAX_SYSTEM_SIZE_KW are searched at the cap;
+size_cap_note() gives the message telling the user so.
+
+The band keeps the recommendation tied to the household's consumption. Over
+the whole rooftop range the ROI peaks at 3 kW, where the subsidy stops
+growing, whatever the bill, so an unbounded ROI search would size every
+household at 3 kW.
+
+Cost curves are built once per reference data version and location tier
+(ReferenceDataCache.cost_curve_for_tier), and whole quotes are memoized by
+quote_cache.py, so a conversation costs one vectorized evaluation at most.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from quote_engine import MAX_SYSTEM_SIZE_KW, SQ_FT_PER_KW, candidate_sizes
+
+STEP_KW = float(os.getenv('OPTIMIZER_STEP_KW', '0.5'))
+MIN_SIZE_KW = float(os.getenv('OPTIMIZER_MIN_SIZE_KW', '1'))
+OBJECTIVE = os.getenv('OPTIMIZER_OBJECTIVE', 'roi')
+MAX_PAYBACK_YEARS = float(os.getenv('OPTIMIZER_MAX_PAYBACK_YEARS', '5'))
+BAND_KW = float(os.getenv('OPTIMIZER_BAND_KW', '1'))
+OBJECTIVES = ('roi', 'payback')
+
+# Central subsidy: (upper end of the band in kW, rupees per kW within the band)
+SUBSIDY_BANDS = ((2, 30000), (3, 18000))
+
+
+def subsidy_for_size(system_size):
+    """Subsidy in rupees for a (possibly fractional) system size."""
+    subsidy, lower = 0.0, 0
+    for upper, per_kw in SUBSIDY_BANDS:
+        subsidy += per_kw * max(0.0, min(system_size, upper) - lower)
+        lower = upper
+    return subsidy
+
+
+class CostCurve:
+    """
+    Installation cost as a function of system size for one location tier.
+
+    Parameters:
+    sizes (list): System sizes in kW that have a cost row.
+    costs (list): Overall installation cost for each size.
+    """
+
+    def __init__(self, sizes, costs):
+        order = np.argsort(sizes)
+        self.sizes = np.asarray(sizes, dtype=float)[order]
+        self.costs = np.asarray(costs, dtype=float)[order]
+        if len(self.sizes) >= 2:
+            self.slope = (self.costs[-1] - self.costs[-2]) / (self.sizes[-1] - self.sizes[-2])
+        else:
+            self.slope = self.costs[-1] / self.sizes[-1] if len(self.sizes) else 0.0
+
+    @classmethod
+    def from_installation_costs(cls, installation_costs, location_tier):
+        """Build from a {(location_tier, system_capacity_kW): overall_cost} mapping."""
+        rows = sorted((size, cost) for (tier, size), cost in installation_costs.items() if tier == location_tier)
+        return cls([size for size, _ in rows], [cost for _, cost in rows])
+
+    def __bool__(self):
+        return len(self.sizes) > 0
+
+    def overall_cost(self, system_size):
+        """Interpolated cost; the smallest row's cost below it and its last slope above the largest row."""
+        size = float(system_size)
+        if size > self.sizes[-1]:
+            return float(self.costs[-1] + self.slope * (size - self.sizes[-1]))
+        return float(np.interp(size, self.sizes, self.costs))
+
+    def final_cost(self, system_size):
+        """Cost after subsidy."""
+        return self.overall_cost(system_size) - subsidy_for_size(system_size)
+
+
+def candidate_grid(rooftop_area, step=STEP_KW, min_size=MIN_SIZE_KW, max_size=MAX_SYSTEM_SIZE_KW):
+    """
+    Sizes from min_size up to what the rooftop holds (at most max_size), in step kW (whole sizes as int).
+
+    At least three sizes are returned, past the rooftop limit if it holds fewer; a ValueError is
+    raised when the rooftop cannot hold min_size at all.
+    """
+    if rooftop_area / SQ_FT_PER_KW < min_size:
+        raise ValueError(f"Rooftop area of {rooftop_area} sq ft is too small; "
+                         f"at least {min_size * SQ_FT_PER_KW:g} sq ft is needed for a {min_size:g} kW system")
+    limit = min(max_size, rooftop_area / SQ_FT_PER_KW)
+    count = max(3, int(math.floor((limit - min_size) / step + 1e-9)) + 1)
+    sizes = min_size + step * np.arange(count)
+    return [int(size) if size == int(size) else size for size in sizes.tolist()]
+
+
+def search_band(target_size, band=BAND_KW):
+    """(low, high) sizes searched: band kW either side of the classic recommendation for target_size."""
+    centre = candidate_sizes(math.floor(target_size))[1]
+    return centre - band, centre + band
+
+
+def size_cap_note(target_size, max_size=MAX_SYSTEM_SIZE_KW):
+    """Message for the user when the energy-based size is above what is quoted here, else None."""
+    if target_size <= max_size:
+        return None
+    return (f"Your consumption needs around {target_size:.1f} kW; these options are capped at {max_size} kW. "
+            f"For a larger system please contact us on support@navyamhomes.com.\n")
+
+
+def choose(options, objective=OBJECTIVE, max_payback_years=MAX_PAYBACK_YEARS):
+    """Index of the option to recommend under the objective."""
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}; expected one of {OBJECTIVES}")
+    roi = np.array([option['roi'] for option in options])
+    best_roi = int(np.argmax(roi))
+    if objective == 'payback':
+        savings = np.array([option['yearly_savings'] for option in options])
+        costs = np.array([option['final_cost'] for option in options])
+        within = np.flatnonzero((savings > 0) & (costs <= savings * max_payback_years))
+        if len(within):
+            return int(within[-1])
+    return best_roi
+
+
+def offered_indices(count, best, spread):
+    """Three distinct indices into a grid of count sizes, including best and spread apart where the grid allows."""
+    for gap in range(min(spread, (count - 1) // 2), 0, -1):
+        # Centred on best, else best and the two above it, else the two below it and best
+        for first in (best - gap, best, best - 2 * gap):
+            if first >= 0 and first + 2 * gap < count:
+                return [first, first + gap, first + 2 * gap]
+    return list(range(count))
+
+
+def optimize(evaluate, rooftop_area, target_size, objective=OBJECTIVE, step=STEP_KW, band=BAND_KW):
+    """
+    Evaluate the sizes around the search band and pick the options to offer.
+
+    Parameters:
+    evaluate (callable): evaluate(system_sizes) -> (options, best_index), e.g. a partial of
+    quote_engine.evaluate_system_sizes priced with CostCurve.final_cost.
+    rooftop_area (float): Rooftop area in square feet.
+    target_size (float): Energy-based size in kW; the choice stays within search_band() of it.
+    objective (str): 'roi' or 'payback'.
+    step (float): Grid step in kW.
+    band (float): Search band either side of the classic recommendation in kW.
+
+    Returns:
+    (float, list, int): The chosen size, the three offered options (by size) and the index of
+    the choice in them.
+    """
+    grid = candidate_grid(rooftop_area, step)
+    spread = max(1, int(round(1 / step)))
+    # Evaluate the band plus room for the offered neighbours on either side
+    target_size = min(target_size, grid[-1])
+    low, high = search_band(target_size, band)
+    reach = 2 * spread * step
+    sizes = [size for size in grid if low - reach - 1e-9 <= size <= high + reach + 1e-9]
+    options, _ = evaluate(sizes)
+
+    eligible = [i for i, size in enumerate(sizes) if low - 1e-9 <= size <= high + 1e-9]
+    if not eligible:
+        eligible = [int(np.argmin(np.abs(np.asarray(sizes) - target_size)))]
+    best = eligible[choose([options[i] for i in eligible], objective)]
+    offered = offered_indices(len(sizes), best, spread)
+    return sizes[best], [options[i] for i in offered], offered.index(best)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Compiled, array-backed form of a state's slab tariffs.
+
+calculate_monthly_bill() and estimate_energy_consumption_with_max_bill() in
+app.py scan the list of slab dicts linearly for every month of every option.
+A TariffIndex is built once per state (see ReferenceDataCache.tariff_index_for_state)
+and answers both directions with a bisect:
+
+- units -> bill: the first slab (in tariff order) whose max_slab covers the
+  units, billed as units * variable + fixed; 0 beyond the last slab.
+- bill -> units: the first slab whose max_bill covers the bill (a missing
+  max_bill is the open-ended top slab), inverted in closed form as
+  int((bill - fixed) / variable); 0 if no slab covers the bill.
+
+Bisecting over the running maximum of max_slab / max_bill finds exactly the
+slab the linear scans pick, even if the rows are not perfectly sorted.
+The *_for_* methods take scalars; the plural methods take arrays of months.
+"""
+
+import math
+from bisect import bisect_left
+from itertools import accumulate
+
+import numpy as np
+
+
+class TariffIndex:
+    """
+    Breakpoints and rates for one state's slab tariffs.
+
+    Parameters:
+    tariffs (list): Slab dicts with min_slab, max_slab, fixed, variable and max_bill,
+    in the order the linear functions scan them.
+    """
+
+    __slots__ = ('tariffs', 'slab_breaks', 'bill_breaks', 'fixed', 'variable',
+                 '_slab_breaks_array', '_bill_breaks_array', '_fixed_array', '_variable_array')
+
+    def __init__(self, tariffs):
+        self.tariffs = list(tariffs)
+        self.slab_breaks = list(accumulate((float(slab['max_slab']) for slab in self.tariffs), max))
+        self.bill_breaks = list(accumulate(
+            (math.inf if slab['max_bill'] is None else float(slab['max_bill']) for slab in self.tariffs), max))
+        self.fixed = [float(slab['fixed']) for slab in self.tariffs]
+        self.variable = [float(slab['variable']) for slab in self.tariffs]
+
+        # NumPy copies with a trailing zero-rate slab for values beyond the last breakpoint
+        self._slab_breaks_array = np.array(self.slab_breaks, dtype=float)
+        self._bill_breaks_array = np.array(self.bill_breaks, dtype=float)
+        self._fixed_array = np.array(self.fixed + [0.0])
+        self._variable_array = np.array(self.variable + [0.0])
+
+    def __len__(self):
+        return len(self.tariffs)
+
+    def bill_for_units(self, units_consumed):
+        """Bill for a number of units (same result as calculate_monthly_bill)."""
+        i = bisect_left(self.slab_breaks, units_consumed)
+        if i == len(self.tariffs):
+            return 0
+        return units_consumed * self.variable[i] + self.fixed[i]
+
+    def units_for_bill(self, bill_amount):
+        """Units behind a bill amount (same result as estimate_energy_consumption_with_max_bill)."""
+        i = bisect_left(self.bill_breaks, bill_amount)
+        if i == len(self.tariffs):
+            return 0
+        return int((bill_amount - self.fixed[i]) / self.variable[i])
+
+    def slab_for_bill(self, bill_amount):
+        """The slab dict used to invert a bill amount, or None."""
+        i = bisect_left(self.bill_breaks, bill_amount)
+        return self.tariffs[i] if i < len(self.tariffs) else None
+
+    def bills_for_units(self, units):
+        """Vectorized bill_for_units for an array of any shape."""
+        units = np.asarray(units, dtype=float)
+        i = np.searchsorted(self._slab_breaks_array, units, side='left')
+        return units * self._variable_array[i] + self._fixed_array[i]
+
+    def units_for_bills(self, bills):
+        """Vectorized units_for_bill for an array of any shape (int64 result)."""
+        bills = np.asarray(bills, dtype=float)
+        i = np.searchsorted(self._bill_breaks_array, bills, side='left')
+        covered = i < len(self.tariffs)
+        # Pad the uncovered slab with rate 1 to avoid dividing by zero; those months are zeroed below
+        variable = np.where(covered, self._variable_array[i], 1.0)
+        units = np.trunc((bills - self._fixed_array[i]) / variable)
+        return np.where(covered, units, 0).astype(np.int64)
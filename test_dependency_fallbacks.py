@@ -0,0 +1,113 @@
+# Third-party APIs that answer with an error page instead of JSON must fall back like any other failed call
+import asyncio
+import logging
+from concurrent.futures import Future
+
+import httpx
+import pytest
+import requests
+
+import app
+import asgi_app
+import circuit_breaker
+import http_client
+from pincode_cache import PincodeInfo
+
+ERROR_PAGE = b'<html><body><h1>503 Service Temporarily Unavailable</h1></body></html>'
+PROFILE = ([100.0 + month for month in range(12)], 5.5)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = body
+
+    def json(self):
+        return httpx.Response(self.status_code, content=self.content).json()
+
+
+class FakeSession:
+    def __init__(self, status_code, body):
+        self.response = FakeResponse(status_code, body)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        return self.response
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+    monkeypatch.setattr(app, 'solar_grid', None)
+
+
+@pytest.fixture(params=[503, 200], ids=['503', '200'])
+def error_page(request, monkeypatch):
+    """Every requests call answers with an HTML page, as a 503 or with a 200 status."""
+    monkeypatch.setattr(http_client, 'get_session', lambda: FakeSession(request.param, ERROR_PAGE))
+    return request.param
+
+
+@pytest.fixture
+def async_error_page(error_page, monkeypatch):
+    transport = httpx.MockTransport(lambda request: httpx.Response(error_page, content=ERROR_PAGE))
+    monkeypatch.setattr(asgi_app, '_client', httpx.AsyncClient(transport=transport))
+
+
+def expired_profile(monkeypatch, lat_cell, lon_cell):
+    app.pvwatts_cache.put(lat_cell, lon_cell, *PROFILE)
+    monkeypatch.setattr(app.pvwatts_cache, 'ttl_seconds', -1)
+
+
+def test_nrel_error_page_serves_expired_profile(error_page, monkeypatch):
+    expired_profile(monkeypatch, 26.8, 75.8)
+    assert app.get_solar_generation(26.8, 75.8) == PROFILE
+    assert http_client.breaker_for('developer.nrel.gov').stats()['consecutive_failures'] == 1
+
+
+def test_hourly_error_page_returns_none(error_page):
+    assert app.get_hourly_generation(12.3, 45.6) is None
+
+
+def test_geocoding_error_page_borrows_nearby_pincode(error_page):
+    app.pincode_cache.put(PincodeInfo('302019', 26.9, 75.8, 'Rajasthan', True))
+    assert app.get_lat_lon_from_pincode('302018') == (None, None)
+    assert app.remember_pincode('302018', None, None, 'Rajasthan') == (26.9, 75.8, 'Rajasthan')
+
+
+def test_state_lookup_error_page_asks_to_retry(error_page):
+    state = app.get_state_from_pincode('302018')
+    assert state == "Error in get_state_from_pincode"
+    with pytest.raises(app.PincodeLookupUnavailable):
+        app.remember_pincode('302018', 26.9, 75.8, state)
+
+
+def test_async_lookups_fall_back_on_error_page(async_error_page, monkeypatch):
+    expired_profile(monkeypatch, 26.7, 75.7)
+
+    async def lookups():
+        return (await asgi_app.get_state_from_pincode('302018'), await asgi_app.get_lat_lon_from_pincode('302018'),
+                await asgi_app.get_solar_generation(26.7, 75.7))
+
+    assert asyncio.run(lookups()) == ("Error in get_state_from_pincode", (None, None), PROFILE)
+
+
+def test_step3_hourly_fetch_is_capped_and_falls_back(monkeypatch):
+    seen_timeouts = []
+
+    class SlowSession:
+        def request(self, method, url, timeout=None, **kwargs):
+            seen_timeouts.append(timeout)
+            raise requests.Timeout("read timed out")
+
+    monkeypatch.setattr(http_client, 'get_session', lambda: SlowSession())
+    monkeypatch.setattr(app, 'HOURLY_FETCH_DEADLINE_SECONDS', 0.5)
+    assert app.hourly_generation_for_quote([11.1, 22.2]) is None
+    assert seen_timeouts and max(seen_timeouts[0]) <= 0.5
+
+
+def test_failed_hourly_prefetch_is_logged(caplog):
+    future = Future()
+    future.set_exception(RuntimeError("database is locked"))
+    with caplog.at_level(logging.WARNING):
+        app._log_prefetch_failure(future)
+    assert "database is locked" in caplog.text
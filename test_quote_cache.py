@@ -0,0 +1,59 @@
+# Step-3 quotes served through quote_cache must match the user's exact inputs unless bill rounding is enabled
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from quote_cache import QuoteCache, normalize_bill
+
+
+@pytest.fixture
+def quoted(monkeypatch):
+    """Record the consumption build_quote() is called with, with no reference data or NREL access."""
+    calls = []
+
+    def build_quote(monthly_consumption, *args):
+        calls.append(list(monthly_consumption))
+        return 3, [{'system_size': 3}], 0
+
+    monkeypatch.setattr(app, 'build_quote', build_quote)
+    monkeypatch.setattr(app, 'reference_data', SimpleNamespace(get=lambda: SimpleNamespace(version='v1')))
+    monkeypatch.setattr(app, 'quote_cache', QuoteCache())
+    monkeypatch.setattr(app, 'SIMULATION_MODE', 'monthly')
+    return calls
+
+
+def conversation(recent_bill, monthly_consumption):
+    return {'state': 'Rajasthan', 'pincode': '302018', 'grid_cell': [26.8, 75.8], 'recent_bill_month': 'Jun',
+            'recent_bill': recent_bill, 'monthly_consumption': monthly_consumption, 'num_acs': 1,
+            'ac_monthly': [120.0] * 12, 'rooftop_area': 600.0}
+
+
+def test_normalize_bill_keeps_exact_bill_without_rounding():
+    assert normalize_bill(12040, rounding=0) == 12040.0
+    assert normalize_bill(12040, rounding=100) == 12000.0
+
+
+def test_quote_uses_step2_consumption_and_exact_bill_key(quoted, monkeypatch):
+    monkeypatch.setattr(app, 'normalize_bill', lambda bill: normalize_bill(bill, rounding=0))
+    app.quote_for_conversation(conversation(12040.0, [1500] * 12))
+    app.quote_for_conversation(conversation(12010.0, [1490] * 12))
+    app.quote_for_conversation(conversation(12040.0, [1500] * 12))
+
+    # Different bills are different keys, each quoted from its own step-2 consumption; the repeat is a hit
+    assert quoted == [[1500] * 12, [1490] * 12]
+    assert app.quote_cache.stats()['hits'] == 1
+
+
+def test_bill_rounding_quotes_from_rounded_bill(quoted, monkeypatch):
+    monkeypatch.setattr(app, 'normalize_bill', lambda bill: normalize_bill(bill, rounding=100))
+    monkeypatch.setattr(app, 'calculate_monthly_bills_for_year', lambda bill, *args: [bill] * 12)
+    monkeypatch.setattr(app, 'get_tariff_index_for_state', lambda state: None)
+    monkeypatch.setattr(app, 'calculate_monthly_consumption', lambda bills, tariffs: [bill / 10 for bill in bills])
+
+    app.quote_for_conversation(conversation(12040.0, [1500] * 12))
+    app.quote_for_conversation(conversation(12010.0, [1490] * 12))
+
+    # Both bills round to 12,000, so the quote is computed once from the rounded bill
+    assert quoted == [[1200.0] * 12]
+    assert app.quote_cache.stats()['hits'] == 1
@@ -0,0 +1,81 @@
+# Optimizer offers and the classic/optimizer pricing of sizes missing from installation_costs
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from system_optimizer import CostCurve, candidate_grid, offered_indices, optimize, size_cap_note
+
+
+def evaluate(system_sizes):
+    # ROI falls with size, as it does past the subsidy, so the choice sits at the bottom of the band
+    options = [{'system_size': size, 'roi': 30.0 - size, 'yearly_savings': 1.0, 'final_cost': 1.0}
+               for size in system_sizes]
+    return options, 0
+
+
+@pytest.mark.parametrize('count', [3, 4, 5, 9])
+def test_offered_indices_are_three_distinct_including_best(count):
+    for best in range(count):
+        offered = offered_indices(count, best, spread=2)
+        assert len(set(offered)) == 3 and best in offered
+        assert offered == sorted(offered) and all(0 <= i < count for i in offered)
+
+
+@pytest.mark.parametrize('rooftop_area, target_size', [
+    (120, 1.0), (200, 1.6), (300, 2.5), (600, 0.7), (1500, 4.5), (1500, 9.8), (3000, 30.0),
+])
+def test_optimize_always_offers_three_distinct_sizes(rooftop_area, target_size):
+    size, options, best_index = optimize(evaluate, rooftop_area, target_size, objective='roi')
+    sizes = [option['system_size'] for option in options]
+    assert len(set(sizes)) == 3 and sizes == sorted(sizes)
+    assert sizes[best_index] == size
+
+
+def test_optimize_searches_the_classic_options():
+    # Energy-based 4.5 kW: classic offers 3, 4 and 5 kW, and the optimizer may pick any of them
+    size, options, _ = optimize(evaluate, 1500, 4.5, objective='roi')
+    assert size == 3
+    assert [option['system_size'] for option in options] == [2, 3, 4]
+
+
+def test_candidate_grid_rejects_rooftop_without_room_for_min_size():
+    with pytest.raises(ValueError):
+        candidate_grid(0)
+    with pytest.raises(ValueError):
+        candidate_grid(100)
+    assert candidate_grid(120) == [1, 1.5, 2]
+
+
+def test_size_cap_note_only_above_max_size():
+    assert size_cap_note(15) is None
+    assert '15 kW' in size_cap_note(22.4)
+
+
+@pytest.fixture
+def costs(monkeypatch):
+    monkeypatch.setattr(app, 'reference_data', SimpleNamespace(
+        installation_cost=lambda tier, size: {1: 110000.0, 2: 164000.0}.get(size),
+        cost_curve_for_tier=lambda tier: CostCurve([1, 2], [110000.0, 164000.0])))
+
+
+def test_classic_pricing_keeps_max_cost_for_missing_sizes(costs):
+    assert app.calculate_cost_and_subsidy(2, 'Tier-1') == 164000.0 - 60000
+    assert app.calculate_cost_and_subsidy(12, 'Tier-1') == 1000000 - 78000
+
+
+def test_optimizer_pricing_interpolates_missing_sizes(costs):
+    assert app.calculate_cost_and_subsidy(1.5, 'Tier-1', interpolate=True) == 137000.0 - 45000
+    assert app.calculate_cost_and_subsidy(3, 'Tier-1', interpolate=True) == 218000.0 - 78000
+
+
+def test_step3_asks_again_for_rooftop_too_small():
+    user_state = {'step': 3, 'monthly_consumption': [300] * 12}
+    result = app.handle_conversation_step(user_state, '0')
+    assert result.http_code == 200 and 'at least 120 square feet' in result.response_text
+    assert user_state['step'] == 3
+
+
+def test_build_quote_rejects_rooftop_too_small():
+    with pytest.raises(ValueError):
+        app.build_quote([300] * 12, [120.0] * 12, 0, 'Rajasthan', '302018')
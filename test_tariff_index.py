@@ -0,0 +1,54 @@
+# The compiled TariffIndex must give the same answers as the linear slab scans in app.py,
+# for the scalar and the vectorized lookups
+import random
+
+import numpy as np
+import pytest
+
+from app import calculate_monthly_bill, estimate_energy_consumption_with_max_bill, calculate_monthly_consumption
+from tariff_index import TariffIndex
+
+DB_INIT_TARIFFS = [
+    {'min_slab': 1, 'max_slab': 50, 'fixed': 230.0, 'variable': 4.75, 'max_bill': 467.5},
+    {'min_slab': 51, 'max_slab': 150, 'fixed': 230.0, 'variable': 6.5, 'max_bill': 1205.0},
+    {'min_slab': 151, 'max_slab': 300, 'fixed': 275.0, 'variable': 7.35, 'max_bill': 2480.0},
+    {'min_slab': 301, 'max_slab': 500, 'fixed': 345.0, 'variable': 7.65, 'max_bill': 4170.0},
+    {'min_slab': 501, 'max_slab': 999999, 'fixed': 400.0, 'variable': 7.95, 'max_bill': None}
+]
+# Only finite slabs, so bills and units beyond the last slab fall back to 0
+CAPPED_TARIFFS = DB_INIT_TARIFFS[:4]
+# max_bill not increasing from one slab to the next, as in the older update_queries.py formula
+UNSORTED_TARIFFS = [dict(slab) for slab in DB_INIT_TARIFFS]
+UNSORTED_TARIFFS[1]['max_bill'] = 400.0
+
+TARIFF_SETS = pytest.mark.parametrize('slab_list', [DB_INIT_TARIFFS, CAPPED_TARIFFS, UNSORTED_TARIFFS],
+                                      ids=['db-init', 'capped', 'unsorted-max-bill'])
+
+rng = random.Random(42)
+UNITS_SAMPLES = list(range(0, 1200)) + [rng.uniform(0, 2000) for _ in range(2000)] + [50, 50.5, 150, 500, 999999, 1000000]
+BILL_SAMPLES = [rng.uniform(-100, 9000) for _ in range(5000)] + [467.5, 1205.0, 2480.0, 4170.0, 4170.01, 0, 230]
+
+
+@TARIFF_SETS
+def test_bill_for_units_matches_linear_scan(slab_list):
+    index = TariffIndex(slab_list)
+    for units in UNITS_SAMPLES:
+        assert index.bill_for_units(units) == calculate_monthly_bill(units, slab_list), units
+    assert np.array_equal(index.bills_for_units(UNITS_SAMPLES), [calculate_monthly_bill(u, slab_list) for u in UNITS_SAMPLES])
+
+
+@TARIFF_SETS
+def test_units_for_bill_matches_linear_scan(slab_list):
+    index = TariffIndex(slab_list)
+    for bill in BILL_SAMPLES:
+        expected_units, expected_slab = estimate_energy_consumption_with_max_bill(bill, slab_list)
+        assert index.units_for_bill(bill) == expected_units, bill
+        assert index.slab_for_bill(bill) == expected_slab, bill
+    expected = [estimate_energy_consumption_with_max_bill(b, slab_list)[0] for b in BILL_SAMPLES]
+    assert index.units_for_bills(BILL_SAMPLES).tolist() == expected
+
+
+@TARIFF_SETS
+def test_monthly_consumption_accepts_index_or_slab_list(slab_list):
+    bills = BILL_SAMPLES[:12]
+    assert calculate_monthly_consumption(bills, TariffIndex(slab_list)) == calculate_monthly_consumption(bills, slab_list)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Boot-time warm-up of the process-wide, read-only data.
+
+gunicorn runs with preload_app (see gunicorn.conf.py), so app.py is imported
+once in the master. The warm-up runs at the end of that import and loads the
+reference data snapshot, compiles every state's TariffIndex and loads any
+bundled pincode file. Forked workers then start with all of it in memory and
+share the pages copy-on-write. gunicorn.conf.py calls gc.freeze() before
+forking so the garbage collector does not touch (and copy) those pages.
+
+/health returns 503 until the warm-up has completed. If it fails in the
+master (e.g. the database is not up yet), the health check retries it in the
+worker.
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_IMPORT = os.getenv('WARMUP_ON_IMPORT', '1') == '1'
+BUNDLED_PINCODES_PATH = os.getenv('BUNDLED_PINCODES_PATH', 'pincodes.csv')
+
+
+class Warmup:
+    """
+    Runs named warm-up steps once and records readiness.
+
+    Parameters:
+    steps (list): (name, callable) pairs, run in order.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.ready = False
+        self.error = None
+        self.durations = {}
+        self.completed_at = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Run the steps unless done already; returns readiness. Never raises."""
+        if self.ready:
+            return True
+        # A concurrent caller is already warming up: report not ready rather than wait
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.ready:
+                return True
+            for name, step in self.steps:
+                started = time.monotonic()
+                step()
+                self.durations[name] = round(time.monotonic() - started, 4)
+            self.ready = True
+            self.error = None
+            self.completed_at = time.time()
+            logger.info("Warm-up completed in pid %s: %s", os.getpid(), self.durations)
+        except Exception as e:
+            self.error = f"{name}: {e}"
+            logger.error("Warm-up step %s failed: %s", name, e)
+        finally:
+            self._lock.release()
+        return self.ready
+
+    def status(self):
+        return {'ready': self.ready, 'error': self.error, 'durations': dict(self.durations),
+                'completed_at': self.completed_at}
+
+
+def warm_reference_data(reference_data):
+    """Load the reference snapshot and compile a TariffIndex for every state in it."""
+    snapshot = reference_data.get()
+    for state in snapshot.tariffs:
+        reference_data.tariff_index_for_state(state)
+
+
+def load_bundled_pincodes(pincode_cache, path=BUNDLED_PINCODES_PATH):
+    """Load a pincode,lat,lon,state file shipped with the image into the cache's read-only layer."""
+    from pincode_cache import read_pincode_file
+
+    if not path or not os.path.exists(path):
+        return 0
+    return pincode_cache.load_bundled(read_pincode_file(path))
+
+
+def release_db_connections():
+    """Close the pool's idle connections so no database socket is inherited by forked workers."""
+    from db_pool import get_pool
+
+    get_pool().close_all()